@@ -1,6 +1,12 @@
 create schema sch_reservas_hotel; 
 set search_path to sch_reservas_hotel;
 
+-- Necesaria para combinar id_habitacion (=) y rangos de fechas (&&) en un mismo índice GiST
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+-- Índices de trigramas para búsquedas de clientes por subcadena y por similitud
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Tabla de costos
 CREATE TABLE costos (
   id_costos SERIAL PRIMARY KEY,
@@ -153,20 +159,185 @@ CREATE INDEX idx_reserva_estado ON reserva(estado_reserva);
 -- Índice por habitación (útil para evitar overbooking y búsquedas por habitación)
 CREATE INDEX idx_reserva_id_habitacion ON reserva(id_habitacion);
 
+-- Índice por número de habitación (la carga masiva actualiza habitaciones por número)
+CREATE INDEX idx_habitacion_numero ON habitacion(numero);
+
+-- Índices de trigramas: ILIKE '%texto%' y búsqueda por similitud sin recorrer toda la tabla cliente
+CREATE INDEX idx_cliente_nombre_trgm ON cliente USING gin (nombre gin_trgm_ops);
+CREATE INDEX idx_cliente_correo_trgm ON cliente USING gin (correo gin_trgm_ops);
+CREATE INDEX idx_cliente_nacionalidad_trgm ON cliente USING gin (nacionalidad gin_trgm_ops);
+
+-- Índices por prefijo (autocompletado de nombre y correo, en minúsculas)
+CREATE INDEX idx_cliente_nombre_prefijo ON cliente (lower(nombre) text_pattern_ops);
+CREATE INDEX idx_cliente_correo_prefijo ON cliente (lower(correo) text_pattern_ops);
+
+-- Índices de pago por cada filtro de filtrar_pagos; con ID_pago al final, la página
+-- (ORDER BY id_pago LIMIT) se lee en orden del índice sin ordenar todo el resultado
+CREATE INDEX idx_pago_documento_identidad ON pago(documento_identidad, ID_pago);
+CREATE INDEX idx_pago_fecha ON pago(fecha_pago, ID_pago);
+CREATE INDEX idx_pago_metodo ON pago(metodo_pago, ID_pago);
+
+-- Índice de pago por reserva (ActualizarEstadoPago los cuenta, cancelar_reservacion los borra
+-- y la FK hacia reserva lo usa al eliminar reservas)
+CREATE INDEX idx_pago_id_reserva ON pago(ID_reserva);
+
+-- Índices de servicios por cliente (y FK hacia cliente) y por disponibilidad (filtrar_servicios)
+CREATE INDEX idx_servicios_documento_identidad ON servicios(documento_identidad);
+CREATE INDEX idx_servicios_disponibilidad ON servicios(disponibilidad, id_servicio);
+
+-- La fecha de salida siempre es posterior a la de entrada
+ALTER TABLE reserva
+ADD CONSTRAINT reserva_fechas_validas CHECK (fecha_salida > fecha_entrada);
+
+-- Una habitación no puede tener dos reservas activas que se solapen en [entrada, salida).
+-- El índice GiST que crea la restricción también es el que usa la búsqueda de disponibilidad.
+ALTER TABLE reserva
+ADD CONSTRAINT reserva_sin_solapamiento
+EXCLUDE USING gist (
+    id_habitacion WITH =,
+    daterange(fecha_entrada, fecha_salida, '[)') WITH &&
+) WHERE (estado_reserva <> 'Cancelada');
+
 -- Creación de una tabla para registrar eventos importantes sobre las reservaciones.
 -- Esto nos permitirá llevar trazabilidad de acciones como creación, cancelación, etc.
+-- Está particionada por mes (fecha_hora): las consultas por fecha solo leen los meses
+-- que tocan y los meses viejos se archivan separando su partición (archivar_bitacora).
 CREATE TABLE tabla_log_reservaciones (
-    id_log SERIAL PRIMARY KEY, 
+    id_log SERIAL, 
 
     id_reserva INT NOT NULL,   
 
     accion TEXT NOT NULL,      
 
-    fecha_hora TIMESTAMP DEFAULT CURRENT_TIMESTAMP, 
+    fecha_hora TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, 
     
     usuario TEXT,              
 
-    detalle JSONB              
+    detalle JSONB,
+
+    PRIMARY KEY (id_log, fecha_hora)
+) PARTITION BY RANGE (fecha_hora);
+
+-- Recibe las filas de meses que aún no tienen partición
+CREATE TABLE tabla_log_reservaciones_default PARTITION OF tabla_log_reservaciones DEFAULT;
+
+-- Historial de una reserva
+CREATE INDEX idx_log_id_reserva ON tabla_log_reservaciones (id_reserva);
+-- Eventos de un tipo en un rango de fechas
+CREATE INDEX idx_log_accion_fecha ON tabla_log_reservaciones (accion, fecha_hora);
+-- Consultas por rango de fechas dentro de un mes
+CREATE INDEX idx_log_fecha_hora ON tabla_log_reservaciones (fecha_hora);
+-- Restauración: último borrado de cada reserva, recorrido por id_reserva
+CREATE INDEX idx_log_eliminaciones ON tabla_log_reservaciones (id_reserva, fecha_hora DESC)
+WHERE accion = 'DELETE';
+
+-- Crea las particiones mensuales desde el mes actual hasta p_meses_adelante meses
+-- después. Si la partición por defecto ya recibió filas de un mes, se mueven a la
+-- partición nueva. Devuelve cuántas particiones creó. Cada proceso de la API la
+-- llama al arrancar: el candado hace que esperen turno en lugar de crear la misma
+-- partición a la vez.
+CREATE OR REPLACE FUNCTION crear_particiones_bitacora(p_meses_adelante INT DEFAULT 3)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_mes DATE;
+    v_siguiente DATE;
+    v_nombre TEXT;
+    v_creadas INT := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('crear_particiones_bitacora'));
+
+    FOR i IN 0..p_meses_adelante LOOP
+        v_mes := (date_trunc('month', CURRENT_DATE) + make_interval(months => i))::DATE;
+        v_siguiente := (v_mes + INTERVAL '1 month')::DATE;
+        v_nombre := 'tabla_log_reservaciones_' || to_char(v_mes, 'YYYY_MM');
+        CONTINUE WHEN to_regclass(v_nombre) IS NOT NULL;
+
+        EXECUTE format(
+            'CREATE TABLE %I (LIKE tabla_log_reservaciones INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+            v_nombre
+        );
+        EXECUTE format(
+            'WITH movidas AS (
+                 DELETE FROM tabla_log_reservaciones_default
+                 WHERE fecha_hora >= %L AND fecha_hora < %L
+                 RETURNING *
+             )
+             INSERT INTO %I SELECT * FROM movidas',
+            v_mes, v_siguiente, v_nombre
+        );
+        EXECUTE format(
+            'ALTER TABLE tabla_log_reservaciones ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+            v_nombre, v_mes, v_siguiente
+        );
+        v_creadas := v_creadas + 1;
+    END LOOP;
+    RETURN v_creadas;
+END;
+$$;
+
+-- Política de retención: las particiones mensuales que terminaron hace más de
+-- p_meses_retencion meses se separan de la bitácora y se mueven al esquema
+-- archivo_bitacora (o se eliminan si p_eliminar). Las reservas borradas en esos
+-- meses ya no se pueden restaurar desde la bitácora.
+CREATE OR REPLACE FUNCTION archivar_bitacora(
+    p_meses_retencion INT DEFAULT 24,
+    p_eliminar BOOLEAN DEFAULT FALSE
+)
+RETURNS TABLE (
+    particion TEXT,
+    filas BIGINT,
+    resultado TEXT
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_limite DATE := (date_trunc('month', CURRENT_DATE) - make_interval(months => p_meses_retencion))::DATE;
+    p RECORD;
+BEGIN
+    -- Mismo candado que crear_particiones_bitacora: los procesos de la API la llaman a la vez
+    PERFORM pg_advisory_xact_lock(hashtext('crear_particiones_bitacora'));
+    CREATE SCHEMA IF NOT EXISTS archivo_bitacora;
+    FOR p IN
+        SELECT c.relname::TEXT AS nombre, to_date(right(c.relname, 7), 'YYYY_MM') AS mes
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'tabla_log_reservaciones'::regclass
+          AND c.relname ~ '_[0-9]{4}_[0-9]{2}$'
+        ORDER BY 2
+    LOOP
+        CONTINUE WHEN (p.mes + INTERVAL '1 month')::DATE > v_limite;
+
+        particion := p.nombre;
+        EXECUTE format('SELECT count(*) FROM %I', p.nombre) INTO filas;
+        EXECUTE format('ALTER TABLE tabla_log_reservaciones DETACH PARTITION %I', p.nombre);
+        IF p_eliminar THEN
+            EXECUTE format('DROP TABLE %I', p.nombre);
+            resultado := 'eliminada';
+        ELSE
+            EXECUTE format('ALTER TABLE %I SET SCHEMA archivo_bitacora', p.nombre);
+            resultado := 'archivada';
+        END IF;
+        RETURN NEXT;
+    END LOOP;
+END;
+$$;
+
+SELECT crear_particiones_bitacora(3);
+
+-- Bandeja de salida de la bitácora. Los procedimientos escriben sus eventos aquí,
+-- dentro de la misma transacción que la reserva (si la transacción confirma, el
+-- evento queda guardado), y la API los pasa por lotes a tabla_log_reservaciones
+-- con vaciar_bitacora_pendiente(). Así la reserva no compite con los índices de
+-- la bitácora.
+CREATE TABLE bitacora_pendiente (
+    id BIGSERIAL PRIMARY KEY,
+    id_reserva INT NOT NULL,
+    accion TEXT NOT NULL,
+    fecha_hora TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    usuario TEXT,
+    detalle JSONB
 );
 
 
@@ -179,13 +350,145 @@ CREATE OR REPLACE PROCEDURE registrar_evento_reserva(
 LANGUAGE plpgsql
 AS $$
 BEGIN
-    INSERT INTO tabla_log_reservaciones (id_reserva, accion, usuario, detalle)
+    INSERT INTO bitacora_pendiente (id_reserva, accion, usuario, detalle)
     VALUES (p_id_reserva, p_accion, p_usuario, p_detalle);
 END;
 $$;
 
---Procedimiento para crear nueva reservación
-CREATE OR REPLACE PROCEDURE crear_reservacion(
+-- Pasa hasta p_lote eventos pendientes (todos si es NULL) a tabla_log_reservaciones
+-- en orden de llegada. SKIP LOCKED permite que varios procesos vacíen a la vez sin
+-- bloquearse ni mover el mismo evento dos veces. Devuelve cuántos movió.
+CREATE OR REPLACE FUNCTION vaciar_bitacora_pendiente(p_lote INT DEFAULT NULL)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_movidos INT;
+BEGIN
+    WITH lote AS (
+        SELECT b.id
+        FROM bitacora_pendiente b
+        ORDER BY b.id
+        LIMIT p_lote
+        FOR UPDATE SKIP LOCKED
+    ), movidos AS (
+        DELETE FROM bitacora_pendiente b
+        USING lote
+        WHERE b.id = lote.id
+        RETURNING b.id, b.id_reserva, b.accion, b.fecha_hora, b.usuario, b.detalle
+    )
+    INSERT INTO tabla_log_reservaciones (id_reserva, accion, fecha_hora, usuario, detalle)
+    SELECT m.id_reserva, m.accion, m.fecha_hora, m.usuario, m.detalle
+    FROM movidos m
+    ORDER BY m.id;
+
+    GET DIAGNOSTICS v_movidos = ROW_COUNT;
+    RETURN v_movidos;
+END;
+$$;
+
+--Habitaciones de un tipo libres para todo el rango [fecha_entrada, fecha_salida)
+CREATE OR REPLACE FUNCTION habitaciones_disponibles(
+    p_tipo VARCHAR,
+    p_fecha_entrada DATE,
+    p_fecha_salida DATE
+)
+RETURNS TABLE (
+    id_habitacion INT,
+    numero INT,
+    tipo VARCHAR,
+    disponibilidad VARCHAR,
+    descripcion TEXT,
+    caracteristicas TEXT,
+    precio_noche NUMERIC
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        h.id_habitacion,
+        h.numero,
+        h.tipo,
+        h.disponibilidad,
+        h.descripcion,
+        h.caracteristicas,
+        c.precio_noche
+    FROM habitacion h
+    JOIN costos c ON h.id_costos = c.id_costos
+    WHERE (p_tipo IS NULL OR h.tipo = p_tipo)
+      AND h.disponibilidad <> 'en mantenimiento'
+      -- Usa el índice GiST de reserva_sin_solapamiento
+      AND NOT EXISTS (
+          SELECT 1
+          FROM reserva r
+          WHERE r.id_habitacion = h.id_habitacion
+            AND r.estado_reserva <> 'Cancelada'
+            AND daterange(r.fecha_entrada, r.fecha_salida, '[)') && daterange(p_fecha_entrada, p_fecha_salida, '[)')
+      )
+    ORDER BY h.id_habitacion;
+END;
+$$;
+
+
+--Elige y bloquea una habitación libre para el rango de fechas
+CREATE OR REPLACE FUNCTION asignar_habitacion(
+    p_tipo VARCHAR,
+    p_fecha_entrada DATE,
+    p_fecha_salida DATE
+)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_id_habitacion INT;
+BEGIN
+    -- Solo se bloquea la fila de la habitación elegida. Con SKIP LOCKED dos reservas
+    -- concurrentes del mismo tipo toman habitaciones distintas en vez de esperarse.
+    -- Una habitación bloqueada por otra reserva puede estar libre en estas fechas, así
+    -- que si la primera pasada no encuentra nada se repite esperando los bloqueos.
+    SELECT h.id_habitacion INTO v_id_habitacion
+    FROM habitacion h
+    WHERE h.tipo = p_tipo
+      AND h.disponibilidad <> 'en mantenimiento'
+      AND NOT EXISTS (
+          SELECT 1
+          FROM reserva r
+          WHERE r.id_habitacion = h.id_habitacion
+            AND r.estado_reserva <> 'Cancelada'
+            AND daterange(r.fecha_entrada, r.fecha_salida, '[)') && daterange(p_fecha_entrada, p_fecha_salida, '[)')
+      )
+    ORDER BY h.id_habitacion
+    LIMIT 1
+    FOR UPDATE OF h SKIP LOCKED;
+
+    IF v_id_habitacion IS NULL THEN
+        -- Si la otra reserva ocupa las mismas fechas, la restricción
+        -- reserva_sin_solapamiento y el reintento de reservar_habitacion lo resuelven
+        SELECT h.id_habitacion INTO v_id_habitacion
+        FROM habitacion h
+        WHERE h.tipo = p_tipo
+          AND h.disponibilidad <> 'en mantenimiento'
+          AND NOT EXISTS (
+              SELECT 1
+              FROM reserva r
+              WHERE r.id_habitacion = h.id_habitacion
+                AND r.estado_reserva <> 'Cancelada'
+                AND daterange(r.fecha_entrada, r.fecha_salida, '[)') && daterange(p_fecha_entrada, p_fecha_salida, '[)')
+          )
+        ORDER BY h.id_habitacion
+        LIMIT 1
+        FOR UPDATE OF h;
+    END IF;
+
+    RETURN v_id_habitacion;
+END;
+$$;
+
+
+--Valida, asigna habitación e inserta una reserva (sin registrar en la bitácora).
+--La usan crear_reservacion y crear_reservaciones_lote.
+CREATE OR REPLACE FUNCTION reservar_habitacion(
     p_numero_huespedes INT,
     p_tipo_habitacion VARCHAR,
     p_id_politicas INT,
@@ -194,65 +497,143 @@ CREATE OR REPLACE PROCEDURE crear_reservacion(
     p_fecha_salida DATE,
     p_tipo_reserva VARCHAR,
     p_tipo_confirmacion VARCHAR,
-    p_solicitudes_especial TEXT DEFAULT NULL
+    p_solicitudes_especial TEXT,
+    OUT o_id_reserva INT,
+    OUT o_id_habitacion INT
 )
 LANGUAGE plpgsql
 AS $$
 DECLARE
-    v_id_habitacion INT;
-    v_id_reserva INT;
+    v_intentos INT := 0;
 BEGIN
-    -- Buscar una habitacion libre del tipo solicitado
-    SELECT id_habitacion INTO v_id_habitacion
-    FROM habitacion
-    WHERE tipo = p_tipo_habitacion
-      AND disponibilidad = 'libre'
-    LIMIT 1;
+    IF p_fecha_salida <= p_fecha_entrada THEN
+        RAISE EXCEPTION 'La fecha de salida (%) debe ser posterior a la de entrada (%)', p_fecha_salida, p_fecha_entrada;
+    END IF;
 
-    -- Si no hay habitaciones disponibles, lanzar error
-    IF v_id_habitacion IS NULL THEN
-        RAISE EXCEPTION 'No hay habitaciones disponibles de tipo %', p_tipo_habitacion;
+    LOOP
+        -- Buscar una habitacion del tipo solicitado libre en esas fechas
+        o_id_habitacion := asignar_habitacion(p_tipo_habitacion, p_fecha_entrada, p_fecha_salida);
+
+        -- Si no hay habitaciones disponibles, lanzar error
+        IF o_id_habitacion IS NULL THEN
+            RAISE EXCEPTION 'No hay habitaciones disponibles de tipo % del % al %',
+                p_tipo_habitacion, p_fecha_entrada, p_fecha_salida;
+        END IF;
+
+        BEGIN
+            -- Insertar la nueva reserva
+            INSERT INTO reserva(
+                numero_huespedes, 
+                solicitudes_especial,
+                tipo_reserva,
+                tipo_confirmacion,
+                fecha_entrada,
+                fecha_salida,
+                id_politicas, 
+                id_habitacion, 
+                documento_identidad
+            )
+            VALUES (
+                p_numero_huespedes, 
+                p_solicitudes_especial,
+                p_tipo_reserva,
+                p_tipo_confirmacion,
+                p_fecha_entrada,
+                p_fecha_salida,
+                p_id_politicas, 
+                o_id_habitacion, 
+                p_documento_identidad
+            )
+            RETURNING id_reserva INTO o_id_reserva;
+            EXIT;
+        EXCEPTION WHEN exclusion_violation THEN
+            -- Otra transacción confirmó una reserva en esa habitación entre la búsqueda
+            -- y el insert; se vuelve a buscar (la siguiente búsqueda ya la ve ocupada)
+            v_intentos := v_intentos + 1;
+            IF v_intentos >= 5 THEN
+                RAISE EXCEPTION 'No se pudo asignar una habitación de tipo % tras % intentos', p_tipo_habitacion, v_intentos;
+            END IF;
+        END;
+    END LOOP;
+
+    -- La habitación solo pasa a ocupada si la estadía ya comenzó
+    IF p_fecha_entrada <= CURRENT_DATE AND CURRENT_DATE < p_fecha_salida THEN
+        UPDATE habitacion
+        SET disponibilidad = 'ocupada'
+        WHERE id_habitacion = o_id_habitacion;
     END IF;
+END;
+$$;
 
-    -- Insertar la nueva reserva
-    INSERT INTO reserva(
-        numero_huespedes, 
-        solicitudes_especial,
-        tipo_reserva,
-        tipo_confirmacion,
-        fecha_entrada,
-        fecha_salida,
-        id_politicas, 
-        id_habitacion, 
-        documento_identidad
-    )
-    VALUES (
-        p_numero_huespedes, 
-        p_solicitudes_especial,
-        p_tipo_reserva,
-        p_tipo_confirmacion,
-        p_fecha_entrada,
-        p_fecha_salida,
-        p_id_politicas, 
-        v_id_habitacion, 
-        p_documento_identidad
+
+--Aviso por NOTIFY en el canal 'habitaciones' con el estado actual de una habitación
+--(lo reparte notificaciones.py a los clientes de GET /habitaciones/eventos). NOTIFY
+--se entrega al confirmar la transacción, así que un aviso nunca anuncia algo que se
+--deshizo. El id sale de una secuencia para que todos los procesos de la API numeren
+--igual cada aviso. El precio y las fechas de la reserva permiten que cada proceso
+--actualice su calendario y su tabla de tarifas sin volver a consultar.
+CREATE SEQUENCE seq_aviso_habitacion;
+
+CREATE OR REPLACE FUNCTION notificar_habitacion(
+    p_id_habitacion INT,
+    p_evento TEXT,
+    p_id_reserva INT DEFAULT NULL
+)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_notify('habitaciones', json_build_object(
+        'id', nextval('seq_aviso_habitacion'),
+        'evento', p_evento,
+        'id_habitacion', h.id_habitacion,
+        'numero', h.numero,
+        'tipo', h.tipo,
+        'disponibilidad', h.disponibilidad,
+        'precio_noche', c.precio_noche,
+        'id_reserva', p_id_reserva,
+        'fecha_entrada', r.fecha_entrada,
+        'fecha_salida', r.fecha_salida,
+        'estado_reserva', r.estado_reserva
+    )::TEXT)
+    FROM habitacion h
+    LEFT JOIN costos c ON c.id_costos = h.id_costos
+    LEFT JOIN reserva r ON r.id_reserva = p_id_reserva
+    WHERE h.id_habitacion = p_id_habitacion;
+END;
+$$;
+
+
+--Procedimiento para crear nueva reservación
+DROP PROCEDURE IF EXISTS crear_reservacion(INT, VARCHAR, INT, VARCHAR, DATE, DATE, VARCHAR, VARCHAR, TEXT);
+CREATE OR REPLACE PROCEDURE crear_reservacion(
+    p_numero_huespedes INT,
+    p_tipo_habitacion VARCHAR,
+    p_id_politicas INT,
+    p_documento_identidad VARCHAR,
+    p_fecha_entrada DATE,
+    p_fecha_salida DATE,
+    p_tipo_reserva VARCHAR,
+    p_tipo_confirmacion VARCHAR,
+    p_solicitudes_especial TEXT DEFAULT NULL,
+    INOUT p_id_reserva INT DEFAULT NULL,     -- salida: reserva creada
+    INOUT p_id_habitacion INT DEFAULT NULL   -- salida: habitación asignada
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    SELECT o_id_reserva, o_id_habitacion
+    INTO p_id_reserva, p_id_habitacion
+    FROM reservar_habitacion(
+        p_numero_huespedes, p_tipo_habitacion, p_id_politicas, p_documento_identidad,
+        p_fecha_entrada, p_fecha_salida, p_tipo_reserva, p_tipo_confirmacion, p_solicitudes_especial
     );
 
-    -- Marcar habitacion como ocupada
-    UPDATE habitacion
-    SET disponibilidad = 'ocupada'
-    WHERE id_habitacion = v_id_habitacion;
-
-    -- Obtener el ID de la reserva recién creada
-    SELECT id_reserva INTO v_id_reserva
-	FROM reserva
-	WHERE id_habitacion = v_id_habitacion
-	  AND documento_identidad = p_documento_identidad
-	ORDER BY id_reserva DESC
-	LIMIT 1;
+    PERFORM notificar_habitacion(p_id_habitacion, 'reserva', p_id_reserva);
+
     -- Registrar en la bitácora
     CALL registrar_evento_reserva(
-        v_id_reserva,
+        p_id_reserva,
         'creación de reserva',
         p_documento_identidad,
         jsonb_build_object(
@@ -264,13 +645,88 @@ BEGIN
         )
     );
 
-    RAISE NOTICE 'Reserva creada exitosamente en habitacion %', v_id_habitacion;
+    RAISE NOTICE 'Reserva creada exitosamente en habitacion %', p_id_habitacion;
+END;
+$$;
+
+
+--Creación de reservas en lote (grupos, corporativas, operadores turísticos).
+--Recibe un arreglo JSON de reservas; cada una se intenta por separado (un error no
+--detiene a las demás) y la bitácora se escribe con una sola inserción al final.
+CREATE OR REPLACE FUNCTION crear_reservaciones_lote(p_reservas JSONB)
+RETURNS TABLE (
+    indice INT,          -- posición de la reserva dentro del arreglo recibido
+    reserva_id INT,
+    habitacion_id INT,
+    error TEXT
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    r RECORD;
+    v_ids INT[] := '{}';
+    v_usuarios TEXT[] := '{}';
+    v_detalles JSONB[] := '{}';
+BEGIN
+    FOR r IN
+        SELECT (e.posicion - 1)::INT AS posicion, x.*
+        FROM jsonb_array_elements(p_reservas) WITH ORDINALITY AS e(item, posicion),
+             jsonb_to_record(e.item) AS x(
+                 indice INT,
+                 numero_huespedes INT,
+                 tipo_habitacion VARCHAR,
+                 id_politicas INT,
+                 documento_identidad VARCHAR,
+                 fecha_entrada DATE,
+                 fecha_salida DATE,
+                 tipo_reserva VARCHAR,
+                 tipo_confirmacion VARCHAR,
+                 solicitudes_especial TEXT
+             )
+    LOOP
+        indice := COALESCE(r.indice, r.posicion);
+        BEGIN
+            SELECT o_id_reserva, o_id_habitacion
+            INTO reserva_id, habitacion_id
+            FROM reservar_habitacion(
+                r.numero_huespedes, r.tipo_habitacion, r.id_politicas, r.documento_identidad,
+                r.fecha_entrada, r.fecha_salida, r.tipo_reserva, r.tipo_confirmacion, r.solicitudes_especial
+            );
+            error := NULL;
+            PERFORM notificar_habitacion(habitacion_id, 'reserva', reserva_id);
+
+            v_ids := v_ids || reserva_id;
+            v_usuarios := v_usuarios || r.documento_identidad::TEXT;
+            v_detalles := v_detalles || jsonb_build_object(
+                'tipo_reserva', r.tipo_reserva,
+                'tipo_confirmacion', r.tipo_confirmacion,
+                'fecha_entrada', r.fecha_entrada,
+                'fecha_salida', r.fecha_salida,
+                'solicitudes', r.solicitudes_especial
+            );
+        EXCEPTION WHEN OTHERS THEN
+            -- Solo se deshace esta reserva (el bloque es una subtransacción)
+            reserva_id := NULL;
+            habitacion_id := NULL;
+            error := SQLERRM;
+        END;
+        RETURN NEXT;
+    END LOOP;
+
+    -- Registrar en la bitácora todas las reservas creadas de una vez
+    INSERT INTO bitacora_pendiente (id_reserva, accion, usuario, detalle)
+    SELECT l.id_reserva, 'creación de reserva', l.usuario, l.detalle
+    FROM unnest(v_ids, v_usuarios, v_detalles) AS l(id_reserva, usuario, detalle);
 END;
 $$;
 
 
 --Procedimiento para cancerlar una reservacion
-CREATE OR REPLACE PROCEDURE cancelar_reservacion(p_id_reserva INT)
+DROP PROCEDURE IF EXISTS cancelar_reservacion(INT);
+CREATE OR REPLACE PROCEDURE cancelar_reservacion(
+    p_id_reserva INT,
+    INOUT p_id_habitacion INT DEFAULT NULL   -- salida: habitación de la reserva
+)
 LANGUAGE plpgsql
 AS $$
 DECLARE
@@ -293,11 +749,21 @@ BEGIN
     SET estado_reserva = 'Cancelada'
     WHERE ID_reserva = p_id_reserva;
 
-    -- Liberar la habitacion 
+    -- Liberar la habitacion si no hay otra estadía en curso en ella
     UPDATE habitacion
     SET disponibilidad = 'libre'
-    WHERE id_habitacion = v_id_habitacion;
+    WHERE id_habitacion = v_id_habitacion
+      AND disponibilidad = 'ocupada'
+      AND NOT EXISTS (
+          SELECT 1
+          FROM reserva r
+          WHERE r.id_habitacion = v_id_habitacion
+            AND r.estado_reserva <> 'Cancelada'
+            AND r.fecha_entrada <= CURRENT_DATE
+            AND CURRENT_DATE < r.fecha_salida
+      );
 
+    PERFORM notificar_habitacion(v_id_habitacion, 'cancelacion', p_id_reserva);
  
     RAISE NOTICE 'Reserva % cancelada.', p_id_reserva;
 	CALL registrar_evento_reserva(
@@ -309,6 +775,7 @@ BEGIN
         'habitacion_liberada', v_id_habitacion
     )
 );
+    p_id_habitacion := v_id_habitacion;
 END;
 $$;
 
@@ -350,72 +817,478 @@ END;
 $$;
 
 
+-- Se ejecuta una vez por sentencia DELETE: todas las filas borradas (tabla de
+-- transición eliminadas) se registran con una sola inserción
 CREATE OR REPLACE FUNCTION log_eliminacion_reserva()
 RETURNS TRIGGER AS $$
 BEGIN
-    INSERT INTO tabla_log_reservaciones (id_reserva, accion, usuario, detalle)
-    VALUES (
-        OLD.id_reserva,
-        'DELETE',
-        current_user,
-        to_jsonb(OLD)
-    );
-    RETURN OLD;
+    INSERT INTO bitacora_pendiente (id_reserva, accion, usuario, detalle)
+    SELECT e.id_reserva, 'DELETE', current_user, to_jsonb(e)
+    FROM eliminadas e;
+    RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
+DROP TRIGGER IF EXISTS trg_log_delete_reserva ON reserva;
 CREATE TRIGGER trg_log_delete_reserva
-BEFORE DELETE ON reserva
-FOR EACH ROW
+AFTER DELETE ON reserva
+REFERENCING OLD TABLE AS eliminadas
+FOR EACH STATEMENT
 EXECUTE FUNCTION log_eliminacion_reserva();
 
 
+-- Restaura en una sola sentencia las reservas borradas según la bitácora, tomando la
+-- última eliminación de cada una. Se omiten las que ya existen, las que ahora se
+-- solaparían con otra reserva activa (ON CONFLICT cubre la restricción de exclusión)
+-- y las cuya habitación, cliente o política ya no existe.
+-- p_despues/p_limite recorren las reservas por id para restaurar por tramos.
+CREATE OR REPLACE FUNCTION restaurar_reservas_lote(
+    p_id_reserva INT DEFAULT NULL,
+    p_despues INT DEFAULT NULL,
+    p_limite INT DEFAULT NULL
+)
+RETURNS TABLE (
+    procesadas INT,   -- reservas encontradas en la bitácora en este tramo
+    restauradas INT,
+    ultimo_id INT     -- valor para p_despues en el siguiente tramo
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    WITH eventos AS (
+        SELECT DISTINCT ON (l.id_reserva) l.id_reserva, l.detalle
+        FROM tabla_log_reservaciones l
+        WHERE l.accion = 'DELETE'
+          AND (p_id_reserva IS NULL OR l.id_reserva = p_id_reserva)
+          AND (p_despues IS NULL OR l.id_reserva > p_despues)
+        ORDER BY l.id_reserva, l.fecha_hora DESC
+        LIMIT p_limite
+    ), insertadas AS (
+        INSERT INTO reserva (
+            id_reserva, numero_huespedes, solicitudes_especial,
+            tipo_reserva, tipo_confirmacion, fecha_entrada,
+            fecha_salida, id_politicas, id_habitacion,
+            documento_identidad, estado_reserva
+        )
+        SELECT
+            r.id_reserva, r.numero_huespedes, r.solicitudes_especial,
+            r.tipo_reserva, r.tipo_confirmacion, r.fecha_entrada,
+            r.fecha_salida, r.id_politicas, r.id_habitacion,
+            r.documento_identidad, r.estado_reserva
+        FROM eventos e
+        CROSS JOIN LATERAL jsonb_populate_record(NULL::reserva, e.detalle) r
+        WHERE (r.id_habitacion IS NULL OR EXISTS (SELECT 1 FROM habitacion h WHERE h.id_habitacion = r.id_habitacion))
+          AND (r.documento_identidad IS NULL OR EXISTS (SELECT 1 FROM cliente c WHERE c.documento_identidad = r.documento_identidad))
+          AND (r.id_politicas IS NULL OR EXISTS (SELECT 1 FROM politicas_reserva p WHERE p.id_politicas = r.id_politicas))
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    )
+    SELECT
+        (SELECT count(*) FROM eventos)::INT,
+        (SELECT count(*) FROM insertadas)::INT,
+        (SELECT max(e.id_reserva) FROM eventos e);
+END;
+$$;
+
 CREATE OR REPLACE PROCEDURE restaurar_reservas_desde_bitacora(
     p_id_reserva INT DEFAULT NULL  -- Si no se indica, se restauran todas
 )
 LANGUAGE plpgsql
 AS $$
 DECLARE
-    r RECORD;
+    v_procesadas INT;
+    v_restauradas INT;
+    v_ultimo INT;
 BEGIN
-    FOR r IN
-        SELECT * 
-        FROM tabla_log_reservaciones
-        WHERE accion = 'DELETE'
-          AND (p_id_reserva IS NULL OR id_reserva = p_id_reserva)
-        ORDER BY fecha_hora
-    LOOP
-        -- Verificar que la reserva no exista antes de insertarla
-        IF NOT EXISTS (
-            SELECT 1 FROM reserva WHERE id_reserva = (r.detalle->>'id_reserva')::INT
-        ) THEN
-            INSERT INTO reserva (
-                id_reserva, numero_huespedes, solicitudes_especial,
-                tipo_reserva, tipo_confirmacion, fecha_entrada,
-                fecha_salida, id_politicas, id_habitacion,
-                documento_identidad, estado_reserva
-            )
-            SELECT
-                (r.detalle->>'id_reserva')::INT,
-                (r.detalle->>'numero_huespedes')::INT,
-                r.detalle->>'solicitudes_especial',
-                r.detalle->>'tipo_reserva',
-                r.detalle->>'tipo_confirmacion',
-                (r.detalle->>'fecha_entrada')::DATE,
-                (r.detalle->>'fecha_salida')::DATE,
-                (r.detalle->>'id_politicas')::INT,
-                (r.detalle->>'id_habitacion')::INT,
-                r.detalle->>'documento_identidad',
-                r.detalle->>'estado_reserva';
-                
-            RAISE NOTICE 'Reserva % restaurada.', (r.detalle->>'id_reserva')::INT;
-        ELSE
-            RAISE NOTICE 'Reserva % ya existe. No se restauró.', (r.detalle->>'id_reserva')::INT;
-        END IF;
+    -- Los eventos aún en la bandeja de salida también deben poder restaurarse
+    PERFORM vaciar_bitacora_pendiente(NULL);
+
+    SELECT * INTO v_procesadas, v_restauradas, v_ultimo
+    FROM restaurar_reservas_lote(p_id_reserva);
+
+    RAISE NOTICE 'Reservas restauradas: % de % encontradas en la bitácora.', v_restauradas, v_procesadas;
+END;
+$$;
+
+-- Reportes de ocupación, ingresos, pagos y cancelaciones. Las tablas reporte_* guardan
+-- los agregados ya calculados y las consultas de reportes solo leen de ellas. Los
+-- triggers no tocan los agregados: anotan en reporte_pendiente qué meses cambiaron y
+-- refrescar_reportes() recalcula esos meses completos desde las tablas base. Así una
+-- reserva no espera por las filas de agregados que comparten otras reservas del mismo
+-- día, y los agregados siguen cuadrando aunque cambien precios o tipos de habitación.
+CREATE TABLE reporte_ocupacion_diaria (
+    fecha DATE NOT NULL,
+    tipo VARCHAR(100) NOT NULL,
+    noches INT NOT NULL,              -- habitaciones ocupadas esa noche
+    ingreso NUMERIC(14,2) NOT NULL,   -- suma de costos.precio_noche de esas habitaciones
+    PRIMARY KEY (fecha, tipo)
+);
+
+CREATE TABLE reporte_pagos_diario (
+    fecha DATE NOT NULL,
+    metodo_pago VARCHAR(100) NOT NULL,
+    tipo_pago VARCHAR(100) NOT NULL,
+    pagos INT NOT NULL,
+    monto NUMERIC(14,2) NOT NULL,     -- noches de la reserva pagada por precio_noche
+    reembolsos BIGINT NOT NULL,
+    PRIMARY KEY (fecha, metodo_pago, tipo_pago)
+);
+
+CREATE TABLE reporte_cancelaciones_mensual (
+    mes DATE NOT NULL,                -- mes de la fecha de entrada de la reserva
+    tipo VARCHAR(100) NOT NULL,
+    cancelaciones INT NOT NULL,
+    noches INT NOT NULL,
+    ingreso_perdido NUMERIC(14,2) NOT NULL,
+    PRIMARY KEY (mes, tipo)
+);
+
+-- Meses por recalcular. Sin llave única: dos reservas del mismo mes no se bloquean
+-- entre sí al anotarlo y los repetidos se descartan al refrescar.
+CREATE TABLE reporte_pendiente (
+    id BIGSERIAL PRIMARY KEY,
+    reporte TEXT NOT NULL CHECK (reporte IN ('ocupacion', 'pagos', 'cancelaciones')),
+    mes DATE NOT NULL
+);
+
+-- Meses de los reportes a los que aporta una reserva: los de sus noches si está
+-- activa, o el de su entrada si está cancelada
+CREATE OR REPLACE FUNCTION meses_reporte_reserva(p_entrada DATE, p_salida DATE, p_estado VARCHAR)
+RETURNS TABLE (reporte TEXT, mes DATE)
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT 'cancelaciones', date_trunc('month', p_entrada::TIMESTAMP)::DATE
+    WHERE p_estado = 'Cancelada'
+    UNION ALL
+    SELECT 'ocupacion', m::DATE
+    FROM generate_series(
+        date_trunc('month', p_entrada::TIMESTAMP),
+        date_trunc('month', (p_salida - 1)::TIMESTAMP),
+        INTERVAL '1 month'
+    ) AS m
+    WHERE p_estado <> 'Cancelada';
+$$;
+
+-- Todos los meses de las reservas y pagos de unas habitaciones (cambio de tipo o precio)
+CREATE OR REPLACE FUNCTION marcar_meses_habitaciones(p_habitaciones INT[])
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO reporte_pendiente (reporte, mes)
+    SELECT m.reporte, m.mes
+    FROM reserva r, meses_reporte_reserva(r.fecha_entrada, r.fecha_salida, r.estado_reserva) m
+    WHERE r.id_habitacion = ANY (p_habitaciones)
+    UNION
+    SELECT 'pagos', date_trunc('month', p.fecha_pago::TIMESTAMP)::DATE
+    FROM pago p
+    JOIN reserva r ON r.id_reserva = p.id_reserva
+    WHERE r.id_habitacion = ANY (p_habitaciones)
+      AND p.fecha_pago IS NOT NULL;
+$$;
+
+-- Triggers por sentencia: una carga de miles de reservas anota cada mes una sola vez
+CREATE OR REPLACE FUNCTION marcar_reporte_reservas()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO reporte_pendiente (reporte, mes)
+        SELECT DISTINCT m.reporte, m.mes
+        FROM nuevas r, meses_reporte_reserva(r.fecha_entrada, r.fecha_salida, r.estado_reserva) m;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO reporte_pendiente (reporte, mes)
+        SELECT DISTINCT m.reporte, m.mes
+        FROM viejas r, meses_reporte_reserva(r.fecha_entrada, r.fecha_salida, r.estado_reserva) m;
+    ELSE
+        -- Solo las reservas cuyo aporte cambió (pasar de Pendiente a Confirmada no
+        -- cambia nada), con sus meses de antes y de después y los de sus pagos
+        WITH cambiadas AS (
+            SELECT v.id_reserva,
+                   v.fecha_entrada AS entrada_antes, v.fecha_salida AS salida_antes,
+                   v.estado_reserva AS estado_antes,
+                   n.fecha_entrada, n.fecha_salida, n.estado_reserva
+            FROM viejas v
+            JOIN nuevas n ON n.id_reserva = v.id_reserva
+            WHERE (v.fecha_entrada, v.fecha_salida, v.id_habitacion, v.estado_reserva = 'Cancelada')
+                  IS DISTINCT FROM
+                  (n.fecha_entrada, n.fecha_salida, n.id_habitacion, n.estado_reserva = 'Cancelada')
+        )
+        INSERT INTO reporte_pendiente (reporte, mes)
+        SELECT m.reporte, m.mes
+        FROM cambiadas c, meses_reporte_reserva(c.entrada_antes, c.salida_antes, c.estado_antes) m
+        UNION
+        SELECT m.reporte, m.mes
+        FROM cambiadas c, meses_reporte_reserva(c.fecha_entrada, c.fecha_salida, c.estado_reserva) m
+        UNION
+        SELECT 'pagos', date_trunc('month', p.fecha_pago::TIMESTAMP)::DATE
+        FROM cambiadas c
+        JOIN pago p ON p.id_reserva = c.id_reserva
+        WHERE p.fecha_pago IS NOT NULL;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Un trigger con tablas de transición solo puede tener un evento
+CREATE TRIGGER trg_reporte_reserva_insert
+AFTER INSERT ON reserva
+REFERENCING NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION marcar_reporte_reservas();
+
+CREATE TRIGGER trg_reporte_reserva_update
+AFTER UPDATE ON reserva
+REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION marcar_reporte_reservas();
+
+CREATE TRIGGER trg_reporte_reserva_delete
+AFTER DELETE ON reserva
+REFERENCING OLD TABLE AS viejas
+FOR EACH STATEMENT
+EXECUTE FUNCTION marcar_reporte_reservas();
+
+CREATE OR REPLACE FUNCTION marcar_reporte_pagos()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO reporte_pendiente (reporte, mes)
+        SELECT DISTINCT 'pagos', date_trunc('month', p.fecha_pago::TIMESTAMP)::DATE
+        FROM nuevas p
+        WHERE p.fecha_pago IS NOT NULL;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO reporte_pendiente (reporte, mes)
+        SELECT DISTINCT 'pagos', date_trunc('month', p.fecha_pago::TIMESTAMP)::DATE
+        FROM viejas p
+        WHERE p.fecha_pago IS NOT NULL;
+    ELSE
+        WITH cambiadas AS (
+            SELECT v.fecha_pago AS fecha_antes, n.fecha_pago
+            FROM viejas v
+            JOIN nuevas n ON n.id_pago = v.id_pago
+            WHERE (v.fecha_pago, v.metodo_pago, v.tipo_pago, v.reembolso, v.id_reserva)
+                  IS DISTINCT FROM
+                  (n.fecha_pago, n.metodo_pago, n.tipo_pago, n.reembolso, n.id_reserva)
+        )
+        INSERT INTO reporte_pendiente (reporte, mes)
+        SELECT 'pagos', date_trunc('month', c.fecha_antes::TIMESTAMP)::DATE
+        FROM cambiadas c WHERE c.fecha_antes IS NOT NULL
+        UNION
+        SELECT 'pagos', date_trunc('month', c.fecha_pago::TIMESTAMP)::DATE
+        FROM cambiadas c WHERE c.fecha_pago IS NOT NULL;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_reporte_pago_insert
+AFTER INSERT ON pago
+REFERENCING NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION marcar_reporte_pagos();
+
+CREATE TRIGGER trg_reporte_pago_update
+AFTER UPDATE ON pago
+REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION marcar_reporte_pagos();
+
+CREATE TRIGGER trg_reporte_pago_delete
+AFTER DELETE ON pago
+REFERENCING OLD TABLE AS viejas
+FOR EACH STATEMENT
+EXECUTE FUNCTION marcar_reporte_pagos();
+
+-- Cambiar el tipo o el costo de una habitación, o el precio de un costo, cambia el
+-- aporte de todas sus reservas
+CREATE OR REPLACE FUNCTION marcar_reporte_habitaciones()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'costos' THEN
+        PERFORM marcar_meses_habitaciones(array_agg(h.id_habitacion))
+        FROM viejas v
+        JOIN nuevas n ON n.id_costos = v.id_costos
+        JOIN habitacion h ON h.id_costos = n.id_costos
+        WHERE v.precio_noche IS DISTINCT FROM n.precio_noche;
+    ELSE
+        PERFORM marcar_meses_habitaciones(array_agg(n.id_habitacion))
+        FROM viejas v
+        JOIN nuevas n ON n.id_habitacion = v.id_habitacion
+        WHERE (v.tipo, v.id_costos) IS DISTINCT FROM (n.tipo, n.id_costos);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_reporte_habitacion_update
+AFTER UPDATE ON habitacion
+REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION marcar_reporte_habitaciones();
+
+CREATE TRIGGER trg_reporte_costos_update
+AFTER UPDATE ON costos
+REFERENCING OLD TABLE AS viejas NEW TABLE AS nuevas
+FOR EACH STATEMENT
+EXECUTE FUNCTION marcar_reporte_habitaciones();
+
+-- Recalcula un mes completo de un reporte desde las tablas base
+CREATE OR REPLACE FUNCTION recalcular_reporte(p_reporte TEXT, p_mes DATE)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_fin DATE := (p_mes + INTERVAL '1 month')::DATE;
+BEGIN
+    IF p_reporte = 'ocupacion' THEN
+        DELETE FROM reporte_ocupacion_diaria WHERE fecha >= p_mes AND fecha < v_fin;
+        -- La condición sobre daterange y estado coincide con el índice de reserva_sin_solapamiento
+        INSERT INTO reporte_ocupacion_diaria (fecha, tipo, noches, ingreso)
+        SELECT n.noche, h.tipo, count(*), COALESCE(sum(c.precio_noche), 0)
+        FROM reserva r
+        JOIN habitacion h ON h.id_habitacion = r.id_habitacion
+        LEFT JOIN costos c ON c.id_costos = h.id_costos
+        CROSS JOIN LATERAL (
+            SELECT GREATEST(r.fecha_entrada, p_mes) + k AS noche
+            FROM generate_series(0, LEAST(r.fecha_salida, v_fin) - GREATEST(r.fecha_entrada, p_mes) - 1) AS k
+        ) n
+        WHERE r.estado_reserva <> 'Cancelada'
+          AND daterange(r.fecha_entrada, r.fecha_salida, '[)') && daterange(p_mes, v_fin, '[)')
+        GROUP BY n.noche, h.tipo;
+
+    ELSIF p_reporte = 'pagos' THEN
+        DELETE FROM reporte_pagos_diario WHERE fecha >= p_mes AND fecha < v_fin;
+        INSERT INTO reporte_pagos_diario (fecha, metodo_pago, tipo_pago, pagos, monto, reembolsos)
+        SELECT p.fecha_pago, p.metodo_pago, p.tipo_pago, count(*),
+               COALESCE(sum((r.fecha_salida - r.fecha_entrada) * c.precio_noche), 0),
+               COALESCE(sum(p.reembolso), 0)
+        FROM pago p
+        LEFT JOIN reserva r ON r.id_reserva = p.id_reserva
+        LEFT JOIN habitacion h ON h.id_habitacion = r.id_habitacion
+        LEFT JOIN costos c ON c.id_costos = h.id_costos
+        WHERE p.fecha_pago >= p_mes AND p.fecha_pago < v_fin
+        GROUP BY p.fecha_pago, p.metodo_pago, p.tipo_pago;
+
+    ELSE
+        DELETE FROM reporte_cancelaciones_mensual WHERE mes = p_mes;
+        INSERT INTO reporte_cancelaciones_mensual (mes, tipo, cancelaciones, noches, ingreso_perdido)
+        SELECT p_mes, h.tipo, count(*), sum(r.fecha_salida - r.fecha_entrada),
+               COALESCE(sum((r.fecha_salida - r.fecha_entrada) * c.precio_noche), 0)
+        FROM reserva r
+        JOIN habitacion h ON h.id_habitacion = r.id_habitacion
+        LEFT JOIN costos c ON c.id_costos = h.id_costos
+        WHERE r.estado_reserva = 'Cancelada'
+          AND r.fecha_entrada >= p_mes AND r.fecha_entrada < v_fin
+        GROUP BY h.tipo;
+    END IF;
+END;
+$$;
+
+-- Toma hasta p_lote anotaciones de reporte_pendiente (todas si es NULL) y recalcula
+-- cada mes distinto una vez. Como vaciar_bitacora_pendiente, varios procesos pueden
+-- refrescar a la vez (SKIP LOCKED); si dos tomaron el mismo mes, el candado consultivo
+-- hace que lo recalculen uno después del otro. Devuelve cuántos meses recalculó.
+CREATE OR REPLACE FUNCTION refrescar_reportes(p_lote INT DEFAULT NULL)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_reportes TEXT[];
+    v_meses DATE[];
+BEGIN
+    WITH lote AS (
+        SELECT p.id
+        FROM reporte_pendiente p
+        ORDER BY p.id
+        LIMIT p_lote
+        FOR UPDATE SKIP LOCKED
+    ), tomadas AS (
+        DELETE FROM reporte_pendiente p
+        USING lote
+        WHERE p.id = lote.id
+        RETURNING p.reporte, p.mes
+    )
+    -- Siempre en el mismo orden para que dos procesos no se esperen en círculo
+    SELECT array_agg(t.reporte ORDER BY t.reporte, t.mes), array_agg(t.mes ORDER BY t.reporte, t.mes)
+    INTO v_reportes, v_meses
+    FROM (SELECT DISTINCT reporte, mes FROM tomadas) t;
+
+    FOR i IN 1 .. COALESCE(array_length(v_reportes, 1), 0) LOOP
+        PERFORM pg_advisory_xact_lock(hashtext('reporte_' || v_reportes[i]), v_meses[i] - DATE '2000-01-01');
+        PERFORM recalcular_reporte(v_reportes[i], v_meses[i]);
     END LOOP;
+
+    RETURN COALESCE(array_length(v_reportes, 1), 0);
 END;
 $$;
 
+-- Borra los agregados y los recalcula todos (después de cargar datos sin triggers,
+-- por ejemplo con session_replication_role = replica). Devuelve los meses recalculados.
+CREATE OR REPLACE FUNCTION reconstruir_reportes()
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    TRUNCATE reporte_ocupacion_diaria, reporte_pagos_diario, reporte_cancelaciones_mensual, reporte_pendiente;
+
+    INSERT INTO reporte_pendiente (reporte, mes)
+    SELECT m.reporte, m.mes
+    FROM reserva r, meses_reporte_reserva(r.fecha_entrada, r.fecha_salida, r.estado_reserva) m
+    UNION
+    SELECT 'pagos', date_trunc('month', p.fecha_pago::TIMESTAMP)::DATE
+    FROM pago p
+    WHERE p.fecha_pago IS NOT NULL;
+
+    RETURN refrescar_reportes(NULL);
+END;
+$$;
+
+
+-- Respuestas de POST /reservaciones y POST /pagos por Idempotency-Key. La fila se
+-- inserta en la misma transacción que la operación: si la operación falla no queda
+-- nada guardado, y un reintento simultáneo con la misma clave espera en la llave
+-- primaria a que la primera termine y recibe su respuesta.
+CREATE TABLE solicitud_idempotente (
+    ruta TEXT NOT NULL,
+    clave TEXT NOT NULL,
+    huella TEXT NOT NULL,        -- sha256 del cuerpo de la petición
+    respuesta JSONB,
+    vence TIMESTAMP NOT NULL,
+    PRIMARY KEY (ruta, clave)
+);
+
+CREATE INDEX idx_solicitud_idempotente_vence ON solicitud_idempotente (vence);
+
+-- Reglas de tarifa que aplica tarifas.py sobre costos.precio_noche (temporada y
+-- promociones_especiales de costos quedan como texto descriptivo).
+-- Temporadas: multiplican el precio de las noches en [desde, hasta); si se superponen
+-- se multiplican entre sí. dias_semana (ISO, 1 = lunes) limita la regla a esos días.
+CREATE TABLE tarifa_temporada (
+    id_temporada SERIAL PRIMARY KEY,
+    nombre VARCHAR(100) NOT NULL,
+    tipo VARCHAR(100) CHECK (tipo IN ('sencilla', 'doble', 'suite')),  -- NULL: todos los tipos
+    desde DATE NOT NULL,
+    hasta DATE NOT NULL,
+    dias_semana SMALLINT[],
+    factor NUMERIC(6,4) NOT NULL CHECK (factor > 0),
+    CHECK (hasta > desde)
+);
+
+-- Promociones: descuento porcentual sobre las noches en [desde, hasta) de las estadías
+-- de al menos noches_minimas. Las que tienen codigo solo se aplican si la cotización lo
+-- incluye. No se acumulan: se aplica la de mayor descuento.
+CREATE TABLE tarifa_promocion (
+    id_promocion SERIAL PRIMARY KEY,
+    nombre VARCHAR(100) NOT NULL,
+    codigo VARCHAR(50) UNIQUE,
+    tipo VARCHAR(100) CHECK (tipo IN ('sencilla', 'doble', 'suite')),  -- NULL: todos los tipos
+    desde DATE NOT NULL,
+    hasta DATE NOT NULL,
+    noches_minimas INT NOT NULL DEFAULT 1 CHECK (noches_minimas >= 1),
+    descuento NUMERIC(5,2) NOT NULL CHECK (descuento > 0 AND descuento <= 100),
+    CHECK (hasta > desde)
+);
+
 --Datos Necesarios para una reserva
 
 INSERT INTO politicas_reserva (
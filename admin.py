@@ -0,0 +1,149 @@
+import asyncio
+import itertools
+import time
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import Optional
+from conexion_BD import get_db, conexion, error_http
+from calendario import calendario
+from tarifas import tarifas
+from cache import cache
+from bitacora import mantener_particiones, BITACORA_MESES_ADELANTE
+from reportes import actualizar
+from notificaciones import avisos
+
+router = APIRouter()
+
+# Restauraciones en curso o terminadas (se guardan las últimas)
+MAXIMO_TAREAS = 50
+_tareas = {}
+_en_curso = set()
+_ids = itertools.count(1)
+
+
+async def _restaurar(tarea, id_reserva, lote):
+    inicio = time.perf_counter()
+    try:
+        async with conexion() as db:
+            # Los borrados aún en la bandeja de salida también se restauran
+            await db.fetchone("SELECT vaciar_bitacora_pendiente(NULL);")
+            fila = await db.fetchone("""
+                SELECT count(DISTINCT id_reserva) AS total
+                FROM tabla_log_reservaciones
+                WHERE accion = 'DELETE' AND (%s::INT IS NULL OR id_reserva = %s);
+            """, (id_reserva, id_reserva))
+            tarea["total"] = fila["total"]
+
+            # Tramos de `lote` reservas, cada uno en su propia transacción
+            despues = None
+            while True:
+                r = await db.fetchone(
+                    "SELECT * FROM restaurar_reservas_lote(%s, %s, %s);",
+                    (id_reserva, despues, lote)
+                )
+                if not r["procesadas"]:
+                    break
+                tarea["procesadas"] += r["procesadas"]
+                tarea["restauradas"] += r["restauradas"]
+                tarea["omitidas"] = tarea["procesadas"] - tarea["restauradas"]
+                tarea["segundos"] = round(time.perf_counter() - inicio, 3)
+                despues = r["ultimo_id"]
+
+            if tarea["restauradas"]:
+                await calendario.construir(db)
+        if tarea["restauradas"]:
+            avisos.difundir(reconstruir=["calendario"])
+            await cache.invalidar("reservacion")
+        tarea["estado"] = "terminada"
+    except Exception as e:
+        tarea["estado"] = "error"
+        tarea["error"] = str(e)
+    finally:
+        tarea["segundos"] = round(time.perf_counter() - inicio, 3)
+
+
+def _progreso(tarea):
+    total = tarea["total"]
+    return {**tarea, "porcentaje": round(100 * tarea["procesadas"] / total, 1) if total else None}
+
+
+# Restaurar reservas borradas desde la bitácora. Se ejecuta en segundo plano;
+# el avance se consulta en GET /admin/bitacora/restauraciones/{id_tarea}
+@router.post("/admin/bitacora/restauraciones", status_code=202)
+async def restaurar_reservas(
+    id_reserva: Optional[int] = Query(None),
+    lote: int = Query(10000, ge=1, le=100000)
+):
+    id_tarea = next(_ids)
+    tarea = {
+        "id_tarea": id_tarea,
+        "estado": "en curso",
+        "id_reserva": id_reserva,
+        "total": None,
+        "procesadas": 0,
+        "restauradas": 0,
+        "omitidas": 0,
+        "segundos": 0,
+        "error": None,
+    }
+    _tareas[id_tarea] = tarea
+    while len(_tareas) > MAXIMO_TAREAS:
+        del _tareas[next(iter(_tareas))]
+    ejecucion = asyncio.create_task(_restaurar(tarea, id_reserva, lote))
+    _en_curso.add(ejecucion)
+    ejecucion.add_done_callback(_en_curso.discard)
+    return _progreso(tarea)
+
+
+@router.get("/admin/bitacora/restauraciones/{id_tarea}")
+async def obtener_restauracion(id_tarea: int):
+    tarea = _tareas.get(id_tarea)
+    if not tarea:
+        raise HTTPException(status_code=404, detail="Restauración no encontrada")
+    return _progreso(tarea)
+
+
+# Crear particiones mensuales por adelantado y aplicar la retención
+@router.post("/admin/bitacora/particiones")
+async def mantener_bitacora(
+    meses_adelante: int = Query(BITACORA_MESES_ADELANTE, ge=0, le=60),
+    retencion_meses: int = Query(0, ge=0),
+    eliminar: bool = Query(False),
+    db=Depends(get_db)
+):
+    try:
+        return await mantener_particiones(db, meses_adelante, retencion_meses, eliminar)
+    except Exception as e:
+        raise error_http(e)
+
+
+# Recalcular todos los agregados de reportes desde cero (después de cargar datos con
+# los triggers desactivados o si se sospecha que no cuadran)
+@router.post("/admin/reportes/reconstruccion")
+async def reconstruir_reportes(db=Depends(get_db)):
+    inicio = time.perf_counter()
+    try:
+        fila = await db.fetchone("SELECT reconstruir_reportes() AS meses;")
+        # Lo que se anotó mientras se reconstruía
+        meses = fila["meses"] + await actualizar(db)
+    except Exception as e:
+        raise error_http(e)
+    return {"meses_recalculados": meses, "segundos": round(time.perf_counter() - inicio, 3)}
+
+
+# Reconstruir la tabla de tarifas en memoria después de cambiar tarifa_temporada o
+# tarifa_promocion (los demás procesos la reconstruyen al recibir el aviso)
+@router.post("/admin/tarifas/reconstruccion")
+async def reconstruir_tarifas(db=Depends(get_db)):
+    inicio = time.perf_counter()
+    try:
+        await tarifas.construir(db)
+    except Exception as e:
+        raise error_http(e)
+    avisos.difundir(reconstruir=["tarifas"])
+    return {
+        "tipos": len(tarifas.acumulado),
+        "habitaciones": len(tarifas.precios),
+        "temporadas": len(tarifas.temporadas),
+        "promociones": len(tarifas.promociones),
+        "segundos": round(time.perf_counter() - inicio, 3),
+    }
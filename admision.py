@@ -0,0 +1,245 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import OrderedDict
+import metricas
+from conexion_BD import POOL_MAX, DB_REPLICAS
+from paginacion import a_bytes
+
+# Control de admisión: antes de llegar a las rutas, cada petición pasa por un límite
+# por cliente (token bucket) y por un cupo de peticiones simultáneas del proceso. Las
+# que no caben esperan turno por prioridad hasta un plazo; si el plazo vence o la cola
+# está llena se responde enseguida 429 o 503 con Retry-After, en lugar de dejar que
+# todas choquen con el pool y la base de datos.
+
+# Peticiones que se atienden a la vez en este proceso: por defecto las conexiones que
+# puede abrir (DB_POOL_MAX de la primaria y de cada réplica)
+ADMISION_CONCURRENCIA = int(os.getenv("ADMISION_CONCURRENCIA", str(POOL_MAX * (1 + len(DB_REPLICAS)))))
+# Peticiones que pueden esperar turno; con la cola llena se rechaza la de menor prioridad
+ADMISION_COLA = int(os.getenv("ADMISION_COLA", str(4 * ADMISION_CONCURRENCIA)))
+# Parte del cupo que las peticiones de baja prioridad no pueden ocupar
+ADMISION_RESERVA = float(os.getenv("ADMISION_RESERVA", "0.2"))
+# Límite por cliente: peticiones por segundo y ráfaga (ADMISION_TASA=0 lo desactiva)
+ADMISION_TASA = float(os.getenv("ADMISION_TASA", "20"))
+ADMISION_RAFAGA = float(os.getenv("ADMISION_RAFAGA", "40"))
+# Cabecera que identifica al cliente (p. ej. X-Forwarded-For detrás de un proxy); sin
+# ella se usa la IP de la conexión
+ADMISION_CLIENTE = os.getenv("ADMISION_CLIENTE", "").lower()
+# Clientes cuyo token bucket se recuerda (se olvidan los menos recientes)
+CLIENTES_MAX = 100000
+
+ALTA, NORMAL, BAJA = 0, 1, 2
+NOMBRES = ("alta", "normal", "baja")
+# Segundos que una petición puede esperar turno según su prioridad
+ADMISION_ESPERA = (
+    float(os.getenv("ADMISION_ESPERA_ALTA", "5")),
+    float(os.getenv("ADMISION_ESPERA_NORMAL", "2")),
+    float(os.getenv("ADMISION_ESPERA_BAJA", "0.5")),
+)
+
+# Sin control de admisión: sondas, métricas, documentación y el flujo de eventos (una
+# conexión larga que no usa la base de datos)
+EXENTAS = (
+    "/salud/", "/metrics", "/pool/metricas", "/cache/metricas", "/avisos/metricas",
+    "/bitacora/metricas", "/admision/metricas", "/habitaciones/eventos", "/docs", "/redoc",
+    "/openapi.json",
+)
+LISTADOS = {"/cliente", "/habitaciones", "/reservaciones", "/pagos", "/servicios"}
+
+ADMITIDA = "admitida"
+
+
+def prioridad(metodo, ruta):
+    # Reservas y pagos primero; listados, búsquedas, reportes, folios de la auditoría
+    # y cargas masivas al final. Las rutas se reconocen por su camino porque el
+    # middleware corre antes del enrutamiento
+    ruta = ruta.rstrip("/") or "/"
+    if ruta.endswith("/lote") or ruta.startswith("/reportes") or ruta == "/cliente/folios":
+        return BAJA
+    if metodo in ("POST", "PUT", "PATCH", "DELETE") and ruta.startswith(("/reservaciones", "/pagos")):
+        return ALTA
+    if metodo == "GET" and (ruta in LISTADOS or ruta == "/cliente/autocompletar"):
+        return BAJA
+    return NORMAL
+
+
+class Admision:
+    def __init__(self, concurrencia, cola, reserva):
+        self.concurrencia = max(concurrencia, 1)
+        self.cola = cola
+        # Las de baja prioridad solo entran si queda libre más que la reserva
+        self.limite_baja = max(self.concurrencia - int(self.concurrencia * reserva), 1)
+        self.en_curso = 0
+        self.esperando = 0
+        self._turnos = []  # heap de (prioridad, orden de llegada, futuro)
+        self._orden = itertools.count()
+        self._fichas = OrderedDict()  # cliente -> (fichas, momento)
+        self.duracion = 0.05  # promedio móvil de la duración de las peticiones admitidas
+        self.resultados = {}
+
+    def _cabe(self, prioridad):
+        return self.en_curso < (self.limite_baja if prioridad == BAJA else self.concurrencia)
+
+    def contar(self, prioridad, resultado):
+        clave = (NOMBRES[prioridad], resultado)
+        self.resultados[clave] = self.resultados.get(clave, 0) + 1
+        metricas.admision.inc(*clave)
+
+    def limite_cliente(self, cliente):
+        # Segundos hasta que el cliente tenga una ficha; 0 si puede pasar ya
+        if ADMISION_TASA <= 0:
+            return 0
+        ahora = time.monotonic()
+        fichas, momento = self._fichas.pop(cliente, (ADMISION_RAFAGA, ahora))
+        fichas = min(ADMISION_RAFAGA, fichas + (ahora - momento) * ADMISION_TASA)
+        espera = 0
+        if fichas >= 1:
+            fichas -= 1
+        else:
+            espera = (1 - fichas) / ADMISION_TASA
+        self._fichas[cliente] = (fichas, ahora)
+        while len(self._fichas) > CLIENTES_MAX:
+            self._fichas.popitem(last=False)
+        return espera
+
+    async def entrar(self, prioridad):
+        # Devuelve ADMITIDA o el motivo del rechazo
+        while self._turnos and self._turnos[0][2].done():
+            heapq.heappop(self._turnos)
+        if self._cabe(prioridad) and not (self._turnos and self._turnos[0][0] <= prioridad):
+            self.en_curso += 1
+            self.contar(prioridad, ADMITIDA)
+            return ADMITIDA
+        if self.esperando >= self.cola and not self._desalojar(prioridad):
+            self.contar(prioridad, "cola_llena")
+            return "cola_llena"
+
+        turno = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._turnos, (prioridad, next(self._orden), turno))
+        self.esperando += 1
+        self._repartir()
+        inicio = time.monotonic()
+        try:
+            await asyncio.wait({turno}, timeout=ADMISION_ESPERA[prioridad])
+        except BaseException:
+            # El cliente se desconectó mientras esperaba
+            if turno.done() and not turno.cancelled() and turno.result() == ADMITIDA:
+                self.en_curso -= 1
+                self._repartir()
+            turno.cancel()
+            raise
+        finally:
+            if not turno.done():
+                turno.cancel()
+                resultado = "vencida"
+            else:
+                resultado = "vencida" if turno.cancelled() else turno.result()
+            self.esperando -= 1
+        metricas.espera_admision.observar(time.monotonic() - inicio, NOMBRES[prioridad])
+        self.contar(prioridad, resultado)
+        return resultado
+
+    def _desalojar(self, prioridad):
+        # Con la cola llena una petición nueva reemplaza a la última en llegar de menor prioridad
+        peor = None
+        for entrada in self._turnos:
+            if entrada[2].done() or entrada[0] <= prioridad:
+                continue
+            if peor is None or (entrada[0], entrada[1]) > (peor[0], peor[1]):
+                peor = entrada
+        if peor is None:
+            return False
+        peor[2].set_result("desalojada")
+        return True
+
+    def salir(self, duracion):
+        self.en_curso -= 1
+        self.duracion += 0.05 * (duracion - self.duracion)
+        self._repartir()
+
+    def _repartir(self):
+        # Pasa el turno a las que esperan, de mayor prioridad y más antiguas primero
+        while self._turnos:
+            prioridad, _, turno = self._turnos[0]
+            if turno.done():
+                heapq.heappop(self._turnos)
+                continue
+            if not self._cabe(prioridad):
+                return
+            heapq.heappop(self._turnos)
+            self.en_curso += 1
+            turno.set_result(ADMITIDA)
+
+    def reintento(self):
+        # Segundos estimados hasta que se desocupe la cola
+        return min(max(math.ceil(self.duracion * (self.esperando + 1) / self.concurrencia), 1), 30)
+
+    def metricas(self):
+        return {
+            "concurrencia": self.concurrencia,
+            "limite_baja": self.limite_baja,
+            "cola": self.cola,
+            "en_curso": self.en_curso,
+            "esperando": self.esperando,
+            "duracion_promedio_s": round(self.duracion, 4),
+            "clientes": len(self._fichas),
+            "resultados": {f"{p}:{r}": n for (p, r), n in sorted(self.resultados.items())},
+        }
+
+
+admision = Admision(ADMISION_CONCURRENCIA, ADMISION_COLA, ADMISION_RESERVA)
+
+
+def _cliente(scope):
+    if ADMISION_CLIENTE:
+        for nombre, valor in scope.get("headers", ()):
+            if nombre.decode("latin-1") == ADMISION_CLIENTE:
+                return valor.decode("latin-1").split(",")[0].strip()
+    cliente = scope.get("client")
+    return cliente[0] if cliente else "desconocido"
+
+
+async def _rechazar(send, estado, detalle, segundos):
+    cuerpo = a_bytes({"detail": detalle})
+    await send({
+        "type": "http.response.start",
+        "status": estado,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(cuerpo)).encode()),
+            (b"retry-after", str(max(math.ceil(segundos), 1)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
+
+
+class ControlAdmision:
+    # Middleware ASGI; en menu_API.py va dentro de MedirPeticiones para que los
+    # rechazos también se cuenten en /metrics
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(EXENTAS):
+            await self.app(scope, receive, send)
+            return
+        nivel = prioridad(scope["method"], scope["path"])
+
+        espera = admision.limite_cliente(_cliente(scope))
+        if espera:
+            admision.contar(nivel, "limite_cliente")
+            await _rechazar(send, 429, "Demasiadas peticiones de este cliente", espera)
+            return
+
+        resultado = await admision.entrar(nivel)
+        if resultado != ADMITIDA:
+            await _rechazar(send, 503, "Servidor saturado, reintentar más tarde", admision.reintento())
+            return
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admision.salir(time.perf_counter() - inicio)
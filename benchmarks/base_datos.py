@@ -0,0 +1,173 @@
+"""Base de datos para las pruebas de rendimiento.
+
+Uso:
+    python -m benchmarks.base_datos --reemplazar --clientes 100000 --habitaciones 300 --anios 3
+
+Crea el esquema desde los dos scripts SQL del repositorio en la base de datos
+configurada por las variables DB_* (ver conexion_BD.py) y genera datos sintéticos:
+clientes, habitaciones con sus costos, `--anios` años de reservas hacia atrás y uno
+hacia adelante sin solapamientos, pagos de las reservas confirmadas y servicios.
+Con la misma semilla se generan los mismos datos.
+"""
+import argparse
+import os
+import time
+
+from conexion_BD import get_connection, DB_CONFIG, DB_SCHEMA
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = ("Script SQL completo P02.sql", "procedimientos adicionales API BDP02.sql")
+
+CLIENTES = """
+    INSERT INTO cliente (documento_identidad, nombre, nacionalidad, telefono, correo, fecha_nacimiento)
+    SELECT 'C' || lpad(i::text, 9, '0'),
+           (ARRAY['Maria','Jose','Juan','Ana','Luis','Carlos','Sofia','Fernanda','Diego','Lucia'])[1 + i %% 10]
+               || ' ' ||
+           (ARRAY['Garcia','Lopez','Martinez','Rodriguez','Hernandez','Perez','Gonzalez','Sanchez'])[1 + (i * 7) %% 8],
+           (ARRAY['Guatemala','México','El Salvador','Honduras','España'])[1 + i %% 5],
+           '5' || lpad((i %% 10000000)::text, 7, '0'),
+           'cliente' || i || '@ejemplo.com',
+           DATE '1950-01-01' + (i %% 20000)
+    FROM generate_series(1, %(clientes)s) AS i;
+
+    INSERT INTO documentos (copia_pasaporte, contratos, facturacion_electronica)
+    SELECT documento_identidad, 'contrato estándar', 'si' FROM cliente;
+"""
+
+HABITACIONES = """
+    INSERT INTO costos (temporada, promociones_especiales, precio_noche)
+    SELECT (ARRAY['alta','media','baja'])[1 + i %% 3], 'ninguna',
+           (ARRAY[350, 600, 1200])[1 + i %% 3] + (i %% 7) * 10
+    FROM generate_series(1, %(habitaciones)s) AS i;
+
+    INSERT INTO habitacion (numero, id_costos, id_evento, tipo, disponibilidad, descripcion, caracteristicas)
+    SELECT 100 + i, c.id_costos, (SELECT min(id_evento) FROM eventos),
+           (ARRAY['sencilla','doble','suite'])[1 + i %% 3], 'libre',
+           'Habitación ' || (100 + i), 'wifi, aire acondicionado'
+    FROM generate_series(1, %(habitaciones)s) AS i
+    JOIN (SELECT id_costos, row_number() OVER (ORDER BY id_costos) AS n FROM costos) c ON c.n = i;
+"""
+
+# Cada habitación se divide en bloques de 7 días; en cada bloque ocupado hay una
+# estadía de 1 a 5 noches que empieza el primer o segundo día, así nunca se solapan.
+RESERVAS = """
+    INSERT INTO reserva (
+        numero_huespedes, solicitudes_especial, tipo_reserva, tipo_confirmacion,
+        fecha_entrada, fecha_salida, id_politicas, id_habitacion, documento_identidad, estado_reserva
+    )
+    SELECT 1 + (random() * 1)::INT, NULL,
+           (ARRAY['individual','grupo','corporativa'])[1 + (random() * 2)::INT],
+           (ARRAY['correo','app','teléfono'])[1 + (random() * 2)::INT],
+           b.entrada, b.entrada + 1 + (random() * 4)::INT,
+           (SELECT min(id_politicas) FROM politicas_reserva),
+           h.id_habitacion,
+           'C' || lpad((1 + (random() * (%(clientes)s - 1))::INT)::text, 9, '0'),
+           CASE
+               WHEN b.entrada >= CURRENT_DATE THEN 'Pendiente'
+               WHEN random() < 0.05 THEN 'Cancelada'
+               ELSE 'Confirmada'
+           END
+    FROM habitacion h
+    CROSS JOIN LATERAL (
+        SELECT (CURRENT_DATE - %(dias_atras)s + k * 7 + (random() * 1)::INT) AS entrada
+        FROM generate_series(0, (%(dias_atras)s + 365) / 7 - 1) AS k
+        WHERE random() < %(ocupacion)s
+          AND h.id_habitacion IS NOT NULL  -- referencia a h: se evalúa por habitación
+    ) b;
+"""
+
+PAGOS = """
+    INSERT INTO pago (
+        tipo_pago, plataformas_integradas, metodo_pago, factura, recibo, reembolso,
+        cargos_extra, ID_reserva, documento_identidad, fecha_pago
+    )
+    SELECT (ARRAY['tarjeta de credito','debito','transferencia','efectivo','billeteras digitales'])[1 + (random() * 4)::INT],
+           'pos', (ARRAY['tarjeta','efectivo','transferencia'])[1 + (random() * 2)::INT],
+           'F-' || r.id_reserva, 'R-' || r.id_reserva, 0, 'ninguno',
+           r.id_reserva, r.documento_identidad, r.fecha_entrada - (random() * 30)::INT
+    FROM reserva r
+    WHERE r.estado_reserva = 'Confirmada';
+
+    INSERT INTO servicios (
+        documento_identidad, nombre, disponibilidad, horario, precio,
+        promociones, servicios_extra, ofertas_personalizadas
+    )
+    SELECT c.documento_identidad,
+           (ARRAY['spa','lavandería','room service','traslado'])[1 + (random() * 3)::INT],
+           random() < 0.8, TIME '08:00' + make_interval(hours => (random() * 12)::INT),
+           round((50 + random() * 450)::NUMERIC, 2), 'ninguna', 'ninguno', 'ninguna'
+    FROM cliente c
+    WHERE random() < %(servicios)s;
+"""
+
+
+def crear_esquema(conn, reemplazar):
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_namespace WHERE nspname = %s", (DB_SCHEMA,))
+        if cur.fetchone():
+            if not reemplazar:
+                raise SystemExit(
+                    f"El esquema {DB_SCHEMA} ya existe en {DB_CONFIG['dbname']}; usa --reemplazar para borrarlo"
+                )
+            cur.execute(f"DROP SCHEMA {DB_SCHEMA} CASCADE")
+        for script in SCRIPTS:
+            with open(os.path.join(RAIZ, script), encoding="utf-8") as f:
+                cur.execute(f.read())
+            print(f"  {script}")
+
+
+def generar_datos(conn, clientes, habitaciones, anios, ocupacion, servicios, semilla):
+    parametros = {
+        "clientes": clientes,
+        "habitaciones": habitaciones,
+        "dias_atras": anios * 365,
+        "ocupacion": ocupacion,
+        "servicios": servicios,
+    }
+    with conn.cursor() as cur:
+        cur.execute("SELECT setseed(%s)", (semilla,))
+        for nombre, sql in (("clientes", CLIENTES), ("habitaciones", HABITACIONES),
+                            ("reservas", RESERVAS), ("pagos y servicios", PAGOS)):
+            inicio = time.perf_counter()
+            cur.execute(sql, parametros)
+            print(f"  {nombre}: {time.perf_counter() - inicio:.1f} s")
+        inicio = time.perf_counter()
+        cur.execute("SELECT refrescar_reportes(NULL)")
+        print(f"  reportes ({cur.fetchone()[0]} meses): {time.perf_counter() - inicio:.1f} s")
+        cur.execute("ANALYZE")
+        cur.execute("""
+            SELECT (SELECT count(*) FROM cliente) AS clientes,
+                   (SELECT count(*) FROM habitacion) AS habitaciones,
+                   (SELECT count(*) FROM reserva) AS reservas,
+                   (SELECT count(*) FROM pago) AS pagos,
+                   (SELECT count(*) FROM servicios) AS servicios
+        """)
+        fila = cur.fetchone()
+        print("  " + "  ".join(f"{n}: {v}" for n, v in zip(
+            ("clientes", "habitaciones", "reservas", "pagos", "servicios"), fila)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reemplazar", action="store_true", help="borrar el esquema si ya existe")
+    parser.add_argument("--clientes", type=int, default=10000)
+    parser.add_argument("--habitaciones", type=int, default=100)
+    parser.add_argument("--anios", type=int, default=2, help="años de reservas hacia atrás")
+    parser.add_argument("--ocupacion", type=float, default=0.7, help="fracción de semanas con reserva")
+    parser.add_argument("--servicios", type=float, default=0.3, help="fracción de clientes con un servicio")
+    parser.add_argument("--semilla", type=float, default=0.42)
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        print(f"creando esquema {DB_SCHEMA} en {DB_CONFIG['dbname']}...")
+        crear_esquema(conn, args.reemplazar)
+        print("generando datos...")
+        generar_datos(conn, args.clientes, args.habitaciones, args.anios,
+                      args.ocupacion, args.servicios, args.semilla)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
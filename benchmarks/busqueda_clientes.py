@@ -0,0 +1,119 @@
+"""Latencia de la búsqueda de clientes con muchos registros.
+
+Uso:
+    python -m benchmarks.busqueda_clientes --generar 1000000
+    python -m benchmarks.busqueda_clientes --repeticiones 50 garcia lopez "maria fer" gmial
+    python -m benchmarks.busqueda_clientes --limpiar
+
+--generar inserta clientes sintéticos (documentos con prefijo BENCH) en la base de
+datos configurada en conexion_BD.py. Luego se mide, para cada término:
+
+  sin_indice      filtrar_clientes(nombre) con los índices desactivados en la sesión
+                  (equivale a la función antes de los índices de trigramas)
+  filtrar         filtrar_clientes(nombre) usando los índices de trigramas
+  buscar          buscar_clientes(texto) con relevancia y tolerancia a errores
+  autocompletar   autocompletar_clientes(prefijo)
+"""
+import argparse
+import statistics
+import time
+
+from conexion_BD import get_connection
+
+PREFIJO = "BENCH"
+
+GENERAR = """
+    INSERT INTO cliente (documento_identidad, nombre, nacionalidad, telefono, correo, fecha_nacimiento)
+    SELECT %(prefijo)s || lpad(i::text, 9, '0'),
+           n.nombre || ' ' || a1.apellido || ' ' || a2.apellido,
+           (ARRAY['Guatemala','México','El Salvador','Honduras','Costa Rica','España','Colombia'])[1 + i %% 7],
+           '5' || lpad((i %% 10000000)::text, 7, '0'),
+           lower(n.nombre || '.' || a1.apellido) || i || '@' ||
+               (ARRAY['gmail.com','hotmail.com','yahoo.com','outlook.com'])[1 + i %% 4],
+           DATE '1950-01-01' + (i %% 20000)
+    FROM generate_series(%(desde)s, %(hasta)s) AS i
+    JOIN LATERAL (SELECT (ARRAY['Maria','Jose','Juan','Ana','Luis','Carlos','Sofia','Fernanda',
+                                'Diego','Lucia','Pedro','Andrea','Jorge','Valeria','Miguel',
+                                'Camila','Ricardo','Daniela','Roberto','Gabriela'])[1 + (i * 7) %% 20] AS nombre) n ON true
+    JOIN LATERAL (SELECT (ARRAY['Garcia','Lopez','Martinez','Rodriguez','Hernandez','Perez','Gonzalez',
+                                'Sanchez','Ramirez','Cruz','Flores','Morales','Reyes','Jimenez',
+                                'Castillo','Ortiz','Mendoza','Ruiz','Alvarez','Romero'])[1 + (i * 13) %% 20] AS apellido) a1 ON true
+    JOIN LATERAL (SELECT (ARRAY['Garcia','Lopez','Martinez','Rodriguez','Hernandez','Perez','Gonzalez',
+                                'Sanchez','Ramirez','Cruz','Flores','Morales','Reyes','Jimenez',
+                                'Castillo','Ortiz','Mendoza','Ruiz','Alvarez','Romero'])[1 + (i * 17) %% 20] AS apellido) a2 ON true
+    ON CONFLICT (documento_identidad) DO NOTHING
+"""
+
+CONSULTAS = {
+    "sin_indice": "SELECT * FROM filtrar_clientes(%s, NULL, NULL, NULL, 100)",
+    "filtrar": "SELECT * FROM filtrar_clientes(%s, NULL, NULL, NULL, 100)",
+    "buscar": "SELECT * FROM buscar_clientes(%s, 20)",
+    "autocompletar": "SELECT * FROM autocompletar_clientes(%s, 10)",
+}
+
+
+def generar(conn, total, lote=100000):
+    with conn.cursor() as cur:
+        for desde in range(1, total + 1, lote):
+            hasta = min(desde + lote - 1, total)
+            cur.execute(GENERAR, {"prefijo": PREFIJO, "desde": desde, "hasta": hasta})
+            print(f"  {hasta} clientes")
+        cur.execute("ANALYZE cliente")
+
+
+def limpiar(conn):
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM cliente WHERE documento_identidad LIKE %s", (PREFIJO + "%",))
+        print(f"eliminados: {cur.rowcount}")
+
+
+def medir(conn, variante, termino, repeticiones):
+    tiempos = []
+    with conn.cursor() as cur:
+        if variante == "sin_indice":
+            cur.execute("SET enable_bitmapscan = off; SET enable_indexscan = off")
+        try:
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                cur.execute(CONSULTAS[variante], (termino,))
+                filas = cur.fetchall()
+                tiempos.append(time.perf_counter() - inicio)
+        finally:
+            cur.execute("RESET enable_bitmapscan; RESET enable_indexscan")
+    return tiempos, len(filas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("terminos", nargs="*", default=["garcia", "maria fer", "gonzales", "lucia.ruiz"])
+    parser.add_argument("--generar", type=int, default=0, help="clientes sintéticos a insertar")
+    parser.add_argument("--limpiar", action="store_true", help="eliminar los clientes sintéticos")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    conn = get_connection()
+    try:
+        if args.limpiar:
+            limpiar(conn)
+            return
+        if args.generar:
+            print(f"generando {args.generar} clientes...")
+            generar(conn, args.generar)
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM cliente")
+            print(f"clientes en la tabla: {cur.fetchone()[0]}")
+
+        print(f"{'término':<14}{'variante':<15}{'filas':>6}{'p50 ms':>10}{'p95 ms':>10}")
+        for termino in args.terminos:
+            for variante in CONSULTAS:
+                tiempos, filas = medir(conn, variante, termino, args.repeticiones)
+                tiempos.sort()
+                p95 = tiempos[min(len(tiempos) - 1, int(0.95 * len(tiempos)))]
+                print(f"{termino:<14}{variante:<15}{filas:>6}"
+                      f"{statistics.median(tiempos) * 1000:>10.2f}{p95 * 1000:>10.2f}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Prueba de carga sencilla contra la API en ejecución.
+
+Uso:
+    python benchmarks/carga.py --url http://localhost:8000 --concurrencia 200 --duracion 30 \
+        /cliente/123 /habitaciones/1 /reservaciones?documento_identidad=123
+
+Sirve para comparar DB_MODO=sync contra DB_MODO=async levantando la API con
+cada modo y ejecutando el mismo comando.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def cliente(http, rutas, fin, latencias, errores):
+    i = 0
+    while time.monotonic() < fin:
+        ruta = rutas[i % len(rutas)]
+        i += 1
+        inicio = time.perf_counter()
+        try:
+            r = await http.get(ruta)
+            if r.status_code >= 500:
+                errores.append(r.status_code)
+                continue
+        except httpx.HTTPError as e:
+            errores.append(type(e).__name__)
+            continue
+        latencias.append(time.perf_counter() - inicio)
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    k = min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))
+    return valores[k]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("rutas", nargs="+")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrencia", type=int, default=100)
+    parser.add_argument("--duracion", type=float, default=30)
+    args = parser.parse_args()
+
+    latencias, errores = [], []
+    limites = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+    async with httpx.AsyncClient(base_url=args.url, limits=limites, timeout=60) as http:
+        fin = time.monotonic() + args.duracion
+        await asyncio.gather(*(
+            cliente(http, args.rutas, fin, latencias, errores) for _ in range(args.concurrencia)
+        ))
+
+    print(f"concurrencia: {args.concurrencia}  duración: {args.duracion}s")
+    print(f"peticiones ok: {len(latencias)}  errores: {len(errores)}")
+    print(f"throughput: {len(latencias) / args.duracion:.1f} req/s")
+    if latencias:
+        print(f"latencia media: {statistics.mean(latencias) * 1000:.2f} ms")
+        for p in (50, 95, 99):
+            print(f"p{p}: {percentil(latencias, p) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
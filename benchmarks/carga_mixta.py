@@ -0,0 +1,310 @@
+"""Carga mixta de lecturas y escrituras contra la API, con línea base para comparar.
+
+Uso:
+    python -m benchmarks.base_datos --reemplazar --clientes 100000 --habitaciones 300
+    python -m benchmarks.carga_mixta --iniciar-api --duracion 60 --concurrencia 50 \
+        --guardar benchmarks/resultados/actual.json --base benchmarks/resultados/base.json
+
+Toma muestras de ids reales de la base de datos (variables DB_*), reparte las
+peticiones según los pesos de ESCENARIOS y reporta por endpoint: peticiones,
+throughput, p50/p95/p99 y errores. Con --guardar escribe el resultado en JSON; con
+--base lo compara contra un resultado anterior y termina con código 1 si algún
+endpoint empeoró más que --tolerancia.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import httpx
+
+from benchmarks.carga import percentil
+from conexion_BD import get_connection
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Muestras:
+    # Ids existentes para armar las peticiones, más las reservas creadas por la prueba
+    def __init__(self, cantidad):
+        conn = get_connection()
+        try:
+            with conn.cursor() as cur:
+                def tomar(sql):
+                    cur.execute(sql, (cantidad,))
+                    return [f[0] for f in cur.fetchall()]
+                self.clientes = tomar("SELECT documento_identidad FROM cliente TABLESAMPLE SYSTEM (10) LIMIT %s")
+                self.habitaciones = tomar("SELECT id_habitacion FROM habitacion LIMIT %s")
+                self.reservas = tomar("SELECT id_reserva FROM reserva TABLESAMPLE SYSTEM (10) LIMIT %s")
+                self.pagos = tomar("SELECT id_pago FROM pago TABLESAMPLE SYSTEM (10) LIMIT %s")
+                self.servicios = tomar("SELECT id_servicio FROM servicios TABLESAMPLE SYSTEM (10) LIMIT %s")
+        finally:
+            conn.close()
+        if not (self.clientes and self.habitaciones and self.reservas):
+            raise SystemExit("No hay datos; ejecuta primero python -m benchmarks.base_datos")
+        self.creadas = []
+
+
+def _fechas_futuras():
+    # Fechas lejanas para que las reservas de la prueba no choquen con los datos generados
+    entrada = date.today() + timedelta(days=400 + random.randint(0, 3000))
+    return entrada, entrada + timedelta(days=random.randint(1, 5))
+
+
+# Cada escenario devuelve (método, ruta, cuerpo); el nombre es la etiqueta del reporte
+def _get_cliente(m):
+    return "GET", f"/cliente/{random.choice(m.clientes)}", None
+
+
+def _buscar_cliente(m):
+    return "GET", "/cliente?q=" + random.choice(["garcia", "maria lop", "hernandes", "sofia"]), None
+
+
+def _get_habitacion(m):
+    return "GET", f"/habitaciones/{random.choice(m.habitaciones)}", None
+
+
+def _disponibles(m):
+    entrada, salida = _fechas_futuras()
+    tipo = random.choice(["sencilla", "doble", "suite"])
+    return "GET", f"/habitaciones/disponibles?fecha_entrada={entrada}&fecha_salida={salida}&tipo={tipo}", None
+
+
+def _get_reservacion(m):
+    return "GET", f"/reservaciones/{random.choice(m.reservas)}", None
+
+
+def _listar_reservaciones(m):
+    return "GET", f"/reservaciones?documento_identidad={random.choice(m.clientes)}", None
+
+
+def _get_pago(m):
+    return "GET", f"/pagos/{random.choice(m.pagos or [1])}", None
+
+
+def _listar_pagos(m):
+    return "GET", f"/pagos?metodo_pago={random.choice(['tarjeta', 'efectivo', 'transferencia'])}&limit=50", None
+
+
+def _get_servicio(m):
+    return "GET", f"/servicios/{random.choice(m.servicios or [1])}", None
+
+
+def _crear_reservacion(m):
+    entrada, salida = _fechas_futuras()
+    return "POST", "/reservaciones", {
+        "numero_huespedes": 1,
+        "tipo_habitacion": random.choice(["sencilla", "doble", "suite"]),
+        "id_politicas": 1,
+        "documento_identidad": random.choice(m.clientes),
+        "fecha_entrada": entrada.isoformat(),
+        "fecha_salida": salida.isoformat(),
+        "tipo_reserva": "individual",
+        "tipo_confirmacion": "app",
+        "solicitudes_especial": None,
+    }
+
+
+def _registrar_pago(m):
+    if not m.creadas:
+        return _crear_reservacion(m)
+    return "POST", "/pagos", {
+        "id_reserva": random.choice(m.creadas),
+        "tipo_pago": "debito",
+        "plataformas_integradas": "pos",
+        "metodo_pago": "tarjeta",
+        "factura": "F-BENCH",
+        "recibo": "R-BENCH",
+        "reembolso": 0,
+        "cargos_extra": "ninguno",
+    }
+
+
+def _cancelar_reservacion(m):
+    if not m.creadas:
+        return _crear_reservacion(m)
+    return "DELETE", f"/reservaciones/{m.creadas.pop(random.randrange(len(m.creadas)))}", None
+
+
+# nombre: (peso, generador)
+ESCENARIOS = {
+    "GET /cliente/{id}": (15, _get_cliente),
+    "GET /cliente?q=": (5, _buscar_cliente),
+    "GET /habitaciones/{id}": (10, _get_habitacion),
+    "GET /habitaciones/disponibles": (15, _disponibles),
+    "GET /reservaciones/{id}": (15, _get_reservacion),
+    "GET /reservaciones": (8, _listar_reservaciones),
+    "GET /pagos/{id}": (8, _get_pago),
+    "GET /pagos": (4, _listar_pagos),
+    "GET /servicios/{id}": (5, _get_servicio),
+    "POST /reservaciones": (8, _crear_reservacion),
+    "POST /pagos": (4, _registrar_pago),
+    "DELETE /reservaciones/{id}": (3, _cancelar_reservacion),
+}
+
+
+async def usuario(http, muestras, fin, resultados):
+    nombres = list(ESCENARIOS)
+    pesos = [ESCENARIOS[n][0] for n in nombres]
+    while time.monotonic() < fin:
+        nombre = random.choices(nombres, pesos)[0]
+        metodo, ruta, cuerpo = ESCENARIOS[nombre][1](muestras)
+        r = resultados.setdefault(nombre, {"latencias": [], "errores": 0, "rechazos": 0})
+        inicio = time.perf_counter()
+        try:
+            respuesta = await http.request(metodo, ruta, json=cuerpo)
+        except httpx.HTTPError:
+            r["errores"] += 1
+            continue
+        r["latencias"].append(time.perf_counter() - inicio)
+        if respuesta.status_code >= 500:
+            r["errores"] += 1
+        elif respuesta.status_code >= 400:
+            # Reservas sin habitación libre, pagos duplicados...: respuestas válidas de la API
+            r["rechazos"] += 1
+        elif nombre == "POST /reservaciones":
+            muestras.creadas.append(respuesta.json()["id_reserva"])
+
+
+def resumir(resultados, duracion):
+    resumen = {}
+    for nombre in sorted(resultados):
+        r = resultados[nombre]
+        latencias = r["latencias"]
+        resumen[nombre] = {
+            "peticiones": len(latencias),
+            "throughput": round(len(latencias) / duracion, 2),
+            "p50_ms": round(percentil(latencias, 50) * 1000, 2),
+            "p95_ms": round(percentil(latencias, 95) * 1000, 2),
+            "p99_ms": round(percentil(latencias, 99) * 1000, 2),
+            "errores": r["errores"],
+            "rechazos": r["rechazos"],
+        }
+    todas = [l for r in resultados.values() for l in r["latencias"]]
+    resumen["TOTAL"] = {
+        "peticiones": len(todas),
+        "throughput": round(len(todas) / duracion, 2),
+        "p50_ms": round(percentil(todas, 50) * 1000, 2),
+        "p95_ms": round(percentil(todas, 95) * 1000, 2),
+        "p99_ms": round(percentil(todas, 99) * 1000, 2),
+        "errores": sum(r["errores"] for r in resultados.values()),
+        "rechazos": sum(r["rechazos"] for r in resultados.values()),
+    }
+    return resumen
+
+
+def imprimir(resumen):
+    print(f"{'endpoint':<32}{'peticiones':>11}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errores':>9}{'4xx':>7}")
+    for nombre, r in resumen.items():
+        print(f"{nombre:<32}{r['peticiones']:>11}{r['throughput']:>10}{r['p50_ms']:>10}"
+              f"{r['p95_ms']:>10}{r['p99_ms']:>10}{r['errores']:>9}{r['rechazos']:>7}")
+
+
+def comparar(resumen, base, tolerancia):
+    # Regresión: p95 más alto o throughput más bajo que la base en más de `tolerancia`
+    regresiones = []
+    for nombre, actual in resumen.items():
+        anterior = base.get(nombre)
+        if not anterior or not anterior["peticiones"]:
+            continue
+        if anterior["p95_ms"] and actual["p95_ms"] > anterior["p95_ms"] * (1 + tolerancia):
+            regresiones.append(f"{nombre}: p95 {anterior['p95_ms']} -> {actual['p95_ms']} ms")
+        if actual["throughput"] < anterior["throughput"] * (1 - tolerancia):
+            regresiones.append(f"{nombre}: throughput {anterior['throughput']} -> {actual['throughput']} req/s")
+    return regresiones
+
+
+def iniciar_api(url):
+    puerto = httpx.URL(url).port or 8000
+    # Toda la carga sale de una sola IP: sin límite por cliente (el cupo sigue activo)
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "menu_API:app", "--port", str(puerto), "--log-level", "warning"],
+        cwd=RAIZ, env={**os.environ, "ADMISION_TASA": os.getenv("ADMISION_TASA", "0")},
+    )
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        try:
+            if httpx.get(url + "/pool/metricas", timeout=1).status_code == 200:
+                return proceso
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    proceso.terminate()
+    raise SystemExit("La API no respondió en 60 s")
+
+
+async def ejecutar(args, muestras):
+    resultados = {}
+    limites = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+    async with httpx.AsyncClient(base_url=args.url, limits=limites, timeout=60) as http:
+        if args.calentamiento:
+            await asyncio.gather(*(
+                usuario(http, muestras, time.monotonic() + args.calentamiento, {})
+                for _ in range(args.concurrencia)
+            ))
+        fin = time.monotonic() + args.duracion
+        await asyncio.gather(*(
+            usuario(http, muestras, fin, resultados) for _ in range(args.concurrencia)
+        ))
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--iniciar-api", action="store_true", help="levantar menu_API.py con uvicorn para la prueba")
+    parser.add_argument("--concurrencia", type=int, default=50)
+    parser.add_argument("--duracion", type=float, default=60)
+    parser.add_argument("--calentamiento", type=float, default=5, help="segundos sin medir al inicio")
+    parser.add_argument("--muestras", type=int, default=5000, help="ids de cada tabla usados en las peticiones")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--guardar", help="archivo JSON donde guardar el resultado")
+    parser.add_argument("--base", help="resultado anterior contra el que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.15)
+    args = parser.parse_args()
+
+    random.seed(args.semilla)
+    muestras = Muestras(args.muestras)
+    proceso = iniciar_api(args.url) if args.iniciar_api else None
+    try:
+        resultados = asyncio.run(ejecutar(args, muestras))
+    finally:
+        if proceso:
+            proceso.terminate()
+            proceso.wait()
+
+    resumen = resumir(resultados, args.duracion)
+    imprimir(resumen)
+
+    if args.guardar:
+        os.makedirs(os.path.dirname(os.path.abspath(args.guardar)), exist_ok=True)
+        with open(args.guardar, "w", encoding="utf-8") as f:
+            json.dump({
+                "fecha": datetime.now().isoformat(timespec="seconds"),
+                "parametros": {
+                    "concurrencia": args.concurrencia, "duracion": args.duracion,
+                    "semilla": args.semilla, "url": args.url,
+                },
+                "endpoints": resumen,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"resultado guardado en {args.guardar}")
+
+    if args.base:
+        with open(args.base, encoding="utf-8") as f:
+            base = json.load(f)["endpoints"]
+        regresiones = comparar(resumen, base, args.tolerancia)
+        if regresiones:
+            print(f"regresiones respecto a {args.base} (tolerancia {args.tolerancia:.0%}):")
+            for r in regresiones:
+                print("  " + r)
+            sys.exit(1)
+        print(f"sin regresiones respecto a {args.base}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Throughput de la API según el número de procesos.
+
+Uso:
+    python -m benchmarks.escalamiento --trabajadores 1 2 4 8 --concurrencia 200 --duracion 30 \
+        /cliente/C000000123 /habitaciones/1 "/reservaciones?documento_identidad=C000000123"
+
+Para cada número de trabajadores levanta `python -m servidor` en --puerto, espera a que
+todos respondan en /salud/listo, ejecuta la misma carga que benchmarks/carga.py contra
+las rutas indicadas y lo apaga con SIGTERM. Reporta req/s, p50/p99 y la aceleración
+respecto a la primera medición. Con --conexiones-totales todas las corridas usan el mismo
+total de conexiones a la base de datos, repartido entre los procesos.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.carga import cliente, percentil
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def levantar(trabajadores, args):
+    comando = [
+        sys.executable, "-m", "servidor", "--puerto", str(args.puerto),
+        "--trabajadores", str(trabajadores), "--espera-drenado", "0",
+    ]
+    if args.conexiones_totales:
+        comando += ["--conexiones-totales", str(args.conexiones_totales)]
+    # Toda la carga sale de una sola IP: sin límite por cliente (el cupo sigue activo)
+    entorno = {**os.environ, "LOG_NIVEL": "WARNING", "ADMISION_TASA": os.getenv("ADMISION_TASA", "0")}
+    proceso = subprocess.Popen(comando, cwd=RAIZ, env=entorno)
+    url = f"http://127.0.0.1:{args.puerto}/salud/listo"
+    # Cada petición cae en algún trabajador; se espera a ver tantos pid distintos como trabajadores
+    listos = set()
+    limite = time.monotonic() + 120
+    while len(listos) < trabajadores and time.monotonic() < limite:
+        try:
+            r = httpx.get(url, timeout=1)
+            if r.status_code == 200:
+                listos.add(r.json()["pid"])
+                continue
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    if not listos:
+        detener(proceso)
+        raise SystemExit(f"La API con {trabajadores} trabajadores no quedó lista")
+    return proceso
+
+
+def detener(proceso):
+    proceso.send_signal(signal.SIGTERM)
+    try:
+        proceso.wait(60)
+    except subprocess.TimeoutExpired:
+        proceso.kill()
+        proceso.wait()
+
+
+async def medir(args):
+    latencias, errores = [], []
+    limites = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.puerto}", limits=limites, timeout=60) as http:
+        if args.calentamiento:
+            fin = time.monotonic() + args.calentamiento
+            await asyncio.gather(*(cliente(http, args.rutas, fin, [], []) for _ in range(args.concurrencia)))
+        fin = time.monotonic() + args.duracion
+        await asyncio.gather(*(
+            cliente(http, args.rutas, fin, latencias, errores) for _ in range(args.concurrencia)
+        ))
+    return latencias, errores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("rutas", nargs="+")
+    parser.add_argument("--trabajadores", type=int, nargs="+",
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--puerto", type=int, default=8100)
+    parser.add_argument("--concurrencia", type=int, default=200)
+    parser.add_argument("--duracion", type=float, default=30)
+    parser.add_argument("--calentamiento", type=float, default=5)
+    parser.add_argument("--conexiones-totales", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"núcleos: {os.cpu_count()}  concurrencia: {args.concurrencia}  duración: {args.duracion}s")
+    print(f"{'trabajadores':>12}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errores':>9}{'aceleración':>13}")
+    base = None
+    for trabajadores in args.trabajadores:
+        proceso = levantar(trabajadores, args)
+        try:
+            latencias, errores = asyncio.run(medir(args))
+        finally:
+            detener(proceso)
+        throughput = len(latencias) / args.duracion
+        base = base or throughput
+        print(f"{trabajadores:>12}{throughput:>10.1f}{percentil(latencias, 50) * 1000:>10.2f}"
+              f"{percentil(latencias, 99) * 1000:>10.2f}{len(errores):>9}{throughput / base if base else 0:>12.2f}x")
+
+
+if __name__ == "__main__":
+    main()
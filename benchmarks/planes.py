@@ -0,0 +1,315 @@
+"""Revisión de planes: ninguna función o procedimiento recorre completa una tabla grande.
+
+Uso:
+    python -m benchmarks.base_datos --reemplazar --clientes 100000 --habitaciones 300
+    python -m benchmarks.planes --filas-minimas 10000
+
+Ejecuta cada función y procedimiento del esquema (salvo los de trigger y OMITIDAS)
+con valores tomados de los datos, dentro de una transacción que se deshace. Con
+auto_explain (log_nested_statements) el servidor envía como aviso el plan de cada
+sentencia, también las que corren dentro de PL/pgSQL y de los triggers. Si alguna
+hace un Seq Scan sobre una tabla de al menos --filas-minimas filas, se reporta y el
+comando termina con código 1. PERMITIDAS lista las rutinas que por diseño leen
+tablas completas. Una rutina que termina con error también cuenta como falla: sus
+sentencias posteriores al error no se revisaron.
+
+auto_explain debe poder cargarse en la sesión (superusuario, o la biblioteca en
+$libdir/plugins).
+"""
+import argparse
+import json
+import sys
+from collections import deque
+from datetime import date, timedelta
+
+import psycopg2
+import psycopg2.extras
+
+from conexion_BD import get_connection
+
+# Rutinas que no se ejecutan: necesitan tablas temporales de carga_masiva.py o
+# reescriben datos de todo el esquema
+OMITIDAS = {
+    "cargar_clientes_staging": "lee stg_cliente, que crea carga_masiva.py en su sesión",
+    "cargar_habitaciones_staging": "lee stg_habitacion, que crea carga_masiva.py en su sesión",
+    "cargar_servicios_staging": "lee stg_servicio, que crea carga_masiva.py en su sesión",
+    "reconstruir_reportes": "recalcula todos los meses de todos los reportes",
+    "restaurar_reservas_desde_bitacora": "recorre toda la bitácora",
+    "archivar_bitacora": "mueve particiones completas de la bitácora",
+}
+
+# Filas que se crean antes de la rutina, en su misma transacción, cuando necesita
+# una que se pueda borrar sin violar llaves foráneas. Devuelven los parámetros a usar
+PREPARACION = {
+    "eliminar_cliente": """
+        INSERT INTO cliente (documento_identidad, nombre) VALUES ('REVISION-PLANES', 'revision')
+        RETURNING documento_identidad AS p_documento_identidad;
+    """,
+    "eliminar_habitacion": """
+        INSERT INTO habitacion (numero, tipo, disponibilidad, descripcion, caracteristicas, id_costos)
+        SELECT 999999, h.tipo, 'libre', 'revision', 'revision', h.id_costos
+        FROM habitacion h WHERE h.id_habitacion = %(p_id_habitacion)s
+        RETURNING id_habitacion AS p_id_habitacion;
+    """,
+}
+
+# Rutinas cuyo recorrido completo es esperado
+PERMITIDAS = {
+    "reservas_activas_desde": "el calendario carga todas las reservas vigentes",
+    "crear_particiones_bitacora": "solo consulta el catálogo",
+}
+
+MUESTRA = """
+    SELECT r.id_reserva, r.id_habitacion, r.documento_identidad, r.fecha_entrada, r.fecha_salida,
+           h.numero, h.tipo, p.id_pago, p.fecha_pago, p.metodo_pago, p.tipo_pago,
+           (SELECT min(id_servicio) FROM servicios) AS id_servicio,
+           (SELECT min(id_politicas) FROM politicas_reserva) AS id_politicas
+    FROM reserva r
+    JOIN habitacion h ON h.id_habitacion = r.id_habitacion
+    JOIN pago p ON p.id_reserva = r.id_reserva
+    WHERE r.estado_reserva <> 'Cancelada'
+    ORDER BY r.id_reserva DESC
+    LIMIT 1;
+"""
+
+RUTINAS = """
+    SELECT p.proname AS nombre, p.prokind AS tipo,
+           COALESCE(p.proargnames, '{}') AS argumentos,
+           COALESCE(p.proargmodes::TEXT[], '{}') AS modos,
+           ARRAY(SELECT format_type(t, NULL)
+                 FROM unnest(COALESCE(p.proallargtypes, p.proargtypes::OID[])) t) AS tipos
+    FROM pg_proc p
+    WHERE p.pronamespace = current_schema()::REGNAMESPACE
+      AND p.prorettype <> 'trigger'::REGTYPE
+      AND p.prokind IN ('f', 'p')
+    ORDER BY p.proname;
+"""
+
+TABLAS = """
+    SELECT c.relname, c.reltuples
+    FROM pg_class c
+    WHERE c.relnamespace = current_schema()::REGNAMESPACE AND c.relkind = 'r';
+"""
+
+
+def valores(m):
+    # Valor por nombre de parámetro; los que no están aquí se deducen de su tipo.
+    # Deben ser válidos para que cada rutina llegue a sus consultas principales
+    return {
+        "p_documento_identidad": m["documento_identidad"],
+        "p_documentos": [m["documento_identidad"]],
+        "p_id_reserva": m["id_reserva"],
+        "p_id_habitacion": m["id_habitacion"],
+        "p_id_pago": m["id_pago"],
+        "p_id_servicio": m["id_servicio"],
+        "p_numero": m["numero"],
+        "p_habitaciones": [m["id_habitacion"]],
+        "p_tipo": m["tipo"],
+        "p_tipo_habitacion": m["tipo"],
+        "p_fecha_entrada": m["fecha_entrada"],
+        "p_entrada": m["fecha_entrada"],
+        "p_fecha": m["fecha_entrada"],
+        "p_fecha_salida": m["fecha_salida"],
+        "p_salida": m["fecha_salida"],
+        "p_fecha_pago": m["fecha_pago"],
+        "p_metodo_pago": m["metodo_pago"],
+        "p_tipo_pago": m["tipo_pago"],
+        "p_desde": m["fecha_entrada"] - timedelta(days=30),
+        "p_hasta": m["fecha_entrada"],
+        "p_mes": m["fecha_entrada"].replace(day=1),
+        "p_estado": "Confirmada",
+        "p_reporte": "ocupacion",
+        "p_agrupacion": "dia",
+        "p_reservas": psycopg2.extras.Json([]),
+        "p_detalle": psycopg2.extras.Json({}),
+        "p_texto": "garcia",
+        "p_prefijo": "mar",
+        "p_nombre": "garcia",
+        "p_despues": None,
+        "p_limite": 100,
+        "p_lote": 100,
+        "p_numero_huespedes": 1,
+        "p_disponibilidad": "libre",
+        "p_id_politicas": m["id_politicas"],
+        "p_tipo_reserva": "individual",
+        "p_tipo_confirmacion": "correo",
+        "p_correo": "revision@example.com",
+        "p_fecha_nacimiento": date(1990, 1, 1),
+        "p_accion": "revision",
+    }
+
+
+def propios(nombre, m):
+    # Valores que cambian para una rutina: altas que no deben chocar con filas existentes
+    # y reservas nuevas en fechas en que seguro hay habitaciones libres
+    entrada = date.today() + timedelta(days=3000)
+    salida = entrada + timedelta(days=2)
+    reserva = {
+        "p_fecha_entrada": entrada,
+        "p_entrada": entrada,
+        "p_fecha_salida": salida,
+        "p_salida": salida,
+    }
+    return {
+        "crear_cliente": {"p_documento_identidad": "REVISION-PLANES"},
+        "crear_habitacion": {"p_numero": 999999},
+        "asignar_habitacion": reserva,
+        "reservar_habitacion": reserva,
+        "crear_reservacion": reserva,
+        "crear_reservaciones_lote": {"p_reservas": psycopg2.extras.Json([{
+            "numero_huespedes": 1,
+            "tipo_habitacion": m["tipo"],
+            "id_politicas": m["id_politicas"],
+            "documento_identidad": m["documento_identidad"],
+            "fecha_entrada": entrada.isoformat(),
+            "fecha_salida": salida.isoformat(),
+            "tipo_reserva": "individual",
+            "tipo_confirmacion": "correo",
+        }])},
+    }.get(nombre, {})
+
+
+def por_tipo(tipo, m):
+    if tipo.endswith("[]"):
+        return []
+    if tipo in ("integer", "bigint", "smallint"):
+        return 1
+    if tipo in ("numeric", "double precision", "real"):
+        return 100
+    if tipo == "date" or tipo.startswith("timestamp"):
+        return m["fecha_entrada"]
+    if tipo == "boolean":
+        return True
+    if tipo.startswith("time"):
+        return "10:00"
+    if tipo in ("jsonb", "json"):
+        return psycopg2.extras.Json({})
+    return "revision"
+
+
+def llamada(rutina, m, preparados=None):
+    conocidos = {**valores(m), **propios(rutina["nombre"], m), **(preparados or {})}
+    partes, params = [], []
+    modos = rutina["modos"] or ["i"] * len(rutina["tipos"])
+    for nombre, modo, tipo in zip(rutina["argumentos"], modos, rutina["tipos"]):
+        if modo not in ("i", "b", "v"):
+            continue
+        partes.append(f"{nombre} => %s::{tipo}")
+        params.append(conocidos[nombre] if nombre in conocidos else por_tipo(tipo, m))
+    argumentos = ", ".join(partes)
+    if rutina["tipo"] == "p":
+        return f"CALL {rutina['nombre']}({argumentos});", params
+    return f"SELECT * FROM {rutina['nombre']}({argumentos});", params
+
+
+def recorridos(nodo):
+    # Tablas leídas con Seq Scan en un nodo del plan y sus hijos
+    if nodo.get("Node Type") == "Seq Scan":
+        yield nodo["Relation Name"]
+    for hijo in nodo.get("Plans", ()):
+        yield from recorridos(hijo)
+
+
+def planes(avisos):
+    for aviso in avisos:
+        inicio = aviso.find("{")
+        if "plan:" not in aviso or inicio < 0:
+            continue
+        try:
+            yield json.loads(aviso[inicio:])
+        except ValueError:
+            continue
+
+
+def revisar(conn, rutina, m, grandes):
+    error = None
+    preparados = None
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        try:
+            if rutina["nombre"] in PREPARACION:
+                cur.execute(PREPARACION[rutina["nombre"]], valores(m))
+                preparados = cur.fetchone()
+            sql, params = llamada(rutina, m, preparados)
+            # Solo cuentan los planes de la rutina, no los de la preparación
+            conn.notices.clear()
+            cur.execute(sql, params)
+        except psycopg2.Error as e:
+            error = str(e).strip().splitlines()[0]
+    conn.rollback()
+    hallazgos = []
+    for plan in planes(list(conn.notices)):
+        for tabla in recorridos(plan["Plan"]):
+            if tabla in grandes:
+                hallazgos.append((tabla, grandes[tabla], plan.get("Query Text", "").strip()))
+    return hallazgos, error
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("rutinas", nargs="*", help="solo estas (por defecto todas)")
+    parser.add_argument("--filas-minimas", type=int, default=10000,
+                        help="tablas con al menos estas filas no se deben recorrer completas")
+    parser.add_argument("--mostrar-consultas", action="store_true")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    conn.notices = deque(maxlen=10000)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("LOAD 'auto_explain'")
+            for ajuste, valor in (("log_min_duration", "0"), ("log_nested_statements", "on"),
+                                  ("log_format", "json"), ("log_level", "notice")):
+                cur.execute(f"SET auto_explain.{ajuste} = {valor}")
+            cur.execute("SET client_min_messages = notice")
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute(MUESTRA)
+            m = cur.fetchone()
+            if m is None:
+                raise SystemExit("No hay reservas con pago: generar datos con python -m benchmarks.base_datos")
+            cur.execute(TABLAS)
+            grandes = {f["relname"]: int(f["reltuples"]) for f in cur.fetchall()
+                       if f["reltuples"] >= args.filas_minimas}
+            cur.execute(RUTINAS)
+            rutinas = [r for r in cur.fetchall() if not args.rutinas or r["nombre"] in args.rutinas]
+        print(f"tablas con {args.filas_minimas} filas o más: {', '.join(sorted(grandes)) or 'ninguna'}")
+
+        # Cada rutina corre en una transacción que se deshace al terminar
+        conn.autocommit = False
+        fallas = 0
+        errores = 0
+        for rutina in rutinas:
+            nombre = rutina["nombre"]
+            if nombre in OMITIDAS:
+                print(f"{nombre:<36}omitida ({OMITIDAS[nombre]})")
+                continue
+            hallazgos, error = revisar(conn, rutina, m, grandes)
+            if error:
+                # Lo que viene después del error no se ejecutó ni se revisó
+                errores += 1
+                print(f"{nombre:<36}ERROR: {error}")
+            if not hallazgos:
+                if not error:
+                    print(f"{nombre:<36}ok")
+                continue
+            tablas = ", ".join(sorted({f"{t} ({filas} filas)" for t, filas, _ in hallazgos}))
+            if nombre in PERMITIDAS:
+                print(f"{nombre:<36}permitida: Seq Scan en {tablas} ({PERMITIDAS[nombre]})")
+                continue
+            fallas += 1
+            print(f"{nombre:<36}FALLA: Seq Scan en {tablas}")
+            if args.mostrar_consultas:
+                for _, _, consulta in hallazgos:
+                    print("    " + " ".join(consulta.split()))
+    finally:
+        conn.close()
+
+    if fallas:
+        print(f"{fallas} rutinas recorren tablas grandes completas")
+    if errores:
+        print(f"{errores} rutinas terminaron con error y no se revisaron completas")
+    if fallas or errores:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Costo de analizar y planificar las consultas en cada petición.
+
+Uso:
+    python -m benchmarks.sentencias --repeticiones 2000
+
+Sobre la base de datos configurada (p. ej. la de benchmarks/base_datos.py) mide cada
+consulta de la API de dos formas, con los mismos parámetros tomados de la tabla:
+
+  sin_preparar   el texto completo en cada ejecución (como antes de DB_SENTENCIAS_PREPARADAS)
+  preparada      conexion_BD.ejecutar: PREPARE la primera vez y luego solo EXECUTE
+
+y compara filtrar_reservas contra la versión anterior con predicados
+"p_x IS NULL OR ..." (creada como función temporal) por combinación de filtros.
+"""
+import argparse
+import random
+import statistics
+import time
+
+import psycopg2.extras
+
+from conexion_BD import get_connection, ejecutar
+
+CONSULTAS = {
+    "obtener_reservacion": "SELECT * FROM obtener_reservacion(%s);",
+    "obtener_habitacion": "SELECT * FROM obtener_habitacion(%s);",
+    "obtener_cliente": "SELECT * FROM obtener_cliente(%s);",
+    "filtrar_habitaciones": "SELECT * FROM filtrar_habitaciones(%s, %s, %s, %s, %s);",
+    "filtrar_reservas": "SELECT * FROM filtrar_reservas(%s, %s, %s, %s);",
+}
+
+# filtrar_reservas antes de separar las combinaciones de filtros
+GENERICA = """
+    CREATE FUNCTION pg_temp.filtrar_reservas_generica(
+        p_documento_identidad VARCHAR, p_fecha_entrada DATE, p_despues INT, p_limite INT
+    )
+    RETURNS SETOF reserva AS $$
+    BEGIN
+        RETURN QUERY
+        SELECT r.* FROM reserva r
+        WHERE (p_documento_identidad IS NULL OR r.documento_identidad = p_documento_identidad)
+          AND (p_fecha_entrada IS NULL OR r.fecha_entrada = p_fecha_entrada)
+          AND (p_despues IS NULL OR r.id_reserva > p_despues)
+        ORDER BY r.id_reserva
+        LIMIT p_limite;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+FILTROS = {
+    "documento": lambda m: (m["documento_identidad"], None, None, 100),
+    "fecha": lambda m: (None, m["fecha_entrada"], None, 100),
+    "ambos": lambda m: (m["documento_identidad"], m["fecha_entrada"], None, 100),
+}
+
+
+def muestras(conn, cantidad):
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("""
+            SELECT id_reserva, id_habitacion, documento_identidad, fecha_entrada
+            FROM reserva TABLESAMPLE SYSTEM (10)
+            LIMIT %s;
+        """, (cantidad,))
+        filas = cur.fetchall()
+    if not filas:
+        raise SystemExit("No hay reservas: generar datos con python -m benchmarks.base_datos")
+    return filas
+
+
+def parametros(consulta, m):
+    if consulta == "obtener_reservacion":
+        return (m["id_reserva"],)
+    if consulta == "obtener_habitacion":
+        return (m["id_habitacion"],)
+    if consulta == "obtener_cliente":
+        return (m["documento_identidad"],)
+    if consulta == "filtrar_habitaciones":
+        return (None, None, None, None, 100)
+    return FILTROS["documento"](m)
+
+
+def medir(conn, sql, lista, preparar):
+    tiempos = []
+    with conn.cursor() as cur:
+        for params in lista:
+            inicio = time.perf_counter()
+            if preparar:
+                ejecutar(cur, sql, params)
+            else:
+                cur.execute(sql, params)
+            cur.fetchall()
+            tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+
+def fila(nombre, variante, tiempos):
+    tiempos.sort()
+    p99 = tiempos[min(len(tiempos) - 1, int(0.99 * len(tiempos)))]
+    print(f"{nombre:<24}{variante:<14}{statistics.mean(tiempos) * 1000:>10.3f}"
+          f"{statistics.median(tiempos) * 1000:>10.3f}{p99 * 1000:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=1000)
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.semilla)
+
+    conn = get_connection()
+    try:
+        base = muestras(conn, 500)
+        elegidas = [random.choice(base) for _ in range(args.repeticiones)]
+        print(f"{'consulta':<24}{'variante':<14}{'media ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for nombre, sql in CONSULTAS.items():
+            lista = [parametros(nombre, m) for m in elegidas]
+            # Una pasada de calentamiento para que ambas variantes encuentren las páginas en memoria
+            medir(conn, sql, lista[:50], False)
+            fila(nombre, "sin_preparar", medir(conn, sql, lista, False))
+            fila(nombre, "preparada", medir(conn, sql, lista, True))
+
+        with conn.cursor() as cur:
+            cur.execute(GENERICA)
+        print()
+        for filtro, armar in FILTROS.items():
+            lista = [armar(m) for m in elegidas]
+            generica = "SELECT * FROM pg_temp.filtrar_reservas_generica(%s, %s, %s, %s);"
+            fila(f"filtrar_reservas {filtro}", "generica", medir(conn, generica, lista, True))
+            fila(f"filtrar_reservas {filtro}", "variantes", medir(conn, CONSULTAS["filtrar_reservas"], lista, True))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Cotizaciones por segundo de la tabla de tarifas en memoria.
+
+Uso:
+    python -m benchmarks.tarifas --cotizaciones 100000 --temporadas 20 --promociones 5
+
+Carga las habitaciones, temporadas y promociones de la base de datos configurada
+(p. ej. la de benchmarks/base_datos.py) en una TablaTarifas, más --temporadas y
+--promociones reglas sintéticas en memoria, y cotiza estadías aleatorias de cada
+duración de dos formas:
+
+  acumulada      tarifas.cotizar: dos lecturas del array de sumas acumuladas por tipo
+  noche_a_noche  la misma cotización recorriendo las reglas de cada noche, como la
+                 calcularía un cliente con los precios de filtrar_habitaciones
+
+Reporta cotizaciones por segundo, microsegundos por cotización y comprueba que ambas
+formas dan el mismo total.
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+import psycopg2.extras
+
+from conexion_BD import get_connection
+from tarifas import TablaTarifas, TARIFAS_DIAS
+from calendario import CAPACIDAD_POR_TIPO
+
+
+def leer(conn):
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("SELECT * FROM filtrar_habitaciones(NULL, NULL, NULL);")
+        habitaciones = cur.fetchall()
+        cur.execute("SELECT * FROM tarifa_temporada;")
+        temporadas = cur.fetchall()
+        cur.execute("SELECT * FROM tarifa_promocion;")
+        promociones = cur.fetchall()
+    if not habitaciones:
+        raise SystemExit("No hay habitaciones: generar datos con python -m benchmarks.base_datos")
+    return habitaciones, temporadas, promociones
+
+
+def sinteticas(inicio, temporadas, promociones):
+    tipos = [None] + sorted(CAPACIDAD_POR_TIPO)
+    reglas_t, reglas_p = [], []
+    for k in range(temporadas):
+        desde = inicio + timedelta(days=random.randint(0, TARIFAS_DIAS - 1))
+        reglas_t.append({
+            "tipo": random.choice(tipos),
+            "desde": desde,
+            "hasta": desde + timedelta(days=random.randint(1, 90)),
+            "dias_semana": random.choice([None, [5, 6], [1, 2, 3, 4]]),
+            "factor": round(random.uniform(0.7, 1.8), 4),
+        })
+    for k in range(promociones):
+        desde = inicio + timedelta(days=random.randint(0, TARIFAS_DIAS - 1))
+        reglas_p.append({
+            "nombre": f"promocion {k}",
+            "codigo": None,
+            "tipo": random.choice(tipos),
+            "desde": desde,
+            "hasta": desde + timedelta(days=random.randint(7, 120)),
+            "noches_minimas": random.choice([1, 3, 7]),
+            "descuento": random.choice([5, 10, 15, 20]),
+        })
+    return reglas_t, reglas_p
+
+
+def noche_a_noche(tabla, fecha_entrada, fecha_salida, tipo, precio):
+    # Referencia: cada noche recorre las temporadas y cada promoción sus noches
+    noches = (fecha_salida - fecha_entrada).days
+    precios = [precio * tabla._factor(tipo, fecha_entrada + timedelta(days=k)) for k in range(noches)]
+    descuento = 0.0
+    for p in tabla.promociones:
+        if (p["tipo"] is not None and p["tipo"] != tipo) or noches < p["noches_minimas"] or p["codigo"]:
+            continue
+        monto = sum(precios[k] for k in range(noches)
+                    if p["desde"] <= fecha_entrada + timedelta(days=k) < p["hasta"]) * p["descuento"]
+        descuento = max(descuento, monto)
+    return round(sum(precios) - descuento, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cotizaciones", type=int, default=100000)
+    parser.add_argument("--noches", type=int, nargs="+", default=[1, 7, 30, 90])
+    parser.add_argument("--temporadas", type=int, default=20)
+    parser.add_argument("--promociones", type=int, default=5)
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.semilla)
+
+    conn = get_connection()
+    try:
+        habitaciones, temporadas, promociones = leer(conn)
+    finally:
+        conn.close()
+    inicio = date.today()
+    extra_t, extra_p = sinteticas(inicio, args.temporadas, args.promociones)
+    tabla = TablaTarifas(TARIFAS_DIAS)
+    comienzo = time.perf_counter()
+    tabla.cargar(inicio, habitaciones, list(temporadas) + extra_t, list(promociones) + extra_p)
+    print(f"habitaciones: {len(tabla.precios)}  temporadas: {len(tabla.temporadas)}  "
+          f"promociones: {len(tabla.promociones)}  construcción: {(time.perf_counter() - comienzo) * 1000:.1f} ms")
+
+    ids = list(tabla.precios)
+    print(f"{'noches':>8}{'variante':>16}{'cotiz./s':>14}{'µs/cotiz.':>12}")
+    for noches in args.noches:
+        estadias = []
+        for _ in range(args.cotizaciones):
+            entrada = inicio + timedelta(days=random.randint(0, TARIFAS_DIAS - noches))
+            estadias.append((random.choice(ids), entrada, entrada + timedelta(days=noches)))
+
+        comienzo = time.perf_counter()
+        totales = [tabla.cotizar_habitacion(h, e, s)["total"] for h, e, s in estadias]
+        segundos = time.perf_counter() - comienzo
+        print(f"{noches:>8}{'acumulada':>16}{len(estadias) / segundos:>14.0f}{segundos / len(estadias) * 1e6:>12.2f}")
+
+        # La referencia es mucho más lenta: se mide sobre una muestra
+        muestra = estadias[:max(1, min(len(estadias), 200000 // noches))]
+        comienzo = time.perf_counter()
+        referencia = [noche_a_noche(tabla, e, s, *tabla.precios[h]) for h, e, s in muestra]
+        segundos = time.perf_counter() - comienzo
+        print(f"{noches:>8}{'noche_a_noche':>16}{len(muestra) / segundos:>14.0f}{segundos / len(muestra) * 1e6:>12.2f}")
+
+        distintas = sum(abs(a - b) > 0.011 for a, b in zip(totales, referencia))
+        if distintas:
+            print(f"{'':>8}{distintas} cotizaciones difieren de la referencia")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import time
+from conexion_BD import conexion
+
+log = logging.getLogger(__name__)
+
+# Eventos que se mueven por lote a tabla_log_reservaciones
+BITACORA_LOTE = int(os.getenv("BITACORA_LOTE", "500"))
+# Segundos máximos que un evento espera en la bandeja antes de moverse
+BITACORA_INTERVALO = float(os.getenv("BITACORA_INTERVALO", "1"))
+# Eventos pendientes a partir de los cuales las rutas esperan a que se vacíe la bandeja
+BITACORA_MAXIMO = int(os.getenv("BITACORA_MAXIMO", "10000"))
+# Particiones mensuales que se crean por adelantado y meses que se conservan en
+# tabla_log_reservaciones antes de archivarse (0 = no se archiva nunca)
+BITACORA_MESES_ADELANTE = int(os.getenv("BITACORA_MESES_ADELANTE", "3"))
+BITACORA_RETENCION_MESES = int(os.getenv("BITACORA_RETENCION_MESES", "0"))
+# Segundos entre revisiones de particiones y retención
+BITACORA_MANTENIMIENTO = 24 * 60 * 60
+
+
+async def mantener_particiones(db, meses_adelante=BITACORA_MESES_ADELANTE, retencion=BITACORA_RETENCION_MESES, eliminar=False):
+    # Crea las particiones de los próximos meses y archiva las que pasaron la retención
+    fila = await db.fetchone("SELECT crear_particiones_bitacora(%s) AS creadas;", (meses_adelante,))
+    archivadas = []
+    if retencion > 0:
+        archivadas = await db.fetchall("SELECT * FROM archivar_bitacora(%s, %s);", (retencion, eliminar))
+    return {"particiones_creadas": fila["creadas"], "archivadas": archivadas}
+
+
+class Bitacora:
+    # Mueve los eventos de bitacora_pendiente a tabla_log_reservaciones en segundo plano.
+    # Los eventos ya están guardados en la base de datos desde que la transacción de la
+    # reserva confirma; aquí solo se decide cuándo pasarlos a la bitácora definitiva.
+    def __init__(self, lote, intervalo, maximo):
+        self.lote = lote
+        self.intervalo = intervalo
+        self.maximo = maximo
+        self.pendientes = 0   # eventos registrados por este proceso aún sin mover (estimado)
+        self.movidos = 0
+        self.lotes = 0
+        self.esperas = 0      # veces que una ruta tuvo que esperar por la bandeja llena
+        self.errores = 0
+        self.ultimo_lote_ms = None
+        self._proximo_mantenimiento = 0
+        self._despertar = asyncio.Event()
+        self._vaciado = asyncio.Event()
+        self._tarea = None
+
+    def iniciar(self):
+        # Al arrancar se vacía también lo que haya quedado de una ejecución anterior
+        self._despertar.set()
+        self._tarea = asyncio.create_task(self._ejecutar())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        await self.vaciar()
+
+    async def registrado(self, eventos=1):
+        # Lo llaman las rutas después de una operación que escribe en la bitácora.
+        # Si la bandeja está llena, la ruta espera a que se vacíe un lote (contrapresión)
+        self.pendientes += eventos
+        if self.pendientes >= self.lote:
+            self._despertar.set()
+        while self.pendientes >= self.maximo and self._tarea:
+            self.esperas += 1
+            self._despertar.set()
+            await self._vaciado.wait()
+
+    async def vaciar(self):
+        # Mueve lotes hasta que la bandeja quede vacía
+        while True:
+            inicio = time.perf_counter()
+            async with conexion() as db:
+                fila = await db.fetchone("SELECT vaciar_bitacora_pendiente(%s) AS movidos;", (self.lote,))
+            movidos = fila["movidos"]
+            self.ultimo_lote_ms = round((time.perf_counter() - inicio) * 1000, 2)
+            self.movidos += movidos
+            self.lotes += 1
+            self.pendientes = max(self.pendientes - movidos, 0) if movidos == self.lote else 0
+            # Despierta a las rutas que esperaban espacio
+            self._vaciado.set()
+            self._vaciado = asyncio.Event()
+            if movidos < self.lote:
+                return
+
+    async def _ejecutar(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._despertar.wait(), self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+            self._despertar.clear()
+            try:
+                await self.vaciar()
+            except Exception:
+                self.errores += 1
+                log.exception("no se pudo vaciar la bitácora")
+            if time.monotonic() >= self._proximo_mantenimiento:
+                self._proximo_mantenimiento = time.monotonic() + BITACORA_MANTENIMIENTO
+                try:
+                    async with conexion() as db:
+                        await mantener_particiones(db)
+                except Exception:
+                    log.exception("no se pudieron mantener las particiones de la bitácora")
+
+    def metricas(self):
+        return {
+            "lote": self.lote,
+            "intervalo": self.intervalo,
+            "maximo": self.maximo,
+            "pendientes": self.pendientes,
+            "movidos": self.movidos,
+            "lotes": self.lotes,
+            "esperas": self.esperas,
+            "errores": self.errores,
+            "ultimo_lote_ms": self.ultimo_lote_ms,
+        }
+
+
+bitacora = Bitacora(BITACORA_LOTE, BITACORA_INTERVALO, BITACORA_MAXIMO)
@@ -0,0 +1,218 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # el backend compartido es opcional
+    redis = None
+
+from paginacion import _a_json
+
+# Entradas máximas en memoria (0 = sin caché) y segundos de vida de cada entrada
+CACHE_MAXIMO = int(os.getenv("CACHE_MAXIMO", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+# Con varios procesos cada uno tiene su propia caché y las invalidaciones se avisan a
+# los demás por NOTIFY (notificaciones.py); CACHE_URL (redis://...) hace que todos
+# compartan una sola
+CACHE_URL = os.getenv("CACHE_URL")
+
+
+class CacheLRU:
+    # Caché en memoria del proceso. Cada entrada guarda (vence, valor, etiquetas);
+    # invalidar una clave también elimina las entradas etiquetadas con ella
+    # (por ejemplo los pagos de una reserva cancelada)
+
+    # Función que avisa de cada invalidación a los demás procesos; la asigna notificaciones.py
+    difundir = None
+
+    def __init__(self, maximo, ttl):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._etiquetas = {}  # etiqueta -> claves que la llevan
+        self._lock = threading.Lock()
+        self._version = 0     # aumenta con cada invalidación
+        self.aciertos = 0
+        self.fallos = 0
+        self.expiradas = 0
+        self.desalojos = 0
+        self.invalidaciones = 0
+
+    def version(self):
+        return self._version
+
+    async def obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            if entrada[0] < time.monotonic():
+                self._quitar(clave)
+                self.expiradas += 1
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+
+    async def guardar(self, clave, valor, etiquetas=(), version=None):
+        with self._lock:
+            # Si hubo una invalidación mientras se consultaba la base de datos,
+            # el valor leído puede ser anterior a ella y no se guarda
+            if version is not None and version != self._version:
+                return
+            self._quitar(clave)
+            self._entradas[clave] = (time.monotonic() + self.ttl, valor, tuple(etiquetas))
+            for etiqueta in etiquetas:
+                self._etiquetas.setdefault(etiqueta, set()).add(clave)
+            while len(self._entradas) > self.maximo:
+                self._quitar(next(iter(self._entradas)))
+                self.desalojos += 1
+
+    async def invalidar(self, *claves):
+        self.descartar(claves)
+        if self.difundir:
+            self.difundir(claves)
+
+    def descartar(self, claves):
+        # Invalidación sin avisar a nadie: la usan también los avisos de otros procesos
+        with self._lock:
+            self._version += 1
+            for clave in claves:
+                self.invalidaciones += 1
+                self._quitar(clave)
+                for dependiente in self._etiquetas.pop(clave, ()):
+                    self._quitar(dependiente)
+
+    def vaciar(self):
+        with self._lock:
+            self._version += 1
+            self._entradas.clear()
+            self._etiquetas.clear()
+
+    def _quitar(self, clave):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is None:
+            return
+        for etiqueta in entrada[2]:
+            claves = self._etiquetas.get(etiqueta)
+            if claves:
+                claves.discard(clave)
+                if not claves:
+                    del self._etiquetas[etiqueta]
+
+    def metricas(self):
+        consultas = self.aciertos + self.fallos
+        return {
+            "backend": "memoria",
+            "maximo": self.maximo,
+            "ttl": self.ttl,
+            "entradas": len(self._entradas),
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else None,
+            "expiradas": self.expiradas,
+            "desalojos": self.desalojos,
+            "invalidaciones": self.invalidaciones,
+        }
+
+
+class CacheRedis:
+    # Caché compartida entre procesos. Redis se encarga del vencimiento (TTL) y del
+    # desalojo (maxmemory-policy); las etiquetas se guardan como conjuntos
+    PREFIJO = "hotel:cache:"
+
+    def __init__(self, url, ttl):
+        if redis is None:
+            raise RuntimeError("CACHE_URL requiere el paquete redis")
+        self.ttl = ttl
+        self._redis = redis.from_url(url)
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def version(self):
+        return None
+
+    async def obtener(self, clave):
+        valor = await self._redis.get(self.PREFIJO + clave)
+        if valor is None:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        return json.loads(valor)
+
+    async def guardar(self, clave, valor, etiquetas=(), version=None):
+        ttl = max(int(self.ttl), 1)
+        async with self._redis.pipeline(transaction=True) as p:
+            p.set(self.PREFIJO + clave, json.dumps(valor, default=_a_json), ex=ttl)
+            for etiqueta in etiquetas:
+                p.sadd(self.PREFIJO + "etiqueta:" + etiqueta, clave)
+                p.expire(self.PREFIJO + "etiqueta:" + etiqueta, ttl)
+            await p.execute()
+
+    async def invalidar(self, *claves):
+        for clave in claves:
+            self.invalidaciones += 1
+            etiqueta = self.PREFIJO + "etiqueta:" + clave
+            dependientes = await self._redis.smembers(etiqueta)
+            borrar = [self.PREFIJO + clave, etiqueta]
+            borrar += [self.PREFIJO + d.decode() for d in dependientes]
+            await self._redis.delete(*borrar)
+
+    def metricas(self):
+        consultas = self.aciertos + self.fallos
+        return {
+            "backend": "redis",
+            "ttl": self.ttl,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else None,
+            "invalidaciones": self.invalidaciones,
+        }
+
+
+class SinCache:
+    # CACHE_MAXIMO=0: todas las lecturas van a la base de datos
+    def version(self):
+        return None
+
+    async def obtener(self, clave):
+        return None
+
+    async def guardar(self, clave, valor, etiquetas=(), version=None):
+        pass
+
+    async def invalidar(self, *claves):
+        pass
+
+    def metricas(self):
+        return {"backend": "desactivada"}
+
+
+if CACHE_URL:
+    cache = CacheRedis(CACHE_URL, CACHE_TTL)
+elif CACHE_MAXIMO > 0:
+    cache = CacheLRU(CACHE_MAXIMO, CACHE_TTL)
+else:
+    cache = SinCache()
+
+
+async def leer(clave, consulta, etiquetas=None):
+    # Lectura a través de la caché: si la clave no está se ejecuta la consulta
+    # y se guarda el resultado (los "no encontrado" no se guardan). Cada entrada
+    # queda etiquetada con su entidad ("cliente" para "cliente:123") para poder
+    # invalidarlas todas tras una carga masiva
+    valor = await cache.obtener(clave)
+    if valor is not None:
+        return valor
+    version = cache.version()
+    valor = await consulta()
+    if valor is not None:
+        extra = etiquetas(valor) if etiquetas else []
+        await cache.guardar(clave, dict(valor), [clave.split(":")[0], *extra], version)
+    return valor
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import os
+from datetime import date, timedelta
+from conexion_BD import conexion
+
+log = logging.getLogger(__name__)
+
+# Días hacia adelante que cubre el calendario en memoria
+CALENDARIO_DIAS = int(os.getenv("CALENDARIO_DIAS", "730"))
+# Cada cuántos segundos se reconstruye desde la base de datos (0 = nunca).
+# Con varios procesos cada uno tiene su propio calendario; los cambios hechos en los
+# demás llegan por los avisos de notificar_habitacion (notificaciones.py) y la
+# reconstrucción periódica corrige lo que se haya perdido.
+CALENDARIO_REFRESCO = float(os.getenv("CALENDARIO_REFRESCO", "300"))
+
+# La tabla habitacion no guarda capacidad; se deriva del tipo
+CAPACIDAD_POR_TIPO = {"sencilla": 1, "doble": 2, "suite": 4}
+
+
+class CalendarioOcupacion:
+    # Ocupación por habitación y por noche: un bytearray por habitación donde la
+    # posición i cuenta las reservas activas de la noche inicio + i
+    def __init__(self, dias):
+        self.dias = dias
+        self.inicio = None
+        self.habitaciones = {}  # id_habitacion -> datos de la habitación
+        self.ocupacion = {}     # id_habitacion -> bytearray(dias)
+        self.reservas = {}      # id_reserva -> (id_habitacion, fecha_entrada, fecha_salida)
+        self.construido = None
+        self._bloqueo = None
+
+    @property
+    def bloqueo(self):
+        # Mientras se reconstruye, los cambios de otros procesos esperan y se aplican
+        # sobre el calendario nuevo (asyncio.Lock se crea dentro del loop)
+        if self._bloqueo is None:
+            self._bloqueo = asyncio.Lock()
+        return self._bloqueo
+
+    @property
+    def listo(self):
+        return self.inicio is not None
+
+    async def construir(self, db):
+        async with self.bloqueo:
+            await self._construir(db)
+
+    async def _construir(self, db):
+        # Se arma en estructuras nuevas y se reemplazan de una sola vez
+        inicio = date.today()
+        habitaciones = await db.fetchall("SELECT * FROM filtrar_habitaciones(NULL, NULL, NULL);")
+        reservas = await db.fetchall("SELECT * FROM reservas_activas_desde(%s);", (inicio,))
+
+        nuevo = CalendarioOcupacion(self.dias)
+        nuevo.inicio = inicio
+        for h in habitaciones:
+            nuevo._guardar_habitacion(h)
+        for r in reservas:
+            nuevo._agregar(r["id_reserva"], r["id_habitacion"], r["fecha_entrada"], r["fecha_salida"])
+
+        self.inicio = nuevo.inicio
+        self.habitaciones = nuevo.habitaciones
+        self.ocupacion = nuevo.ocupacion
+        self.reservas = nuevo.reservas
+        self.construido = date.today()
+
+    def _rango(self, fecha_entrada, fecha_salida):
+        i = max((fecha_entrada - self.inicio).days, 0)
+        j = min((fecha_salida - self.inicio).days, self.dias)
+        return i, j
+
+    def cubre(self, fecha_entrada, fecha_salida):
+        return self.listo and fecha_entrada >= self.inicio and (fecha_salida - self.inicio).days <= self.dias
+
+    def _guardar_habitacion(self, h):
+        self.habitaciones[h["id_habitacion"]] = {
+            "id_habitacion": h["id_habitacion"],
+            "numero": h["numero"],
+            "tipo": h["tipo"],
+            "disponibilidad": h["disponibilidad"],
+            "descripcion": h["descripcion"],
+            "caracteristicas": h["caracteristicas"],
+            "precio_noche": h["precio_noche"],
+        }
+        self.ocupacion.setdefault(h["id_habitacion"], bytearray(self.dias))
+
+    def _agregar(self, id_reserva, id_habitacion, fecha_entrada, fecha_salida):
+        # Una reserva que ya está se reemplaza: el mismo cambio puede llegar por la
+        # ruta y por el aviso
+        self._quitar(id_reserva)
+        noches = self.ocupacion.get(id_habitacion)
+        if noches is None:
+            return
+        i, j = self._rango(fecha_entrada, fecha_salida)
+        if i >= j:
+            return
+        for k in range(i, j):
+            noches[k] += 1
+        self.reservas[id_reserva] = (id_habitacion, fecha_entrada, fecha_salida)
+
+    def _quitar(self, id_reserva):
+        anterior = self.reservas.pop(id_reserva, None)
+        if anterior is None:
+            return
+        id_habitacion, fecha_entrada, fecha_salida = anterior
+        noches = self.ocupacion.get(id_habitacion)
+        if noches is None:
+            return
+        i, j = self._rango(fecha_entrada, fecha_salida)
+        for k in range(i, j):
+            if noches[k]:
+                noches[k] -= 1
+
+    # Cambios que informan las rutas de reservaciones y habitaciones
+
+    def reserva_creada(self, id_reserva, id_habitacion, fecha_entrada, fecha_salida):
+        if self.listo:
+            self._agregar(id_reserva, id_habitacion, fecha_entrada, fecha_salida)
+
+    def reserva_cancelada(self, id_reserva):
+        if self.listo:
+            self._quitar(id_reserva)
+
+    async def reserva_actualizada(self, db, id_reserva):
+        if not self.listo:
+            return
+        self._quitar(id_reserva)
+        r = await db.fetchone("SELECT * FROM obtener_reservacion(%s);", (id_reserva,))
+        if r:
+            self._agregar(r["id_reserva"], r["id_habitacion"], r["fecha_entrada"], r["fecha_salida"])
+
+    def habitacion_actualizada(self, id_habitacion, tipo, descripcion, disponibilidad, precio_noche):
+        h = self.habitaciones.get(id_habitacion)
+        if h:
+            h.update(tipo=tipo, descripcion=descripcion, disponibilidad=disponibilidad, precio_noche=precio_noche)
+
+    def habitacion_sincronizada(self, h):
+        # Fila de obtener_habitacion de una habitación creada o cambiada en otro proceso
+        if self.listo:
+            self._guardar_habitacion(h)
+
+    def habitacion_eliminada(self, id_habitacion):
+        self.habitaciones.pop(id_habitacion, None)
+        self.ocupacion.pop(id_habitacion, None)
+
+    async def recargar_habitaciones(self, db):
+        # crear_habitacion no devuelve el id; se vuelve a leer la lista de habitaciones
+        if not self.listo:
+            return
+        for h in await db.fetchall("SELECT * FROM filtrar_habitaciones(NULL, NULL, NULL);"):
+            self._guardar_habitacion(h)
+
+    # Consultas
+
+    def buscar(self, fecha_entrada, fecha_salida, tipo=None, huespedes=None, precio_maximo=None):
+        i, j = self._rango(fecha_entrada, fecha_salida)
+        resultado = []
+        for id_habitacion, h in self.habitaciones.items():
+            if tipo is not None and h["tipo"] != tipo:
+                continue
+            if h["disponibilidad"] == "en mantenimiento":
+                continue
+            if huespedes is not None and CAPACIDAD_POR_TIPO.get(h["tipo"], 0) < huespedes:
+                continue
+            if precio_maximo is not None and h["precio_noche"] > precio_maximo:
+                continue
+            if any(self.ocupacion[id_habitacion][i:j]):
+                continue
+            resultado.append(h)
+        resultado.sort(key=lambda h: h["id_habitacion"])
+        return resultado
+
+    async def verificar(self, db):
+        # Compara el calendario contra uno recién construido desde la base de datos
+        if not self.listo:
+            return {"consistente": False, "detalle": "El calendario aún no se ha construido"}
+        referencia = CalendarioOcupacion(self.dias)
+        await referencia.construir(db)
+        diferencias = []
+        for id_habitacion in set(self.ocupacion) | set(referencia.ocupacion):
+            propias = self.ocupacion.get(id_habitacion)
+            esperadas = referencia.ocupacion.get(id_habitacion)
+            if propias is None or esperadas is None:
+                diferencias.append({"id_habitacion": id_habitacion, "motivo": "habitación faltante o sobrante"})
+                continue
+            desfase = (referencia.inicio - self.inicio).days
+            for k in range(self.dias - desfase):
+                if propias[k + desfase] != esperadas[k]:
+                    diferencias.append({
+                        "id_habitacion": id_habitacion,
+                        "fecha": (referencia.inicio + timedelta(days=k)).isoformat(),
+                        "calendario": propias[k + desfase],
+                        "base_de_datos": esperadas[k],
+                    })
+        return {
+            "consistente": not diferencias,
+            "habitaciones": len(referencia.habitaciones),
+            "reservas_activas": len(referencia.reservas),
+            "diferencias": diferencias[:100],
+        }
+
+
+calendario = CalendarioOcupacion(CALENDARIO_DIAS)
+
+
+async def refrescar_periodicamente():
+    # Reconstruye el calendario cada CALENDARIO_REFRESCO segundos
+    while True:
+        await asyncio.sleep(CALENDARIO_REFRESCO)
+        try:
+            async with conexion() as db:
+                await calendario.construir(db)
+        except Exception:
+            log.exception("no se pudo refrescar el calendario")
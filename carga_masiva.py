@@ -0,0 +1,149 @@
+"""Carga masiva de clientes, habitaciones y servicios con COPY.
+
+Uso desde la línea de comandos:
+    python carga_masiva.py clientes clientes.csv
+    python carga_masiva.py habitaciones habitaciones.ndjson
+    python carga_masiva.py servicios servicios.csv --formato csv
+
+El archivo se copia como texto a una tabla temporal y la función
+cargar_<entidad>_staging() valida cada fila igual que los procedimientos
+almacenados, inserta (o actualiza) las válidas y devuelve las rechazadas.
+Las mismas cargas están disponibles en POST /cliente/lote, /habitaciones/lote
+y /servicios/lote.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import tempfile
+import time
+
+from starlette.concurrency import run_in_threadpool
+from conexion_BD import conexion, abrir_pools, cerrar_pools
+
+# Bytes del archivo que se mantienen en memoria antes de pasar a disco
+MEMORIA_MAXIMA = 8 * 1024 * 1024
+# Filas rechazadas que se devuelven en el detalle
+MAXIMO_RECHAZOS = 1000
+
+ENTIDADES = {
+    "clientes": {
+        "staging": "stg_cliente",
+        "funcion": "cargar_clientes_staging",
+        "columnas": [
+            "documento_identidad", "nombre", "nacionalidad", "telefono", "email",
+            "fecha_nacimiento", "contratos", "facturacion_electronica",
+        ],
+    },
+    "habitaciones": {
+        "staging": "stg_habitacion",
+        "funcion": "cargar_habitaciones_staging",
+        "columnas": [
+            "numero", "tipo", "descripcion", "disponibilidad", "caracteristicas",
+            "temporada", "promociones_especiales", "precio_noche",
+        ],
+    },
+    "servicios": {
+        "staging": "stg_servicio",
+        "funcion": "cargar_servicios_staging",
+        "columnas": [
+            "documento_identidad", "nombre_servicio", "disponible", "horario",
+            "precio_unitario", "promociones", "servicios_extra", "ofertas_personalizadas",
+        ],
+    },
+}
+
+
+def _archivo_temporal():
+    return tempfile.SpooledTemporaryFile(max_size=MEMORIA_MAXIMA, mode="w+b")
+
+
+def _linea_csv(valores):
+    salida = io.StringIO()
+    csv.writer(salida).writerow(valores)
+    return salida.getvalue().encode("utf-8")
+
+
+def preparar_csv(archivo, formato, columnas):
+    # Devuelve un CSV con encabezado listo para COPY y las columnas en el orden del archivo
+    if formato == "csv":
+        encabezado = archivo.readline().decode("utf-8-sig")
+        columnas_archivo = [c.strip() for c in next(csv.reader([encabezado]))]
+        desconocidas = [c for c in columnas_archivo if c not in columnas]
+        if desconocidas:
+            raise ValueError(f"Columnas desconocidas: {', '.join(desconocidas)}")
+        archivo.seek(0)
+        return archivo, columnas_archivo
+
+    # NDJSON: un objeto por línea, se reescribe como CSV con las columnas conocidas
+    salida = _archivo_temporal()
+    salida.write(_linea_csv(columnas))
+    for numero, linea in enumerate(archivo, start=1):
+        if not linea.strip():
+            continue
+        try:
+            fila = json.loads(linea)
+        except ValueError:
+            raise ValueError(f"La línea {numero} no es JSON válido")
+        salida.write(_linea_csv(["" if fila.get(c) is None else fila.get(c) for c in columnas]))
+    salida.seek(0)
+    return salida, columnas
+
+
+async def recibir(request):
+    # Guarda el cuerpo de la petición a medida que llega (en memoria o en disco si es grande)
+    archivo = _archivo_temporal()
+    async for bloque in request.stream():
+        archivo.write(bloque)
+    archivo.seek(0)
+    return archivo
+
+
+async def cargar(db, entidad, archivo, formato="csv"):
+    conf = ENTIDADES[entidad]
+    inicio = time.perf_counter()
+    archivo, columnas = await run_in_threadpool(preparar_csv, archivo, formato, conf["columnas"])
+    definicion = ", ".join(f"{c} TEXT" for c in conf["columnas"])
+    async with db.transaccion():
+        await db.execute(
+            f"CREATE TEMP TABLE {conf['staging']} (linea BIGSERIAL, motivo TEXT, {definicion}) ON COMMIT DROP;"
+        )
+        await db.copy_desde(conf["staging"], columnas, archivo)
+        total = (await db.fetchone(f"SELECT count(*) AS total FROM {conf['staging']};"))["total"]
+        rechazadas = await db.fetchall(f"SELECT * FROM {conf['funcion']}();")
+    segundos = time.perf_counter() - inicio
+    return {
+        "filas": total,
+        "cargadas": total - len(rechazadas),
+        "rechazadas": len(rechazadas),
+        "detalle_rechazos": [{"fila": r["linea"], "motivo": r["motivo"]} for r in rechazadas[:MAXIMO_RECHAZOS]],
+        "segundos": round(segundos, 3),
+        "filas_por_segundo": round(total / segundos, 1) if segundos > 0 else None,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("entidad", choices=sorted(ENTIDADES))
+    parser.add_argument("archivo")
+    parser.add_argument("--formato", choices=["csv", "ndjson"])
+    args = parser.parse_args()
+    formato = args.formato or ("ndjson" if args.archivo.endswith((".ndjson", ".jsonl")) else "csv")
+
+    await abrir_pools()
+    try:
+        with open(args.archivo, "rb") as archivo:
+            async with conexion() as db:
+                resultado = await cargar(db, args.entidad, archivo, formato)
+    finally:
+        await cerrar_pools()
+
+    print(f"filas: {resultado['filas']}  cargadas: {resultado['cargadas']}  rechazadas: {resultado['rechazadas']}")
+    print(f"tiempo: {resultado['segundos']} s  ({resultado['filas_por_segundo']} filas/s)")
+    for r in resultado["detalle_rechazos"]:
+        print(f"  fila {r['fila']}: {r['motivo']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
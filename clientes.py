@@ -1,30 +1,83 @@
-from fastapi import APIRouter, HTTPException, Depends
+import os
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
 from pydantic import BaseModel
 from datetime import date
-from conexion_BD import get_connection
-import psycopg2.extras
+from typing import Optional, Literal, List
+from conexion_BD import get_db, get_db_lectura, consultar_uno, error_http
+from cache import cache, leer
+from carga_masiva import recibir, cargar
+from paginacion import paginar, respuesta_ndjson, columnas, a_bytes, RespuestaJSON, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
 
 router = APIRouter()
 
+# Documentos por petición en POST /cliente/folios
+FOLIOS_MAX = int(os.getenv("FOLIOS_MAX", "500"))
+
 # Modelo de entrada para POST y PUT
 class ClienteRequest(BaseModel):
     nombre: str
-    email: str         
+    email: str
     telefono: str
     documento_identidad: str
     nacionalidad: str
-    fecha_nacimiento: date 
+    fecha_nacimiento: date
     contratos: str
     facturacion_electronica: str
 
+# Modelos de respuesta (documentación de la API; las filas se envían sin validar)
+class Cliente(BaseModel):
+    documento_identidad: str
+    nombre: Optional[str] = None
+    nacionalidad: Optional[str] = None
+    telefono: Optional[str] = None
+    correo: Optional[str] = None
+    fecha_nacimiento: Optional[date] = None
+
+class ClienteEncontrado(Cliente):
+    relevancia: float
+
+class ClienteSugerido(BaseModel):
+    documento_identidad: str
+    nombre: Optional[str] = None
+    correo: Optional[str] = None
+
+class FolioReserva(BaseModel):
+    id_reserva: int
+    id_habitacion: Optional[int] = None
+    numero: Optional[int] = None
+    tipo: Optional[str] = None
+    fecha_entrada: date
+    fecha_salida: date
+    estado_reserva: Optional[str] = None
+    noches: int
+    precio_noche: Optional[float] = None
+    cargo: float
+    pagada: bool
+
+class Folio(BaseModel):
+    documento_identidad: str
+    nombre: Optional[str] = None
+    reservas: List[FolioReserva]
+    servicios: List[dict]
+    pagos: List[dict]
+    cargo_noches: float
+    cargo_servicios: float
+    pagado: float
+    reembolsos: float
+    saldo: float
+
+class FoliosRequest(BaseModel):
+    documentos: List[str]
+
+class Folios(BaseModel):
+    folios: List[Folio]
+    no_encontrados: List[str]
+
 # Crear cliente
 @router.post("/cliente")
-def crear_cliente(data: ClienteRequest):
-    conn = get_connection()
-    cur = conn.cursor()
+async def crear_cliente(data: ClienteRequest, db=Depends(get_db)):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("""
+        await db.execute("""
             CALL crear_cliente(%s, %s, %s, %s, %s, %s, %s, %s);
         """, (
             data.documento_identidad,
@@ -36,41 +89,88 @@ def crear_cliente(data: ClienteRequest):
             data.facturacion_electronica,
             data.fecha_nacimiento
         ))
-        conn.commit()
+        await cache.invalidar(f"cliente:{data.documento_identidad}")
         return {"mensaje": "Cliente creado exitosamente"}
     except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
-
-# Obtener cliente individual
-@router.get("/cliente/{id_cliente}")
-def obtener_cliente(id_cliente: str):
-    conn = get_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        raise error_http(e)
+
+# Carga masiva de clientes desde CSV o NDJSON (ver carga_masiva.py)
+@router.post("/cliente/lote")
+async def cargar_clientes(request: Request, formato: Literal["csv", "ndjson"] = Query("csv"), db=Depends(get_db)):
+    try:
+        archivo = await recibir(request)
+        resultado = await cargar(db, "clientes", archivo, formato)
+        await cache.invalidar("cliente")
+        return resultado
+    except Exception as e:
+        raise error_http(e)
+
+# Autocompletado por prefijo de nombre o correo (declarada antes de /cliente/{id_cliente})
+@router.get("/cliente/autocompletar", response_model=List[ClienteSugerido])
+async def autocompletar_clientes(
+    prefijo: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=50),
+    db=Depends(get_db_lectura)
+):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("SELECT * FROM obtener_cliente(%s);", (id_cliente,))
-        cliente = cur.fetchone()
-        if not cliente:
-            raise HTTPException(status_code=404, detail="Cliente no encontrado")
-        return cliente
+        return RespuestaJSON(await db.fetchall("SELECT * FROM autocompletar_clientes(%s, %s);", (prefijo, limit)))
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
+
+# Folios de varios clientes a la vez (auditoría nocturna), en una sola consulta.
+# Declarada antes de /cliente/{id_cliente}
+@router.post("/cliente/folios", response_model=Folios)
+async def folios_clientes(data: FoliosRequest, db=Depends(get_db_lectura)):
+    documentos = list(dict.fromkeys(data.documentos))
+    if len(documentos) > FOLIOS_MAX:
+        raise HTTPException(status_code=400, detail=f"Máximo {FOLIOS_MAX} documentos por petición")
+    try:
+        filas = await db.fetchall(
+            "SELECT documento_identidad, folio::TEXT AS folio FROM folio_clientes(%s::VARCHAR[]);",
+            (documentos,)
+        )
+    except Exception as e:
+        raise error_http(e)
+    # Los folios ya vienen en JSON desde la base de datos: se concatenan sin volver a convertirlos
+    encontrados = {f["documento_identidad"] for f in filas}
+    no_encontrados = a_bytes([d for d in documentos if d not in encontrados])
+    folios = b",".join(f["folio"].encode("utf-8") for f in filas)
+    cuerpo = b'{"folios":[' + folios + b'],"no_encontrados":' + no_encontrados + b"}"
+    return Response(cuerpo, media_type="application/json")
+
+@router.get("/cliente/{id_cliente}", response_model=Cliente)
+async def obtener_cliente(id_cliente: str):
+    try:
+        cliente = await leer(
+            f"cliente:{id_cliente}",
+            lambda: consultar_uno("SELECT * FROM obtener_cliente(%s);", (id_cliente,))
+        )
+    except Exception as e:
+        raise error_http(e)
+    if not cliente:
+        raise HTTPException(status_code=404, detail="Cliente no encontrado")
+    return RespuestaJSON(cliente)
+
+# Folio para el checkout: reservas con sus cargos por noche, servicios consumidos,
+# pagos y saldo en una sola consulta (ver folio_clientes)
+@router.get("/cliente/{id_cliente}/folio", response_model=Folio)
+async def folio_cliente(id_cliente: str, db=Depends(get_db_lectura)):
+    try:
+        fila = await db.fetchone(
+            "SELECT folio::TEXT AS folio FROM folio_clientes(%s::VARCHAR[]);",
+            ([id_cliente],)
+        )
+    except Exception as e:
+        raise error_http(e)
+    if not fila:
+        raise HTTPException(status_code=404, detail="Cliente no encontrado")
+    return Response(fila["folio"], media_type="application/json")
 
 # Actualizar cliente
 @router.put("/cliente/{id_cliente}")
-def actualizar_cliente(id_cliente: str, data: ClienteRequest):
-    conn = get_connection()
-    cur = conn.cursor()
+async def actualizar_cliente(id_cliente: str, data: ClienteRequest, db=Depends(get_db)):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("""
+        await db.execute("""
             CALL actualizar_cliente(%s, %s, %s, %s, %s, %s);
         """, (
             id_cliente,
@@ -80,45 +180,53 @@ def actualizar_cliente(id_cliente: str, data: ClienteRequest):
             data.email,
             data.fecha_nacimiento
         ))
-        conn.commit()
+        await cache.invalidar(f"cliente:{id_cliente}")
         return {"mensaje": "Cliente actualizado exitosamente"}
     except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
 
 # Eliminar cliente (solo si no tiene reservas activas)
 @router.delete("/cliente/{id_cliente}")
-def eliminar_cliente(id_cliente: str):
-    conn = get_connection()
-    cur = conn.cursor()
+async def eliminar_cliente(id_cliente: str, db=Depends(get_db)):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("""
+        await db.execute("""
             CALL eliminar_cliente(%s);
         """, (id_cliente,))
-        conn.commit()
+        await cache.invalidar(f"cliente:{id_cliente}")
         return {"mensaje": "Cliente eliminado exitosamente"}
     except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
-
-# Buscar clientes con filtros opcionales
-@router.get("/cliente")
-def listar_clientes(nombre: str = None, email: str = None, nacionalidad: str = None):
-    conn = get_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        raise error_http(e)
+
+# Buscar clientes con filtros opcionales, paginado por documento (limit/after)
+# o completo como NDJSON con formato=ndjson.
+# Con q se hace una búsqueda por relevancia en nombre y correo (tolera errores de
+# escritura) y se devuelven solo los `limit` mejores resultados.
+# fields=nombre,correo devuelve solo esas columnas (más documento_identidad)
+@router.get("/cliente", response_model=List[Cliente])
+async def listar_clientes(
+    q: Optional[str] = Query(None, min_length=3),
+    nombre: str = None,
+    email: str = None,
+    nacionalidad: str = None,
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    after: Optional[str] = Query(None),
+    formato: Literal["json", "ndjson"] = Query("json"),
+    fields: Optional[str] = Query(None, description="Columnas separadas por comas"),
+    db=Depends(get_db_lectura)
+):
+    if q is not None:
+        sql = f"SELECT {columnas(fields, ClienteEncontrado)} FROM buscar_clientes(%s, %s);"
+        try:
+            return RespuestaJSON(await db.fetchall(sql, (q, limit or 20)))
+        except Exception as e:
+            raise error_http(e)
+
+    sql = f"SELECT {columnas(fields, Cliente, 'documento_identidad')} FROM filtrar_clientes(%s, %s, %s, %s, %s);"
+    if formato == "ndjson":
+        return respuesta_ndjson(db, sql, (nombre, email, nacionalidad, after, limit))
+    limite = limit or LIMITE_POR_DEFECTO
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("SELECT * FROM filtrar_clientes(%s, %s, %s);", (nombre, email, nacionalidad))
-        return cur.fetchall()
+        clientes = await db.fetchall(sql, (nombre, email, nacionalidad, after, limite))
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
+    return paginar(clientes, limite, "documento_identidad")
@@ -1,10 +1,805 @@
+import asyncio
+import itertools
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.extras
+from fastapi import HTTPException, Request, Response
+from starlette.concurrency import run_in_threadpool
+import metricas
+
+try:
+    import asyncpg
+except ImportError:  # solo se necesita con DB_MODO=async
+    asyncpg = None
+
+log = logging.getLogger(__name__)
+
+# Parámetros de conexión (se pueden sobreescribir con variables de entorno)
+DB_CONFIG = {
+    "dbname": os.getenv("DB_NAME", "proyecto 02"),
+    "user": os.getenv("DB_USER", "caleb"),
+    "password": os.getenv("DB_PASSWORD", "7741"),
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": os.getenv("DB_PORT", "5433"),
+}
+
+# Esquema con las tablas y procedimientos del hotel
+DB_SCHEMA = os.getenv("DB_SCHEMA", "sch_reservas_hotel")
+
+# Driver a usar: "sync" (psycopg2 en el threadpool) o "async" (asyncpg)
+DB_MODO = os.getenv("DB_MODO", "sync")
+
+# Configuración del pool de conexiones
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))  # segundos esperando una conexión libre
+POOL_VERIFICAR_TRAS = float(os.getenv("DB_POOL_VERIFICAR_TRAS", "30"))  # segundos inactiva antes de verificarla
+
+# Réplicas de solo lectura, "host:puerto" separadas por comas (misma base, usuario y
+# contraseña que la primaria). Sin réplicas todo va a la primaria
+DB_REPLICAS = [r.strip() for r in os.getenv("DB_REPLICAS", "").split(",") if r.strip()]
+REPLICA_RETRASO_MAX = float(os.getenv("DB_REPLICA_RETRASO_MAX", "5"))  # segundos de atraso tolerados
+REPLICA_REVISION = float(os.getenv("DB_REPLICA_REVISION", "2"))  # segundos entre mediciones del atraso
+# Segundos que las lecturas de un cliente van a la primaria después de que escribió
+LECTURA_PROPIA = float(os.getenv("DB_LECTURA_PROPIA", "5"))
+COOKIE_ESCRITURA = "bd_escritura"
+ESCRITURAS = {"POST", "PUT", "PATCH", "DELETE"}
 
-def get_connection():
-    return psycopg2.connect(
-        dbname="proyecto 02",
-        user="caleb",
-        password="7741",
-        host="localhost",
-        port="5433"
+# Sentencias preparadas que guarda cada conexión (0 = no preparar)
+SENTENCIAS_MAX = int(os.getenv("DB_SENTENCIAS_PREPARADAS", "100"))
+
+# Milisegundos que puede tardar una sentencia antes de que el servidor la cancele (0 = sin límite)
+STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))
+# Segundos que se sugieren en Retry-After cuando la base de datos está saturada
+REINTENTO = 1
+
+
+class ConexionPreparada(psycopg2.extensions.connection):
+    # Conexión de psycopg2 que recuerda las sentencias que ya preparó en el servidor
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparadas = OrderedDict()  # texto de la sentencia -> nombre ("" = no se puede preparar)
+        self.siguiente = 0
+
+
+def get_connection(config=None):
+    # Abre una conexión física nueva (la usa el pool para crear sus conexiones).
+    # El search_path viaja en el arranque de la conexión, así las rutas no
+    # necesitan ejecutar SET search_path en cada petición.
+    conn = psycopg2.connect(
+        **(config or DB_CONFIG),
+        options=f"-c search_path={DB_SCHEMA} -c statement_timeout={STATEMENT_TIMEOUT}",
+        connection_factory=ConexionPreparada,
     )
+    # Cada ruta ejecuta una sola sentencia (CALL o SELECT), que ya es atómica por
+    # sí misma; en autocommit se evitan los viajes extra de BEGIN/COMMIT.
+    conn.autocommit = True
+    return conn
+
+
+class PoolAgotado(Exception):
+    pass
+
+
+def _errores(modulo, *nombres):
+    return tuple(getattr(modulo, n) for n in nombres if modulo is not None and hasattr(modulo, n))
+
+
+# Sentencias canceladas por statement_timeout
+ERRORES_TIEMPO = (psycopg2.errors.QueryCanceled,) + _errores(asyncpg, "QueryCanceledError")
+# La base de datos no puede atender ahora (sin conexiones, caída, reiniciando, bloqueos
+# o serialización): reintentar más tarde puede funcionar. En psycopg2 todos son
+# OperationalError; los errores de los procedimientos (RAISE EXCEPTION) no lo son
+ERRORES_SATURACION = (PoolAgotado, psycopg2.OperationalError, psycopg2.InterfaceError) + _errores(
+    asyncpg, "PostgresConnectionError", "TooManyConnectionsError", "CannotConnectNowError",
+    "OperatorInterventionError", "TransactionRollbackError", "LockNotAvailableError",
+    "InterfaceError", "ConnectionDoesNotExistError",
+) + (ConnectionError, asyncio.TimeoutError)
+
+
+def error_http(e, estado=400):
+    # Respuesta para el error de una ruta: la saturación de la base de datos es 503 con
+    # Retry-After y una sentencia cancelada por tiempo es 504; los demás errores usan el
+    # estado de la ruta (400 por defecto). Las HTTPException se dejan pasar
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, ERRORES_TIEMPO):
+        return HTTPException(status_code=504, detail=f"La consulta tardó demasiado: {e}")
+    if isinstance(e, ERRORES_SATURACION):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(REINTENTO)})
+    return HTTPException(status_code=estado, detail=str(e))
+
+
+class PoolConexiones:
+    def __init__(self, minimo, maximo, timeout, verificar_tras, config=None):
+        self.config = config  # None = la primaria (DB_CONFIG)
+        self.minimo = minimo
+        self.maximo = maximo
+        self.timeout = timeout
+        self.verificar_tras = verificar_tras
+        self._libres = deque()  # (conexion, momento en que se devolvió)
+        self._cond = threading.Condition()
+        self._total = 0
+        self._cerrado = False
+        # Métricas
+        self.en_uso = 0
+        self.esperando = 0
+        self.prestamos = 0
+        self.timeouts = 0
+        self.descartadas = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    def abrir(self):
+        with self._cond:
+            self._cerrado = False
+            faltantes = self.minimo - self._total
+            self._total += max(faltantes, 0)
+        for _ in range(max(faltantes, 0)):
+            try:
+                conn = get_connection(self.config)
+            except Exception:
+                with self._cond:
+                    self._total -= 1
+                raise
+            with self._cond:
+                self._libres.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def cerrar(self):
+        with self._cond:
+            self._cerrado = True
+            libres = list(self._libres)
+            self._libres.clear()
+            self._total -= len(libres)
+            self._cond.notify_all()
+        for conn, _ in libres:
+            conn.close()
+
+    def obtener(self):
+        inicio = time.monotonic()
+        limite = inicio + self.timeout
+        conn, ultimo_uso = None, None
+        with self._cond:
+            self.esperando += 1
+            try:
+                while True:
+                    if self._cerrado:
+                        raise PoolAgotado("El pool de conexiones está cerrado")
+                    if self._libres:
+                        # LIFO: se reutiliza la conexión usada más recientemente
+                        conn, ultimo_uso = self._libres.pop()
+                        break
+                    if self._total < self.maximo:
+                        self._total += 1
+                        break
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        self.timeouts += 1
+                        raise PoolAgotado(
+                            f"No hay conexiones disponibles tras {self.timeout}s (máximo {self.maximo})"
+                        )
+                    self._cond.wait(restante)
+            finally:
+                self.esperando -= 1
+
+        # La conexión se crea o verifica fuera del lock para no bloquear a los demás
+        try:
+            if conn is not None and not self._sana(conn, ultimo_uso):
+                self._descartar(conn)
+                conn = None
+            if conn is None:
+                conn = get_connection(self.config)
+        except Exception:
+            with self._cond:
+                self._total -= 1
+                self._cond.notify()
+            raise
+
+        espera = time.monotonic() - inicio
+        metricas.espera_conexion.observar(espera)
+        with self._cond:
+            self.en_uso += 1
+            self.prestamos += 1
+            self.espera_total += espera
+            self.espera_max = max(self.espera_max, espera)
+        return conn
+
+    def devolver(self, conn):
+        try:
+            if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            pass
+        with self._cond:
+            self.en_uso -= 1
+            if conn.closed or self._cerrado:
+                self._total -= 1
+                cerrar = not conn.closed
+            else:
+                self._libres.append((conn, time.monotonic()))
+                cerrar = False
+            self._cond.notify()
+        if cerrar:
+            conn.close()
+
+    def _sana(self, conn, ultimo_uso):
+        if conn.closed:
+            return False
+        if time.monotonic() - ultimo_uso < self.verificar_tras:
+            return True
+        # Conexión inactiva por mucho tiempo: verificar que el servidor siga respondiendo
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _descartar(self, conn):
+        self.descartadas += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def metricas(self):
+        with self._cond:
+            return {
+                "minimo": self.minimo,
+                "maximo": self.maximo,
+                "abiertas": self._total,
+                "libres": len(self._libres),
+                "en_uso": self.en_uso,
+                "esperando": self.esperando,
+                "prestamos": self.prestamos,
+                "timeouts": self.timeouts,
+                "descartadas": self.descartadas,
+                "espera_promedio_ms": round(self.espera_total / self.prestamos * 1000, 3) if self.prestamos else 0.0,
+                "espera_max_ms": round(self.espera_max * 1000, 3),
+            }
+
+
+pool = PoolConexiones(POOL_MIN, POOL_MAX, POOL_TIMEOUT, POOL_VERIFICAR_TRAS)
+
+
+class PoolAsync:
+    # Pool de asyncpg con las mismas métricas que PoolConexiones
+    def __init__(self, minimo, maximo, timeout, verificar_tras, config=None):
+        self.config = config or DB_CONFIG
+        self.minimo = minimo
+        self.maximo = maximo
+        self.timeout = timeout
+        self.verificar_tras = verificar_tras
+        self._pool = None
+        self.en_uso = 0
+        self.esperando = 0
+        self.prestamos = 0
+        self.timeouts = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+
+    async def abrir(self):
+        if asyncpg is None:
+            raise RuntimeError("DB_MODO=async requiere tener instalado asyncpg")
+        self._pool = await asyncpg.create_pool(
+            database=self.config["dbname"],
+            user=self.config["user"],
+            password=self.config["password"],
+            host=self.config["host"],
+            port=int(self.config["port"]),
+            min_size=self.minimo,
+            max_size=self.maximo,
+            max_inactive_connection_lifetime=self.verificar_tras,
+            # asyncpg prepara cada sentencia (también los CALL) y guarda las últimas por conexión
+            statement_cache_size=SENTENCIAS_MAX,
+            server_settings={"search_path": DB_SCHEMA, "statement_timeout": str(STATEMENT_TIMEOUT)},
+        )
+
+    @property
+    def abierto(self):
+        return self._pool is not None
+
+    async def cerrar(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def obtener(self):
+        if self._pool is None:
+            raise PoolAgotado("El pool de conexiones está cerrado")
+        inicio = time.monotonic()
+        self.esperando += 1
+        try:
+            conn = await self._pool.acquire(timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise PoolAgotado(f"No hay conexiones disponibles tras {self.timeout}s (máximo {self.maximo})")
+        finally:
+            self.esperando -= 1
+        espera = time.monotonic() - inicio
+        metricas.espera_conexion.observar(espera)
+        self.en_uso += 1
+        self.prestamos += 1
+        self.espera_total += espera
+        self.espera_max = max(self.espera_max, espera)
+        return conn
+
+    async def devolver(self, conn):
+        self.en_uso -= 1
+        await self._pool.release(conn)
+
+    def metricas(self):
+        return {
+            "minimo": self.minimo,
+            "maximo": self.maximo,
+            "abiertas": self._pool.get_size() if self._pool else 0,
+            "libres": self._pool.get_idle_size() if self._pool else 0,
+            "en_uso": self.en_uso,
+            "esperando": self.esperando,
+            "prestamos": self.prestamos,
+            "timeouts": self.timeouts,
+            "espera_promedio_ms": round(self.espera_total / self.prestamos * 1000, 3) if self.prestamos else 0.0,
+            "espera_max_ms": round(self.espera_max * 1000, 3),
+        }
+
+
+pool_async = PoolAsync(POOL_MIN, POOL_MAX, POOL_TIMEOUT, POOL_VERIFICAR_TRAS)
+
+
+def _placeholders_asyncpg(sql):
+    # asyncpg usa $1, $2... en lugar de %s
+    contador = itertools.count(1)
+    return re.sub(r"%s", lambda _: f"${next(contador)}", sql)
+
+
+# PREPARE solo admite estas sentencias; los CALL se envían siempre completos
+_PREPARABLE = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE|VALUES|WITH)\b", re.IGNORECASE)
+
+
+# Errores de PREPARE que se repetirían siempre con el mismo texto
+_SIN_PREPARAR = (
+    psycopg2.errors.SyntaxError,
+    psycopg2.errors.IndeterminateDatatype,
+    psycopg2.errors.AmbiguousParameter,
+)
+
+
+def _preparar(conn, sql, params):
+    # Nombre de la sentencia preparada para sql en esta conexión (la prepara la primera
+    # vez) o None si se debe ejecutar sin preparar
+    preparadas = getattr(conn, "preparadas", None)
+    if preparadas is None or not SENTENCIAS_MAX or not isinstance(params, (tuple, list)):
+        return None
+    nombre = preparadas.get(sql)
+    if nombre is not None:
+        preparadas.move_to_end(sql)
+        return nombre or None
+    # Dentro de una transacción un PREPARE fallido la abortaría: solo se prepara en autocommit
+    if not conn.autocommit or "%(" in sql or not _PREPARABLE.match(sql):
+        return None
+    contador = itertools.count(1)
+    texto = re.sub(r"%%|%s", lambda m: "%" if m.group() == "%%" else f"${next(contador)}", sql)
+    nombre = f"api_{conn.siguiente}"
+    conn.siguiente += 1
+    cur = conn.cursor()
+    try:
+        cur.execute(f"PREPARE {nombre} AS {texto}")
+    except _SIN_PREPARAR:
+        # Falla por el texto mismo (varias sentencias, un parámetro cuyo tipo el servidor
+        # no puede deducir): queda sin preparar para siempre
+        nombre = ""
+    except psycopg2.Error:
+        # Otros errores pueden pasar (una tabla o función que aún no existe, la conexión):
+        # no se recuerda nada y la próxima llamada vuelve a intentarlo
+        cur.close()
+        return None
+    preparadas[sql] = nombre
+    if len(preparadas) > SENTENCIAS_MAX:
+        _, viejo = preparadas.popitem(last=False)
+        if viejo:
+            cur.execute(f"DEALLOCATE {viejo}")
+    cur.close()
+    return nombre or None
+
+
+def ejecutar(cur, sql, params=()):
+    # Ejecuta sql en el cursor usando la sentencia preparada de su conexión: el servidor
+    # analiza y planifica el texto una vez y luego solo recibe EXECUTE con los parámetros
+    conn = cur.connection
+    nueva = sql not in getattr(conn, "preparadas", ())
+    nombre = _preparar(conn, sql, params)
+    if nombre is None:
+        metricas.sentencias_preparadas.inc("sin_preparar")
+        cur.execute(sql, params)
+        return
+    argumentos = f"({', '.join(['%s'] * len(params))})" if params else ""
+    try:
+        cur.execute(f"EXECUTE {nombre}{argumentos};", params)
+    except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.FeatureNotSupported):
+        # La sentencia ya no existe en el servidor o se recreó la función y cambió su
+        # resultado ("cached plan must not change result type"): se vuelve a preparar
+        conn.preparadas.pop(sql, None)
+        if not conn.autocommit:
+            raise
+        cur.execute(sql, params)
+    metricas.sentencias_preparadas.inc("preparada" if nueva else "reutilizada")
+
+
+class BDSync:
+    # Ejecuta las consultas con psycopg2 en el threadpool para no bloquear el event loop
+    def __init__(self, conn, lectura=False):
+        self.conn = conn
+        self.lectura = lectura  # True si la conexión es de una réplica
+        self.pool = None        # pool al que vuelve (lo asigna conexion())
+        self.cedida = False     # True si la devuelve stream() y no conexion()
+
+    def _ejecutar(self, sql, params, modo):
+        cur = self.conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            with metricas.medir_consulta(sql):
+                ejecutar(cur, sql, params)
+                if modo == "uno":
+                    return cur.fetchone()
+                if modo == "todos":
+                    return cur.fetchall()
+        finally:
+            cur.close()
+
+    async def fetchone(self, sql, params=()):
+        return await run_in_threadpool(self._ejecutar, sql, params, "uno")
+
+    async def fetchall(self, sql, params=()):
+        return await run_in_threadpool(self._ejecutar, sql, params, "todos")
+
+    async def execute(self, sql, params=()):
+        await run_in_threadpool(self._ejecutar, sql, params, None)
+
+    def _copiar(self, tabla, columnas, archivo):
+        cur = self.conn.cursor()
+        sql = f"COPY {tabla} ({', '.join(columnas)}) FROM STDIN WITH (FORMAT csv, HEADER true)"
+        try:
+            with metricas.medir_consulta(sql):
+                cur.copy_expert(sql, archivo)
+        finally:
+            cur.close()
+
+    async def copy_desde(self, tabla, columnas, archivo):
+        # Carga un CSV con encabezado (archivo binario) usando COPY
+        await run_in_threadpool(self._copiar, tabla, columnas, archivo)
+
+    @asynccontextmanager
+    async def transaccion(self):
+        # Agrupa varias sentencias en una transacción (fuera de ella rige el autocommit)
+        self.conn.autocommit = False
+        try:
+            yield self
+            await run_in_threadpool(self.conn.commit)
+        except BaseException:
+            await run_in_threadpool(self.conn.rollback)
+            raise
+        finally:
+            self.conn.autocommit = True
+
+
+class BDAsync:
+    # Ejecuta las consultas directamente sobre una conexión de asyncpg
+    def __init__(self, conn, lectura=False):
+        self.conn = conn
+        self.lectura = lectura  # True si la conexión es de una réplica
+        self.pool = None        # pool al que vuelve (lo asigna conexion())
+        self.cedida = False     # True si la devuelve stream() y no conexion()
+
+    async def fetchone(self, sql, params=()):
+        with metricas.medir_consulta(sql):
+            fila = await self.conn.fetchrow(_placeholders_asyncpg(sql), *params)
+        return dict(fila) if fila is not None else None
+
+    async def fetchall(self, sql, params=()):
+        with metricas.medir_consulta(sql):
+            filas = await self.conn.fetch(_placeholders_asyncpg(sql), *params)
+        return [dict(fila) for fila in filas]
+
+    async def execute(self, sql, params=()):
+        with metricas.medir_consulta(sql):
+            await self.conn.execute(_placeholders_asyncpg(sql), *params)
+
+    async def copy_desde(self, tabla, columnas, archivo):
+        with metricas.medir_consulta(f"COPY {tabla}"):
+            await self.conn.copy_to_table(tabla, source=archivo, columns=columnas, format="csv", header=True)
+
+    @asynccontextmanager
+    async def transaccion(self):
+        async with self.conn.transaction():
+            yield self
+
+
+def _pool_primario():
+    return pool_async if DB_MODO == "async" else pool
+
+
+def _nuevo_pool(config=None):
+    if DB_MODO == "async":
+        return PoolAsync(POOL_MIN, POOL_MAX, POOL_TIMEOUT, POOL_VERIFICAR_TRAS, config)
+    return PoolConexiones(POOL_MIN, POOL_MAX, POOL_TIMEOUT, POOL_VERIFICAR_TRAS, config)
+
+
+async def _prestar(p):
+    if DB_MODO == "async":
+        return await p.obtener()
+    return await run_in_threadpool(p.obtener)
+
+
+async def _devolver(p, conn):
+    if DB_MODO == "async":
+        await p.devolver(conn)
+    else:
+        await run_in_threadpool(p.devolver, conn)
+
+
+def _envolver(conn, lectura=False):
+    return BDAsync(conn, lectura) if DB_MODO == "async" else BDSync(conn, lectura)
+
+
+# Atraso de una réplica: 0 si ya aplicó todo lo que recibió (o si no es réplica, p. ej.
+# una copia independiente para pruebas) y, si no, la antigüedad de la última
+# transacción aplicada
+RETRASO_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END AS retraso;
+"""
+
+
+class Replica:
+    # Réplica de solo lectura con su propio pool y el último atraso medido
+    def __init__(self, direccion):
+        host, _, puerto = direccion.partition(":")
+        self.nombre = direccion
+        # Con connect_timeout una réplica caída no deja esperando a la medición
+        self.pool = _nuevo_pool({
+            **DB_CONFIG, "host": host, "port": puerto or DB_CONFIG["port"], "connect_timeout": 3,
+        })
+        self.disponible = False  # hasta la primera medición
+        self.retraso = None
+        self.lecturas = 0
+        self.fallos = 0
+
+    def apta(self):
+        return self.disponible and self.retraso is not None and self.retraso <= REPLICA_RETRASO_MAX
+
+    async def abrir(self):
+        try:
+            if DB_MODO == "async":
+                await self.pool.abrir()
+            else:
+                await run_in_threadpool(self.pool.abrir)
+        except Exception as e:
+            # La API arranca igual; la réplica se usa cuando vuelva a responder
+            self.fallo(e)
+
+    async def medir(self):
+        try:
+            if DB_MODO == "async" and not self.pool.abierto:
+                await self.pool.abrir()
+            conn = await _prestar(self.pool)
+            try:
+                fila = await _envolver(conn, True).fetchone(RETRASO_SQL)
+            finally:
+                await _devolver(self.pool, conn)
+        except Exception as e:
+            self.fallo(e)
+            return
+        if not self.disponible:
+            log.info("réplica disponible", extra={"campos": {"replica": self.nombre}})
+        self.disponible = True
+        self.retraso = float(fila["retraso"])
+
+    def fallo(self, error):
+        # Sin conexiones libres la lectura va a la primaria pero la réplica sigue en uso;
+        # cualquier otro error la saca hasta que la siguiente medición la encuentre
+        self.fallos += 1
+        if isinstance(error, PoolAgotado):
+            return
+        if self.disponible or self.retraso is None:
+            log.warning("réplica no disponible", extra={"campos": {"replica": self.nombre, "error": str(error)}})
+        self.disponible = False
+
+    def metricas(self):
+        return {
+            "replica": self.nombre,
+            "disponible": self.disponible,
+            "retraso_s": self.retraso,
+            "apta": self.apta(),
+            "lecturas": self.lecturas,
+            "fallos": self.fallos,
+            **self.pool.metricas(),
+        }
+
+
+replicas = [Replica(d) for d in DB_REPLICAS]
+_turno = itertools.count()
+
+
+def elegir_replica():
+    # Reparte las lecturas entre las réplicas con atraso tolerable (None: usar la primaria)
+    aptas = [r for r in replicas if r.apta()]
+    if not aptas:
+        return None
+    return aptas[next(_turno) % len(aptas)]
+
+
+async def _prestar_para(lectura):
+    # (pool, conexión, réplica o None). Si la réplica elegida no entrega una conexión,
+    # la lectura va a la primaria
+    replica = elegir_replica() if lectura else None
+    if replica is not None:
+        try:
+            conn = await _prestar(replica.pool)
+            replica.lecturas += 1
+            metricas.lecturas.inc(replica.nombre)
+            return replica.pool, conn, replica
+        except Exception as e:
+            replica.fallo(e)
+    if lectura:
+        metricas.lecturas.inc("primaria")
+    primario = _pool_primario()
+    return primario, await _prestar(primario), None
+
+
+async def vigilar_replicas():
+    # Mide el atraso de cada réplica cada DB_REPLICA_REVISION segundos
+    while True:
+        await asyncio.sleep(REPLICA_REVISION)
+        for replica in replicas:
+            await replica.medir()
+
+
+async def abrir_pools():
+    if DB_MODO == "async":
+        await pool_async.abrir()
+    else:
+        await run_in_threadpool(pool.abrir)
+    for replica in replicas:
+        await replica.abrir()
+        await replica.medir()
+
+
+async def cerrar_pools():
+    for replica in replicas:
+        if DB_MODO == "async":
+            await replica.pool.cerrar()
+        else:
+            await run_in_threadpool(replica.pool.cerrar)
+    if DB_MODO == "async":
+        await pool_async.cerrar()
+    else:
+        await run_in_threadpool(pool.cerrar)
+
+
+def metricas_pool():
+    datos = pool_async.metricas() if DB_MODO == "async" else pool.metricas()
+    if replicas:
+        datos["replicas"] = [r.metricas() for r in replicas]
+    return datos
+
+
+@asynccontextmanager
+async def conexion(lectura=False):
+    # Presta una conexión del pool envuelta en BDSync/BDAsync (también fuera de las rutas).
+    # Con lectura=True viene de una réplica al día, si hay alguna
+    p, conn, replica = await _prestar_para(lectura)
+    db = _envolver(conn, replica is not None)
+    db.pool = p
+    try:
+        yield db
+    finally:
+        if not db.cedida:
+            await _devolver(p, conn)
+
+
+async def consultar_uno(sql, params=()):
+    # Una fila desde la primaria con una conexión prestada solo para esta consulta. Las
+    # lecturas a través de la caché la usan al fallar: un acierto no toca el pool
+    async with conexion() as db:
+        return await db.fetchone(sql, params)
+
+
+async def stream(db, sql, params=(), lote=500):
+    # Recorre el resultado con un cursor del lado del servidor, de a `lote` filas,
+    # para que la memoria de la API no crezca con el tamaño de la tabla.
+    # Sigue leyendo después de que la ruta retorna, así que la ruta le cede su conexión
+    # (db.cedida = True) y stream la devuelve al terminar.
+    conn = db.conn
+    if DB_MODO == "async":
+        try:
+            async with conn.transaction():
+                async for fila in conn.cursor(_placeholders_asyncpg(sql), *params, prefetch=lote):
+                    yield dict(fila)
+        finally:
+            await devolver_cedida(db)
+        return
+
+    cur = None
+    try:
+        # Los cursores con nombre solo existen dentro de una transacción
+        conn.autocommit = False
+        cur = conn.cursor(name=f"stream_{id(conn)}", cursor_factory=psycopg2.extras.RealDictCursor)
+        await run_in_threadpool(cur.execute, sql, params)
+        while True:
+            filas = await run_in_threadpool(cur.fetchmany, lote)
+            if not filas:
+                break
+            for fila in filas:
+                yield fila
+    finally:
+        await devolver_cedida(db, cur)
+
+
+async def devolver_cedida(db, cur=None):
+    # Devuelve al pool una conexión cedida a stream(); las llamadas siguientes no hacen nada
+    conn, db.conn = db.conn, None
+    if conn is None:
+        return
+    if DB_MODO == "async":
+        await db.pool.devolver(conn)
+        return
+
+    def liberar():
+        try:
+            if cur is not None:
+                cur.close()
+            conn.rollback()
+            conn.autocommit = True
+        except Exception:
+            pass
+        db.pool.devolver(conn)
+    await run_in_threadpool(liberar)
+
+
+def escribio_hace_poco(request):
+    # El cliente escribió hace menos de DB_LECTURA_PROPIA segundos (cookie de get_db)
+    try:
+        return float(request.cookies.get(COOKIE_ESCRITURA, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+async def get_db(request: Request, response: Response):
+    # Dependencia de FastAPI: presta una conexión de la primaria a la ruta y la devuelve
+    # al terminar. Tras una escritura, la cookie hace que las lecturas de ese cliente
+    # vayan a la primaria hasta que las réplicas la alcancen
+    if replicas and LECTURA_PROPIA > 0 and request.method in ESCRITURAS:
+        response.set_cookie(
+            COOKIE_ESCRITURA, f"{time.time() + LECTURA_PROPIA:.3f}",
+            max_age=math.ceil(LECTURA_PROPIA), httponly=True,
+        )
+    try:
+        async with conexion() as db:
+            yield db
+    except ERRORES_SATURACION as e:
+        raise error_http(e)
+
+
+async def get_db_lectura(request: Request):
+    # Dependencia para las rutas de solo lectura: una réplica al día si hay alguna y el
+    # cliente no acaba de escribir; si no, la primaria
+    try:
+        async with conexion(lectura=not escribio_hace_poco(request)) as db:
+            yield db
+    except ERRORES_SATURACION as e:
+        raise error_http(e)
@@ -1,8 +1,15 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List
-from conexion_BD import get_connection
-import psycopg2.extras
+from typing import Optional, List, Literal
+from datetime import date
+from conexion_BD import get_db, get_db_lectura, consultar_uno, error_http
+from cache import cache, leer
+from carga_masiva import recibir, cargar
+from paginacion import paginar, respuesta_ndjson, columnas, RespuestaJSON, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
+from calendario import calendario, CAPACIDAD_POR_TIPO
+from tarifas import tarifas, TARIFAS_DIAS
+from notificaciones import avisos
 
 router = APIRouter()
 
@@ -22,13 +29,33 @@ class HabitacionUpdateRequest(BaseModel):
     disponibilidad: str
     precio_noche: float
 
+# Modelo de respuesta (documentación de la API; las filas se envían sin validar)
+class Habitacion(BaseModel):
+    id_habitacion: int
+    numero: int
+    tipo: str
+    disponibilidad: str
+    descripcion: str
+    caracteristicas: str
+    precio_noche: Optional[float] = None
+
+class Cotizacion(BaseModel):
+    tipo: str
+    id_habitacion: Optional[int] = None
+    fecha_entrada: date
+    fecha_salida: date
+    noches: int
+    precio_noche: float
+    subtotal: float
+    promocion: Optional[str] = None
+    descuento: float
+    total: float
+    promedio_noche: float
+
 @router.post("/habitaciones")
-def crear_habitacion(data: HabitacionRequest):
-    conn = get_connection()
-    cur = conn.cursor()
+async def crear_habitacion(data: HabitacionRequest, db=Depends(get_db)):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("""
+        await db.execute("""
             CALL crear_habitacion(%s, %s, %s, %s, %s, %s, %s, %s);
         """, (
             data.numero,
@@ -40,39 +67,125 @@ def crear_habitacion(data: HabitacionRequest):
             data.promociones_especiales,
             data.precio_noche
         ))
-        conn.commit()
+        await calendario.recargar_habitaciones(db)
+        await tarifas.recargar_habitaciones(db)
         return {"mensaje": "Habitación creada exitosamente"}
     except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
+
+# Carga masiva de habitaciones desde CSV o NDJSON (ver carga_masiva.py)
+@router.post("/habitaciones/lote")
+async def cargar_habitaciones(request: Request, formato: Literal["csv", "ndjson"] = Query("csv"), db=Depends(get_db)):
+    try:
+        archivo = await recibir(request)
+        resultado = await cargar(db, "habitaciones", archivo, formato)
+        await calendario.recargar_habitaciones(db)
+        await tarifas.recargar_habitaciones(db)
+        await cache.invalidar("habitacion")
+        return resultado
+    except Exception as e:
+        raise error_http(e)
+
+# Búsqueda de habitaciones vendibles para un rango de fechas, servida desde el
+# calendario de ocupación en memoria (se declara antes de /habitaciones/{id_habitacion})
+@router.get("/habitaciones/disponibles", response_model=List[Habitacion])
+async def buscar_disponibles(
+    fecha_entrada: date,
+    fecha_salida: date,
+    tipo: Optional[str] = Query(None),
+    huespedes: Optional[int] = Query(None),
+    precio_maximo: Optional[float] = Query(None),
+    db=Depends(get_db)
+):
+    if fecha_salida <= fecha_entrada:
+        raise HTTPException(status_code=400, detail="La fecha de salida debe ser posterior a la de entrada")
+    if calendario.cubre(fecha_entrada, fecha_salida):
+        return RespuestaJSON(calendario.buscar(fecha_entrada, fecha_salida, tipo, huespedes, precio_maximo))
+    # Fechas fuera del calendario (o calendario sin construir): se consulta la base de datos
+    try:
+        habitaciones = await db.fetchall(
+            "SELECT * FROM habitaciones_disponibles(%s, %s, %s);",
+            (tipo, fecha_entrada, fecha_salida)
+        )
+    except Exception as e:
+        raise error_http(e)
+    return RespuestaJSON([
+        h for h in habitaciones
+        if (huespedes is None or CAPACIDAD_POR_TIPO.get(h["tipo"], 0) >= huespedes)
+        and (precio_maximo is None or h["precio_noche"] <= precio_maximo)
+    ])
+
+# Compara el calendario en memoria con la base de datos (reparar=true lo reconstruye).
+# Va a la primaria: el calendario refleja lo confirmado en ella, y contra una réplica
+# atrasada daría diferencias falsas y la reparación lo armaría con datos viejos
+@router.get("/habitaciones/disponibles/verificacion")
+async def verificar_calendario(reparar: bool = Query(False), db=Depends(get_db)):
+    try:
+        resultado = await calendario.verificar(db)
+        if reparar and not resultado["consistente"]:
+            await calendario.construir(db)
+            resultado["reparado"] = True
+        return resultado
+    except Exception as e:
+        raise error_http(e)
+
+# Cotización de una estadía con temporadas y promociones, calculada con la tabla de
+# tarifas en memoria (se declara antes de /habitaciones/{id_habitacion}).
+# Sin id_habitacion se cotiza cada tipo desde su habitación más barata
+@router.get("/habitaciones/cotizacion", response_model=List[Cotizacion])
+async def cotizar_estadia(
+    fecha_entrada: date,
+    fecha_salida: date,
+    tipo: Optional[str] = Query(None),
+    id_habitacion: Optional[int] = Query(None),
+    codigo: Optional[str] = Query(None)
+):
+    if fecha_salida <= fecha_entrada:
+        raise HTTPException(status_code=400, detail="La fecha de salida debe ser posterior a la de entrada")
+    if (fecha_salida - fecha_entrada).days > TARIFAS_DIAS:
+        raise HTTPException(status_code=400, detail=f"La estadía no puede superar {TARIFAS_DIAS} noches")
+    if not tarifas.listo:
+        raise HTTPException(status_code=503, detail="Tabla de tarifas sin construir")
+    if id_habitacion is None:
+        return RespuestaJSON(tarifas.cotizar_tipos(fecha_entrada, fecha_salida, tipo, codigo))
+    cotizacion = tarifas.cotizar_habitacion(id_habitacion, fecha_entrada, fecha_salida, codigo)
+    if cotizacion is None:
+        raise HTTPException(status_code=404, detail="Habitación no encontrada")
+    return RespuestaJSON([cotizacion])
+
+# Cambios de estado de las habitaciones (reservas, cancelaciones y actualizaciones)
+# como Server-Sent Events; se declara antes de /habitaciones/{id_habitacion}.
+# Last-Event-ID (o ?desde=) reanuda desde el último aviso recibido
+@router.get("/habitaciones/eventos")
+async def eventos_habitaciones(
+    request: Request,
+    tipo: Optional[str] = Query(None),
+    desde: Optional[str] = Query(None),
+    last_event_id: Optional[str] = Header(None),
+):
+    return StreamingResponse(
+        avisos.flujo(request, tipo, last_event_id or desde),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-@router.get("/habitaciones/{id_habitacion}")
-def obtener_habitacion(id_habitacion: int):
-    conn = get_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+@router.get("/habitaciones/{id_habitacion}", response_model=Habitacion)
+async def obtener_habitacion(id_habitacion: int):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("SELECT * FROM obtener_habitacion(%s);", (id_habitacion,))
-        habitacion = cur.fetchone()
-        if not habitacion:
-            raise HTTPException(status_code=404, detail="Habitación no encontrada")
-        return habitacion
+        habitacion = await leer(
+            f"habitacion:{id_habitacion}",
+            lambda: consultar_uno("SELECT * FROM obtener_habitacion(%s);", (id_habitacion,))
+        )
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
+    if not habitacion:
+        raise HTTPException(status_code=404, detail="Habitación no encontrada")
+    return RespuestaJSON(habitacion)
 
 @router.put("/habitaciones/{id_habitacion}")
-def actualizar_habitacion(id_habitacion: int, data: HabitacionUpdateRequest):
-    conn = get_connection()
-    cur = conn.cursor()
+async def actualizar_habitacion(id_habitacion: int, data: HabitacionUpdateRequest, db=Depends(get_db)):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("""
+        await db.execute("""
             CALL actualizar_habitacion(%s, %s, %s, %s, %s);
         """, (
             id_habitacion,
@@ -81,46 +194,42 @@ def actualizar_habitacion(id_habitacion: int, data: HabitacionUpdateRequest):
             data.precio_noche,
             data.disponibilidad
         ))
-        conn.commit()
+        calendario.habitacion_actualizada(id_habitacion, data.tipo, data.descripcion, data.disponibilidad, data.precio_noche)
+        tarifas.habitacion_actualizada(id_habitacion, data.tipo, data.precio_noche)
+        await cache.invalidar(f"habitacion:{id_habitacion}")
         return {"mensaje": "Habitación actualizada exitosamente"}
     except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
 
 @router.delete("/habitaciones/{id_habitacion}")
-def eliminar_habitacion(id_habitacion: int):
-    conn = get_connection()
-    cur = conn.cursor()
+async def eliminar_habitacion(id_habitacion: int, db=Depends(get_db)):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("CALL eliminar_habitacion(%s);", (id_habitacion,))
-        conn.commit()
+        await db.execute("CALL eliminar_habitacion(%s);", (id_habitacion,))
+        calendario.habitacion_eliminada(id_habitacion)
+        tarifas.habitacion_eliminada(id_habitacion)
+        await cache.invalidar(f"habitacion:{id_habitacion}")
         return {"mensaje": "Habitación eliminada exitosamente"}
     except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
 
-@router.get("/habitaciones")
-def listar_habitaciones(
+# fields=numero,tipo devuelve solo esas columnas (más id_habitacion)
+@router.get("/habitaciones", response_model=List[Habitacion])
+async def listar_habitaciones(
     tipo: Optional[str] = Query(None),
     precio_maximo: Optional[float] = Query(None),
-    disponibilidad: Optional[str] = Query(None)
+    disponibilidad: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    after: Optional[int] = Query(None),
+    formato: Literal["json", "ndjson"] = Query("json"),
+    fields: Optional[str] = Query(None, description="Columnas separadas por comas"),
+    db=Depends(get_db_lectura)
 ):
-    conn = get_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    sql = f"SELECT {columnas(fields, Habitacion, 'id_habitacion')} FROM filtrar_habitaciones(%s, %s, %s, %s, %s);"
+    if formato == "ndjson":
+        return respuesta_ndjson(db, sql, (tipo, precio_maximo, disponibilidad, after, limit))
+    limite = limit or LIMITE_POR_DEFECTO
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("SELECT * FROM filtrar_habitaciones(%s, %s, %s);", (tipo, precio_maximo, disponibilidad))
-        habitaciones = cur.fetchall()
-        return habitaciones
+        habitaciones = await db.fetchall(sql, (tipo, precio_maximo, disponibilidad, after, limite))
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
+    return paginar(habitaciones, limite, "id_habitacion")
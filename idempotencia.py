@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from conexion_BD import conexion
+from cache import cache
+from paginacion import _a_json
+
+log = logging.getLogger(__name__)
+
+# Horas que se guarda la respuesta de cada Idempotency-Key
+IDEMPOTENCIA_HORAS = float(os.getenv("IDEMPOTENCIA_HORAS", "24"))
+# Segundos entre borrados de las claves vencidas
+IDEMPOTENCIA_PURGA = float(os.getenv("IDEMPOTENCIA_PURGA", "3600"))
+LONGITUD_MAXIMA = 255
+
+
+class Solicitud:
+    def __init__(self, respuesta=None):
+        # Con respuesta al entrar, es un reintento: se devuelve sin volver a ejecutar nada
+        self.repetida = respuesta is not None
+        self.respuesta = respuesta
+
+
+def _huella(cuerpo):
+    return hashlib.sha256(json.dumps(jsonable_encoder(cuerpo), sort_keys=True).encode()).hexdigest()
+
+
+def _guardada(fila, huella):
+    if fila["huella"] != huella:
+        raise HTTPException(
+            status_code=422,
+            detail="La Idempotency-Key ya se usó con un cuerpo distinto"
+        )
+    return Solicitud(fila["respuesta"])
+
+
+@asynccontextmanager
+async def idempotente(db, ruta, clave, cuerpo):
+    # Sin clave la operación se ejecuta como siempre. Con clave, la primera petición
+    # ejecuta la operación en una transacción que también guarda la clave y, al salir,
+    # su respuesta (solicitud.respuesta). Los reintentos reciben esa respuesta: desde la
+    # caché si la tiene este proceso y, si no, desde solicitud_idempotente. Un reintento
+    # que llega mientras la primera sigue en curso espera en el INSERT a que termine.
+    if clave is None:
+        yield Solicitud()
+        return
+    if len(clave) > LONGITUD_MAXIMA:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key de más de {LONGITUD_MAXIMA} caracteres")
+    huella = _huella(cuerpo)
+    llave = f"idempotencia:{ruta}:{clave}"
+    guardada = await cache.obtener(llave)
+    if guardada is not None:
+        yield _guardada(guardada, huella)
+        return
+
+    async with db.transaccion():
+        # Una clave vencida se reutiliza como si fuera nueva
+        nueva = await db.fetchone("""
+            INSERT INTO solicitud_idempotente AS s (ruta, clave, huella, vence)
+            VALUES (%s, %s, %s, now() + make_interval(secs => %s))
+            ON CONFLICT (ruta, clave) DO UPDATE
+                SET huella = EXCLUDED.huella, respuesta = NULL, vence = EXCLUDED.vence
+                WHERE s.vence < now()
+            RETURNING s.clave;
+        """, (ruta, clave, huella, IDEMPOTENCIA_HORAS * 3600))
+        if nueva is None:
+            fila = await db.fetchone("""
+                SELECT huella, respuesta::TEXT AS respuesta
+                FROM solicitud_idempotente
+                WHERE ruta = %s AND clave = %s;
+            """, (ruta, clave))
+            guardada = {"huella": fila["huella"], "respuesta": json.loads(fila["respuesta"])}
+            solicitud = _guardada(guardada, huella)
+        else:
+            solicitud = Solicitud()
+        yield solicitud
+        if not solicitud.repetida:
+            await db.execute("""
+                UPDATE solicitud_idempotente SET respuesta = %s::JSONB
+                WHERE ruta = %s AND clave = %s;
+            """, (json.dumps(solicitud.respuesta, default=_a_json), ruta, clave))
+            guardada = {"huella": huella, "respuesta": jsonable_encoder(solicitud.respuesta)}
+    await cache.guardar(llave, guardada, ["idempotencia"])
+
+
+async def purgar_periodicamente():
+    # Borra las claves vencidas cada IDEMPOTENCIA_PURGA segundos
+    while True:
+        await asyncio.sleep(IDEMPOTENCIA_PURGA)
+        try:
+            async with conexion() as db:
+                await db.execute("DELETE FROM solicitud_idempotente WHERE vence < now();")
+        except Exception:
+            log.exception("no se pudieron borrar las claves de idempotencia vencidas")
@@ -1,13 +1,134 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+import registro
+import metricas
+from conexion_BD import abrir_pools, cerrar_pools, metricas_pool, conexion, replicas, vigilar_replicas
+from calendario import calendario, refrescar_periodicamente, CALENDARIO_REFRESCO
+from tarifas import tarifas, refrescar_periodicamente as refrescar_tarifas, TARIFAS_REFRESCO
+from cache import cache
+from bitacora import bitacora
 from reservaciones import router as reservaciones_router
 from clientes import router as clientes_router
 from habitaciones import router as habitaciones_router
 from pagos import router as pagos_router
 from servicios import router as servicios_router
-app = FastAPI()
+from admin import router as admin_router
+from salud import router as salud_router
+from reportes import router as reportes_router, actualizar_periodicamente, REPORTES_INTERVALO
+from idempotencia import purgar_periodicamente
+from paginacion import RespuestaJSON
+from notificaciones import avisos
+from admision import admision, ControlAdmision
+
+# Logs en JSON con nivel y muestreo (LOG_NIVEL, LOG_MUESTREO)
+registro.configurar()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Abrir las conexiones mínimas del pool al arrancar y cerrarlas al apagar
+    await abrir_pools()
+    # Escucha de los cambios de habitaciones para GET /habitaciones/eventos y de los
+    # hechos en otros procesos; empieza antes de construir para no perder ninguno
+    avisos.iniciar()
+    # Calendario de ocupación en memoria para GET /habitaciones/disponibles
+    async with conexion() as db:
+        await calendario.construir(db)
+        # Tabla de tarifas en memoria para GET /habitaciones/cotizacion
+        await tarifas.construir(db)
+    refresco = asyncio.create_task(refrescar_periodicamente()) if CALENDARIO_REFRESCO > 0 else None
+    refresco_tarifas = asyncio.create_task(refrescar_tarifas()) if TARIFAS_REFRESCO > 0 else None
+    # Paso por lotes de los eventos de bitacora_pendiente a tabla_log_reservaciones
+    bitacora.iniciar()
+    # Recalcular los meses de reportes que cambiaron
+    reportes = asyncio.create_task(actualizar_periodicamente()) if REPORTES_INTERVALO > 0 else None
+    # Borrado de las claves de idempotencia vencidas
+    purga = asyncio.create_task(purgar_periodicamente())
+    # Atraso de las réplicas de lectura (DB_REPLICAS)
+    vigilancia = asyncio.create_task(vigilar_replicas()) if replicas else None
+    yield
+    await avisos.detener()
+    purga.cancel()
+    if vigilancia:
+        vigilancia.cancel()
+    if refresco:
+        refresco.cancel()
+    if refresco_tarifas:
+        refresco_tarifas.cancel()
+    if reportes:
+        reportes.cancel()
+    # Antes de cerrar el pool se mueve lo que quede pendiente
+    await bitacora.detener()
+    await cerrar_pools()
+
+
+# Las respuestas se serializan con orjson si está instalado (paginacion.RespuestaJSON)
+app = FastAPI(lifespan=lifespan, default_response_class=RespuestaJSON)
+# Cupo de peticiones simultáneas por prioridad y límite por cliente (admision.py)
+app.add_middleware(ControlAdmision)
+# Conteo y latencia de cada petición para /metrics
+app.add_middleware(metricas.MedirPeticiones)
 
 app.include_router(reservaciones_router)
 app.include_router(clientes_router)
 app.include_router(habitaciones_router)
 app.include_router(pagos_router)
-app.include_router(servicios_router)
\ No newline at end of file
+app.include_router(servicios_router)
+app.include_router(admin_router)
+app.include_router(reportes_router)
+app.include_router(salud_router)
+
+
+# Métricas del pool de conexiones
+@app.get("/pool/metricas")
+def obtener_metricas_pool():
+    return metricas_pool()
+
+
+# Aciertos, fallos y desalojos de la caché de lecturas
+@app.get("/cache/metricas")
+def obtener_metricas_cache():
+    return cache.metricas()
+
+
+# Escucha de cambios de habitaciones y clientes conectados a /habitaciones/eventos
+@app.get("/avisos/metricas")
+def obtener_metricas_avisos():
+    return avisos.metricas()
+
+
+# Cupo, cola y rechazos del control de admisión
+@app.get("/admision/metricas")
+def obtener_metricas_admision():
+    return admision.metricas()
+
+
+# Estado del paso de eventos a la bitácora
+@app.get("/bitacora/metricas")
+def obtener_metricas_bitacora():
+    return bitacora.metricas()
+
+
+# Valores que ya llevan el pool, la caché y la bitácora, leídos al exponer /metrics
+for clave in ("abiertas", "libres", "en_uso", "esperando"):
+    metricas.medidor(f"bd_pool_{clave}", f"Conexiones del pool: {clave}", lambda clave=clave: metricas_pool()[clave])
+metricas.medidor("bd_pool_timeouts_total", "Esperas por conexión que agotaron el tiempo",
+                 lambda: metricas_pool()["timeouts"], "counter")
+for clave in ("aciertos", "fallos", "desalojos", "invalidaciones"):
+    metricas.medidor(f"cache_{clave}_total", f"Caché de lecturas: {clave}",
+                     lambda clave=clave: cache.metricas().get(clave, 0), "counter")
+metricas.medidor("bitacora_pendientes", "Eventos de bitácora aún sin mover", lambda: bitacora.pendientes)
+metricas.medidor("http_admision_en_curso", "Peticiones admitidas en curso", lambda: admision.en_curso)
+metricas.medidor("http_admision_esperando", "Peticiones esperando turno", lambda: admision.esperando)
+metricas.medidor("avisos_suscriptores", "Clientes conectados a /habitaciones/eventos",
+                 lambda: len(avisos.suscriptores))
+metricas.medidor("avisos_recibidos_total", "Avisos de cambios de habitaciones recibidos",
+                 lambda: avisos.recibidos, "counter")
+
+
+# Métricas en formato de Prometheus
+@app.get("/metrics", include_in_schema=False)
+def exponer_metricas():
+    return PlainTextResponse(metricas.exponer(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,209 @@
+"""Métricas en formato de texto de Prometheus (GET /metrics).
+
+Se registran desde los middlewares de menu_API.py (peticiones y control de admisión),
+desde BDSync/BDAsync (consultas) y desde los pools (espera por una conexión).
+"""
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+log = logging.getLogger(__name__)
+
+# Límites de los histogramas de latencia, en segundos
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _etiquetas(nombres, valores):
+    if not nombres:
+        return ""
+    pares = []
+    for n, v in zip(nombres, valores):
+        v = str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pares.append(f'{n}="{v}"')
+    return "{" + ",".join(pares) + "}"
+
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *valores, cantidad=1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def exponer(self):
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} counter"
+        with self._lock:
+            for valores, total in self._valores.items():
+                yield f"{self.nombre}{_etiquetas(self.etiquetas, valores)} {total}"
+
+
+class Medidor:
+    # Valor que sube y baja; con `funcion` se lee en el momento de exponer
+    # (tipo "counter" para contadores que ya lleva otro módulo)
+    def __init__(self, nombre, ayuda, funcion=None, tipo="gauge"):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.funcion = funcion
+        self.tipo = tipo
+        self.valor = 0
+
+    def inc(self, cantidad=1):
+        self.valor += cantidad
+
+    def dec(self, cantidad=1):
+        self.valor -= cantidad
+
+    def exponer(self):
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} {self.tipo}"
+        yield f"{self.nombre} {self.funcion() if self.funcion else self.valor}"
+
+
+class Histograma:
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = buckets
+        self._series = {}  # valores de etiquetas -> [conteos por bucket..., suma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, segundos, *valores):
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [0] * (len(self.buckets) + 2)
+            for i, limite in enumerate(self.buckets):
+                if segundos <= limite:
+                    serie[i] += 1
+                    break
+            serie[-2] += segundos
+            serie[-1] += 1
+
+    def exponer(self):
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} histogram"
+        with self._lock:
+            for valores, serie in self._series.items():
+                acumulado = 0
+                for limite, conteo in zip(self.buckets, serie):
+                    acumulado += conteo
+                    etiquetas = _etiquetas(self.etiquetas + ("le",), valores + (limite,))
+                    yield f"{self.nombre}_bucket{etiquetas} {acumulado}"
+                etiquetas = _etiquetas(self.etiquetas + ("le",), valores + ("+Inf",))
+                yield f"{self.nombre}_bucket{etiquetas} {serie[-1]}"
+                yield f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {serie[-2]}"
+                yield f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {serie[-1]}"
+
+
+_registradas = []
+
+
+def _registrar(metrica):
+    _registradas.append(metrica)
+    return metrica
+
+
+peticiones = _registrar(Contador(
+    "http_peticiones_total", "Peticiones atendidas", ("metodo", "ruta", "estado")))
+duracion_peticiones = _registrar(Histograma(
+    "http_duracion_segundos", "Duración de las peticiones", ("metodo", "ruta", "estado")))
+en_curso = _registrar(Medidor(
+    "http_peticiones_en_curso", "Peticiones que se están atendiendo"))
+duracion_consultas = _registrar(Histograma(
+    "bd_consulta_segundos", "Duración de las consultas por procedimiento o función", ("operacion",)))
+errores_consultas = _registrar(Contador(
+    "bd_consulta_errores_total", "Consultas que terminaron en error", ("operacion",)))
+sentencias_preparadas = _registrar(Contador(
+    "bd_sentencias_preparadas_total",
+    "Consultas según prepararon la sentencia, reutilizaron una preparada o se ejecutaron sin preparar",
+    ("resultado",)))
+lecturas = _registrar(Contador(
+    "bd_lecturas_total", "Conexiones de lectura por destino (réplica o primaria)", ("destino",)))
+espera_conexion = _registrar(Histograma(
+    "bd_conexion_espera_segundos", "Tiempo de espera para obtener una conexión del pool"))
+admision = _registrar(Contador(
+    "http_admision_total",
+    "Peticiones por prioridad según se admitieron o se rechazaron (límite por cliente, cola llena, "
+    "plazo vencido o desalojadas por una de mayor prioridad)",
+    ("prioridad", "resultado")))
+espera_admision = _registrar(Histograma(
+    "http_admision_espera_segundos", "Tiempo que esperaron turno las peticiones encoladas", ("prioridad",)))
+
+
+def medidor(nombre, ayuda, funcion, tipo="gauge"):
+    # Registra un valor que se calcula al exponer (tamaño del pool, aciertos de caché...)
+    return _registrar(Medidor(nombre, ayuda, funcion, tipo))
+
+
+@lru_cache(maxsize=1024)
+def operacion(sql):
+    # Nombre del procedimiento o función que ejecuta la sentencia; si no hay, su comando
+    encontrado = re.search(r"\b(?:CALL|FROM)\s+([A-Za-z_][\w.]*)\s*\(", sql, re.IGNORECASE)
+    if encontrado:
+        return encontrado.group(1).lower()
+    palabras = sql.split(None, 1)
+    return palabras[0].upper() if palabras else "vacia"
+
+
+@contextmanager
+def medir_consulta(sql):
+    nombre = operacion(sql)
+    inicio = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        errores_consultas.inc(nombre)
+        raise
+    finally:
+        duracion_consultas.observar(time.perf_counter() - inicio, nombre)
+
+
+class MedirPeticiones:
+    # Middleware ASGI: cuenta y mide cada petición por método, ruta (la plantilla,
+    # p. ej. /cliente/{id_cliente}, para no crear una serie por id) y código de estado
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        estado = 500
+
+        async def enviar(mensaje):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            await send(mensaje)
+
+        inicio = time.perf_counter()
+        en_curso.inc()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            en_curso.dec()
+            duracion = time.perf_counter() - inicio
+            ruta = getattr(scope.get("route"), "path", "sin_ruta")
+            peticiones.inc(scope["method"], ruta, estado)
+            duracion_peticiones.observar(duracion, scope["method"], ruta, estado)
+            log.info("petición atendida", extra={"campos": {
+                "metodo": scope["method"], "ruta": ruta, "estado": estado,
+                "duracion_ms": round(duracion * 1000, 2),
+            }})
+
+
+def exponer():
+    lineas = []
+    for metrica in _registradas:
+        lineas.extend(metrica.exponer())
+    return "\n".join(lineas) + "\n"
@@ -0,0 +1,357 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from collections import deque
+from datetime import date
+from starlette.concurrency import run_in_threadpool
+import salud
+from conexion_BD import DB_MODO, DB_CONFIG, DB_SCHEMA, get_connection, asyncpg, conexion
+from calendario import calendario
+from tarifas import tarifas
+from cache import cache, CacheLRU
+
+log = logging.getLogger(__name__)
+
+# Canal de NOTIFY de notificar_habitacion() (Script SQL completo P02.sql)
+CANAL = "habitaciones"
+# Canal por el que cada proceso avisa a los demás de sus invalidaciones de caché y de
+# las reconstrucciones del calendario o de las tarifas
+CANAL_SINCRONIZACION = "sincronizacion"
+# Marca los avisos de sincronización propios, que no se vuelven a aplicar
+ORIGEN = uuid.uuid4().hex
+# Tamaño máximo de cada aviso de sincronización (NOTIFY admite hasta 8000 bytes)
+SINCRONIZACION_BYTES = 7000
+# Avisos recientes que se guardan para reanudar un flujo desde Last-Event-ID
+AVISOS_RECIENTES = int(os.getenv("AVISOS_RECIENTES", "1000"))
+# Avisos que puede acumular un cliente lento antes de pedirle que recargue
+AVISOS_COLA = int(os.getenv("AVISOS_COLA", "100"))
+# Segundos entre latidos (comentarios SSE) para que proxies y clientes no cierren la conexión
+AVISOS_LATIDO = float(os.getenv("AVISOS_LATIDO", "15"))
+# Milisegundos que espera el navegador (EventSource) antes de reconectarse
+AVISOS_RECONEXION_MS = 3000
+
+# El cliente debe volver a leer GET /habitaciones: se perdieron avisos
+REINICIO = b"event: reinicio\ndata: {}\n\n"
+
+
+class Suscriptor:
+    def __init__(self, tipo):
+        self.tipo = tipo
+        self.cola = asyncio.Queue(AVISOS_COLA)
+
+    def entregar(self, tipo, mensaje):
+        # tipo None: aviso para todos los clientes (la carga masiva de habitaciones)
+        if self.tipo is not None and tipo is not None and tipo != self.tipo:
+            return
+        try:
+            self.cola.put_nowait(mensaje)
+        except asyncio.QueueFull:
+            # No se desconecta al cliente lento: se descarta lo acumulado y recarga
+            while not self.cola.empty():
+                self.cola.get_nowait()
+            self.cola.put_nowait(REINICIO)
+
+
+def _mensajes(claves, reconstruir):
+    # Avisos de sincronización que no pasan de SINCRONIZACION_BYTES
+    def nuevo():
+        return {"evento": "sincronizacion", "origen": ORIGEN, "reconstruir": reconstruir, "claves": []}
+    mensaje = nuevo()
+    tamano = len(json.dumps(mensaje))
+    for clave in claves:
+        largo = len(json.dumps(clave)) + 2
+        if mensaje["claves"] and tamano + largo > SINCRONIZACION_BYTES:
+            yield json.dumps(mensaje)
+            mensaje = nuevo()
+            mensaje["reconstruir"] = []
+            tamano = len(json.dumps(mensaje))
+        mensaje["claves"].append(clave)
+        tamano += largo
+    yield json.dumps(mensaje)
+
+
+class Avisos:
+    # Una sola conexión por proceso escucha el canal (LISTEN) y reparte cada aviso a
+    # todos los clientes conectados a GET /habitaciones/eventos. Cada aviso se convierte
+    # una vez en el mensaje SSE que reciben todos.
+    # La misma conexión mantiene al día el calendario, las tarifas y la caché de este
+    # proceso con los cambios hechos en los demás: los avisos de habitaciones traen la
+    # reserva y sus fechas, y los de CANAL_SINCRONIZACION las claves invalidadas.
+    def __init__(self, canal):
+        self.canal = canal
+        self.recientes = deque(maxlen=AVISOS_RECIENTES)  # (id, tipo, mensaje)
+        self.suscriptores = set()
+        self.recibidos = 0
+        self.conexiones = 0
+        self.conectado = False
+        self.aplicados = 0
+        self.difundidos = 0
+        self._tarea = None
+        self._aplicador = None
+        self._cambios = None
+        self._por_difundir = set()
+        self._por_reconstruir = set()
+        self._envio = None
+
+    def iniciar(self):
+        self._cambios = asyncio.Queue()
+        self._aplicador = asyncio.create_task(self._aplicar())
+        if isinstance(cache, CacheLRU):
+            cache.difundir = self.difundir
+        self._tarea = asyncio.create_task(self._escuchar())
+
+    async def detener(self):
+        if isinstance(cache, CacheLRU):
+            cache.difundir = None
+        if self._envio:
+            # Lo pendiente se avisa antes de cerrar el pool
+            await asyncio.wait({self._envio})
+        for tarea in (self._tarea, self._aplicador):
+            if tarea:
+                tarea.cancel()
+                try:
+                    await tarea
+                except asyncio.CancelledError:
+                    pass
+        self._tarea = self._aplicador = None
+
+    async def _escuchar(self):
+        espera = 0.5
+        while True:
+            try:
+                if DB_MODO == "async":
+                    await self._escuchar_async()
+                else:
+                    await self._escuchar_sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("escucha de avisos interrumpida", extra={"campos": {"error": str(e)}})
+            # Si la conexión llegó a escuchar se reintenta pronto; si ni conectó, cada vez más espaciado
+            espera = 1 if self.conectado else min(espera * 2, 30)
+            self.conectado = False
+            await asyncio.sleep(espera)
+
+    async def _escuchar_sync(self):
+        conn = await run_in_threadpool(get_connection)
+        loop = asyncio.get_running_loop()
+        llegada = asyncio.Event()
+        try:
+            cur = conn.cursor()
+            await run_in_threadpool(cur.execute, f"LISTEN {self.canal}; LISTEN {CANAL_SINCRONIZACION};")
+            cur.close()
+            loop.add_reader(conn.fileno(), llegada.set)
+            try:
+                self._conectar()
+                while True:
+                    await llegada.wait()
+                    llegada.clear()
+                    # Lee lo que llegó al socket; si la conexión se cayó lanza OperationalError
+                    conn.poll()
+                    while conn.notifies:
+                        aviso = conn.notifies.pop(0)
+                        self._despachar(aviso.channel, aviso.payload)
+            finally:
+                loop.remove_reader(conn.fileno())
+        finally:
+            conn.close()
+
+    async def _escuchar_async(self):
+        conn = await asyncpg.connect(
+            database=DB_CONFIG["dbname"],
+            user=DB_CONFIG["user"],
+            password=DB_CONFIG["password"],
+            host=DB_CONFIG["host"],
+            port=int(DB_CONFIG["port"]),
+            server_settings={"search_path": DB_SCHEMA},
+        )
+        perdida = asyncio.Event()
+        try:
+            conn.add_termination_listener(lambda _: perdida.set())
+            for canal in (self.canal, CANAL_SINCRONIZACION):
+                await conn.add_listener(canal, lambda _conn, _pid, canal, payload: self._despachar(canal, payload))
+            self._conectar()
+            await perdida.wait()
+            raise ConnectionError("se cerró la conexión que escucha los avisos")
+        finally:
+            if not conn.is_closed():
+                await conn.close()
+
+    def _conectar(self):
+        if self.conexiones:
+            # Mientras no hubo conexión pudieron perderse avisos: los guardados ya no
+            # sirven para reanudar y los clientes conectados deben recargar
+            self.recientes.clear()
+            for suscriptor in list(self.suscriptores):
+                suscriptor.entregar(suscriptor.tipo, REINICIO)
+        if self.conexiones or calendario.listo:
+            # Los cambios de otros procesos anteriores a LISTEN se recogen reconstruyendo
+            self._cambios.put_nowait({"evento": "recarga"})
+        self.conexiones += 1
+        self.conectado = True
+
+    def _despachar(self, canal, payload):
+        try:
+            aviso = json.loads(payload)
+        except ValueError:
+            log.warning("aviso con formato inválido", extra={"campos": {"canal": canal, "payload": payload[:200]}})
+            return
+        if canal == CANAL_SINCRONIZACION:
+            if aviso.get("origen") != ORIGEN:
+                self._cambios.put_nowait(aviso)
+            return
+        self._recibir(aviso, payload)
+        self._cambios.put_nowait(aviso)
+
+    def _recibir(self, aviso, payload):
+        self.recibidos += 1
+        id_aviso = str(aviso["id"])
+        # Tras una carga masiva se pide a los clientes recargar en lugar de un aviso por habitación
+        evento = "reinicio" if aviso.get("evento") == "carga" else "habitacion"
+        mensaje = f"id: {id_aviso}\nevent: {evento}\ndata: {payload}\n\n".encode("utf-8")
+        self.recientes.append((id_aviso, aviso.get("tipo"), mensaje))
+        for suscriptor in list(self.suscriptores):
+            suscriptor.entregar(aviso.get("tipo"), mensaje)
+
+    # Sincronización entre procesos
+
+    def difundir(self, claves=(), reconstruir=()):
+        # Avisa a los demás procesos de claves invalidadas o de qué deben reconstruir
+        # ("calendario", "tarifas"). Lo de la misma vuelta del loop va en un solo NOTIFY
+        self._por_difundir.update(claves)
+        self._por_reconstruir.update(reconstruir)
+        if self._envio is None:
+            self._envio = asyncio.create_task(self._enviar())
+
+    async def _enviar(self):
+        await asyncio.sleep(0)
+        claves, reconstruir = sorted(self._por_difundir), sorted(self._por_reconstruir)
+        self._por_difundir, self._por_reconstruir = set(), set()
+        self._envio = None
+        try:
+            async with conexion() as db:
+                for mensaje in _mensajes(claves, reconstruir):
+                    await db.execute("SELECT pg_notify(%s, %s);", (CANAL_SINCRONIZACION, mensaje))
+                    self.difundidos += 1
+        except Exception as e:
+            # Los demás procesos lo recogen con el TTL de la caché y la reconstrucción periódica
+            log.warning("no se pudo avisar a los demás procesos", extra={"campos": {"error": str(e)}})
+
+    async def _aplicar(self):
+        # Aplica en orden de llegada los cambios hechos en otros procesos
+        while True:
+            cambio = await self._cambios.get()
+            try:
+                await self._aplicar_cambio(cambio)
+                self.aplicados += 1
+            except Exception as e:
+                log.warning("no se pudo aplicar un cambio de otro proceso",
+                            extra={"campos": {"evento": cambio.get("evento"), "error": str(e)}})
+
+    async def _aplicar_cambio(self, cambio):
+        evento = cambio.get("evento")
+        reconstruir = {"calendario", "tarifas"} if evento == "recarga" else set(cambio.get("reconstruir") or ())
+        if reconstruir:
+            async with conexion() as db:
+                if "calendario" in reconstruir:
+                    await calendario.construir(db)
+                if "tarifas" in reconstruir:
+                    await tarifas.construir(db)
+        if evento == "recarga":
+            if isinstance(cache, CacheLRU):
+                cache.vaciar()
+            return
+        if evento == "sincronizacion":
+            if cambio["claves"] and isinstance(cache, CacheLRU):
+                cache.descartar(cambio["claves"])
+            return
+        if evento == "carga":
+            async with conexion() as db:
+                async with calendario.bloqueo, tarifas.bloqueo:
+                    await calendario.recargar_habitaciones(db)
+                    await tarifas.recargar_habitaciones(db)
+            if isinstance(cache, CacheLRU):
+                cache.descartar(["habitacion"])
+            return
+
+        id_habitacion, id_reserva = cambio["id_habitacion"], cambio.get("id_reserva")
+        habitacion = None
+        if evento in ("creacion", "actualizacion"):
+            async with conexion() as db:
+                habitacion = await db.fetchone("SELECT * FROM obtener_habitacion(%s);", (id_habitacion,))
+        # Repetir un cambio que ya aplicó la ruta de este proceso no altera nada
+        async with calendario.bloqueo, tarifas.bloqueo:
+            if id_reserva is not None:
+                if evento == "cancelacion" or cambio.get("estado_reserva") in (None, "Cancelada"):
+                    calendario.reserva_cancelada(id_reserva)
+                else:
+                    calendario.reserva_creada(
+                        id_reserva, id_habitacion,
+                        date.fromisoformat(cambio["fecha_entrada"]), date.fromisoformat(cambio["fecha_salida"]),
+                    )
+            if evento == "eliminacion":
+                calendario.habitacion_eliminada(id_habitacion)
+                tarifas.habitacion_eliminada(id_habitacion)
+            elif habitacion:
+                calendario.habitacion_sincronizada(habitacion)
+                tarifas.habitacion_actualizada(id_habitacion, habitacion["tipo"], habitacion["precio_noche"])
+        if isinstance(cache, CacheLRU):
+            claves = [f"habitacion:{id_habitacion}"]
+            if id_reserva is not None:
+                claves.append(f"reservacion:{id_reserva}")
+            cache.descartar(claves)
+
+    def _desde(self, ultimo):
+        # Mensajes posteriores al aviso `ultimo`, o None si ya no está entre los recientes.
+        # Todos los procesos reciben los avisos en el orden en que se confirmaron, así que
+        # la posición sirve aunque el cliente se reconecte a otro proceso
+        for i, (id_aviso, _, _) in enumerate(self.recientes):
+            if id_aviso == ultimo:
+                return list(self.recientes)[i + 1:]
+        return None
+
+    async def flujo(self, request, tipo=None, ultimo=None):
+        # Generador de la respuesta text/event-stream de un cliente
+        suscriptor = Suscriptor(tipo)
+        # Suscribir y tomar los pendientes sin ceder el control: ningún aviso queda
+        # fuera ni llega dos veces
+        self.suscriptores.add(suscriptor)
+        pendientes = self._desde(ultimo) if ultimo is not None else []
+        try:
+            yield f"retry: {AVISOS_RECONEXION_MS}\n\n".encode()
+            if pendientes is None:
+                yield REINICIO
+            else:
+                for _, tipo_aviso, mensaje in pendientes:
+                    if tipo is None or tipo_aviso in (None, tipo):
+                        yield mensaje
+            while True:
+                try:
+                    mensaje = await asyncio.wait_for(suscriptor.cola.get(), AVISOS_LATIDO)
+                except asyncio.TimeoutError:
+                    # Al drenar se cierra el flujo: el cliente se reconecta a otro proceso
+                    # con Last-Event-ID y no pierde avisos
+                    if salud.drenando or await request.is_disconnected():
+                        break
+                    yield b": latido\n\n"
+                    continue
+                yield mensaje
+        finally:
+            self.suscriptores.discard(suscriptor)
+
+    def metricas(self):
+        return {
+            "conectado": self.conectado,
+            "suscriptores": len(self.suscriptores),
+            "recibidos": self.recibidos,
+            "recientes": len(self.recientes),
+            "reconexiones": max(self.conexiones - 1, 0),
+            "cambios_aplicados": self.aplicados,
+            "cambios_pendientes": self._cambios.qsize() if self._cambios else 0,
+            "sincronizaciones_enviadas": self.difundidos,
+        }
+
+
+avisos = Avisos(CANAL)
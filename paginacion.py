@@ -0,0 +1,98 @@
+import json
+import os
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from conexion_BD import stream, devolver_cedida
+
+try:
+    import orjson
+except ImportError:  # opcional: sin orjson se serializa con json
+    orjson = None
+
+# Filas por página cuando no se indica limit, y máximo permitido
+LIMITE_POR_DEFECTO = int(os.getenv("LIMITE_POR_DEFECTO", "100"))
+LIMITE_MAXIMO = int(os.getenv("LIMITE_MAXIMO", "1000"))
+
+
+def _a_json(valor):
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, (date, datetime, time)):
+        return valor.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+
+def a_bytes(contenido):
+    # orjson convierte fechas y horas por sí mismo; _a_json solo se llama para Decimal
+    if orjson is not None:
+        return orjson.dumps(contenido, default=_a_json)
+    return json.dumps(contenido, default=_a_json, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class RespuestaJSON(JSONResponse):
+    # Las rutas de lectura devuelven sus filas en una RespuestaJSON: FastAPI no pasa
+    # una Response por jsonable_encoder, así que las filas van directo a bytes
+    def render(self, contenido):
+        return a_bytes(contenido)
+
+
+def paginar(filas, limite, clave):
+    # Si la página vino llena puede haber más: se indica el valor a usar en `after`
+    respuesta = RespuestaJSON(filas)
+    if filas and len(filas) == limite:
+        respuesta.headers["X-Siguiente"] = str(filas[-1][clave])
+    return respuesta
+
+
+def _campos(modelo):
+    return getattr(modelo, "model_fields", None) or modelo.__fields__
+
+
+def columnas(fields, modelo, clave=None):
+    # ?fields=a,b -> "a, b" para el SELECT, validado contra el modelo de respuesta.
+    # La clave de paginación se incluye siempre para poder calcular X-Siguiente
+    if not fields:
+        return "*"
+    validas = _campos(modelo)
+    pedidas = []
+    for campo in [clave, *fields.split(",")]:
+        campo = (campo or "").strip()
+        if not campo or campo in pedidas:
+            continue
+        if campo not in validas:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Campo desconocido: {campo}. Disponibles: {', '.join(validas)}"
+            )
+        pedidas.append(campo)
+    return ", ".join(pedidas)
+
+
+async def _lineas(db, sql, params):
+    async for fila in stream(db, sql, params):
+        yield a_bytes(fila) + b"\n"
+
+
+class RespuestaNDJSON(StreamingResponse):
+    # Usa la conexión que la ruta ya obtuvo de get_db_lectura: sin pool libre la ruta
+    # responde 503 antes de empezar y no un 200 con el cuerpo vacío. La conexión vuelve
+    # al pool al terminar la respuesta, aunque el cliente se vaya antes del primer byte
+    def __init__(self, db, sql, params):
+        db.cedida = True
+        self.db = db
+        super().__init__(_lineas(db, sql, params), media_type="application/x-ndjson")
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            await devolver_cedida(self.db)
+
+
+def respuesta_ndjson(db, sql, params):
+    # Una fila JSON por línea, enviadas a medida que llegan del cursor del servidor
+    return RespuestaNDJSON(db, sql, params)
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from conexion_BD import get_connection
-from fastapi import APIRouter, HTTPException, Query
-from typing import Optional
+from conexion_BD import get_db, get_db_lectura, consultar_uno, error_http
+from cache import cache, leer
+from bitacora import bitacora
+from idempotencia import idempotente
+from paginacion import paginar, respuesta_ndjson, columnas, RespuestaJSON, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
+from fastapi import APIRouter, HTTPException, Depends, Query, Response, Header
+from typing import Optional, Literal, List
 from datetime import date
 
 
@@ -18,76 +21,94 @@ class PagoRequest(BaseModel):
     reembolso: int
     cargos_extra: str
 
-@router.post("/pagos")
-def registrar_pago(data: PagoRequest):
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("""
-            CALL registrar_pago(%s, %s, %s, %s, %s, %s, %s, %s);
-        """, (
-            data.id_reserva,
-            data.tipo_pago,
-            data.plataformas_integradas,
-            data.metodo_pago,
-            data.factura,
-            data.recibo,
-            data.reembolso,
-            data.cargos_extra
-        ))
-        conn.commit()
-        return {"mensaje": f"Pago registrado y reserva {data.id_reserva} actualizada a 'Confirmada'"}
-    except Exception as e:
-        conn.rollback()
-        if 'No se encontró cliente asociado' in str(e):
-            raise HTTPException(status_code=404, detail="Reserva sin cliente asociado")
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+# Modelo de respuesta (documentación de la API; las filas se envían sin validar)
+class Pago(BaseModel):
+    id_pago: int
+    tipo_pago: str
+    plataformas_integradas: str
+    metodo_pago: str
+    factura: str
+    recibo: Optional[str] = None
+    reembolso: Optional[int] = None
+    cargos_extra: Optional[str] = None
+    id_reserva: Optional[int] = None
+    documento_identidad: Optional[str] = None
+    fecha_pago: Optional[date] = None
 
-router = APIRouter()
+@router.post("/pagos")
+async def registrar_pago(
+    data: PagoRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
+    db=Depends(get_db)
+):
+    # Con Idempotency-Key un reintento devuelve el pago original en lugar de registrar otro
+    async with idempotente(db, "POST /pagos", idempotency_key, data) as solicitud:
+        if solicitud.repetida:
+            response.headers["Idempotent-Replayed"] = "true"
+            return solicitud.respuesta
+        try:
+            # El NULL es el parámetro INOUT con el id del pago creado
+            fila = await db.fetchone("""
+                CALL registrar_pago(%s, %s, %s, %s, %s, %s, %s, %s, NULL);
+            """, (
+                data.id_reserva,
+                data.tipo_pago,
+                data.plataformas_integradas,
+                data.metodo_pago,
+                data.factura,
+                data.recibo,
+                data.reembolso,
+                data.cargos_extra
+            ))
+        except Exception as e:
+            if 'No se encontró cliente asociado' in str(e):
+                raise HTTPException(status_code=404, detail="Reserva sin cliente asociado")
+            raise error_http(e)
+        solicitud.respuesta = {
+            "mensaje": f"Pago registrado y reserva {data.id_reserva} actualizada a 'Confirmada'",
+            "id_pago": fila["p_id_pago"]
+        }
+    # registrar_pago confirma la reserva
+    await cache.invalidar(f"reservacion:{data.id_reserva}")
+    await bitacora.registrado()
+    return solicitud.respuesta
 
-@router.get("/pagos/{id}")
-def obtener_pago_por_id(id: int):
-    conn = get_connection()
-    cur = conn.cursor()
+@router.get("/pagos/{id}", response_model=Pago)
+async def obtener_pago_por_id(id: int):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("SELECT * FROM obtener_pago(%s);", (id,))
-        pago = cur.fetchone()
-        if not pago:
-            raise HTTPException(status_code=404, detail="Pago no encontrado")
-        
-        columnas = [desc[0] for desc in cur.description]
-        resultado = dict(zip(columnas, pago))
-        return resultado
+        # Etiquetado con su reserva: si se cancela, cancelar_reservacion borra sus pagos
+        pago = await leer(
+            f"pago:{id}",
+            lambda: consultar_uno("SELECT * FROM obtener_pago(%s);", (id,)),
+            lambda p: [f"reservacion:{p['id_reserva']}"]
+        )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e, 500)
+    if not pago:
+        raise HTTPException(status_code=404, detail="Pago no encontrado")
+    return RespuestaJSON(pago)
 
-@router.get("/pagos")
-def obtener_pagos(
+# fields=metodo_pago,fecha_pago devuelve solo esas columnas (más id_pago)
+@router.get("/pagos", response_model=List[Pago])
+async def obtener_pagos(
     id_cliente: Optional[str] = Query(None, alias="id_cliente"),
     fecha_pago: Optional[date] = Query(None),
-    metodo_pago: Optional[str] = Query(None)
+    metodo_pago: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    after: Optional[int] = Query(None),
+    formato: Literal["json", "ndjson"] = Query("json"),
+    fields: Optional[str] = Query(None, description="Columnas separadas por comas"),
+    db=Depends(get_db_lectura)
 ):
-    conn = get_connection()
-    cur = conn.cursor()
+    sql = f"""
+            SELECT {columnas(fields, Pago, 'id_pago')} FROM filtrar_pagos(%s, %s, %s, %s, %s);
+        """
+    if formato == "ndjson":
+        return respuesta_ndjson(db, sql, (id_cliente, fecha_pago, metodo_pago, after, limit))
+    limite = limit or LIMITE_POR_DEFECTO
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("""
-            SELECT * FROM filtrar_pagos(%s, %s, %s);
-        """, (id_cliente, fecha_pago, metodo_pago))
-        pagos = cur.fetchall()
-        columnas = [desc[0] for desc in cur.description]
-        resultados = [dict(zip(columnas, fila)) for fila in pagos]
-        return resultados
+        resultados = await db.fetchall(sql, (id_cliente, fecha_pago, metodo_pago, after, limite))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+        raise error_http(e, 500)
+    return paginar(resultados, limite, "id_pago")
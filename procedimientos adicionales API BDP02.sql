@@ -1,5 +1,34 @@
 set search_path to sch_reservas_hotel;
 
+-- VALIDACIONES PARA CARGAS MASIVAS
+-- Las cargas masivas copian el archivo como texto a tablas temporales (COPY) y
+-- validan cada fila antes de convertirla, para rechazar filas sin abortar la carga.
+
+CREATE OR REPLACE FUNCTION es_fecha(p_valor TEXT)
+RETURNS BOOLEAN
+LANGUAGE plpgsql
+IMMUTABLE
+AS $$
+BEGIN
+    IF p_valor IS NULL OR p_valor !~ '^\d{4}-\d{2}-\d{2}$' THEN
+        RETURN FALSE;
+    END IF;
+    PERFORM p_valor::DATE;
+    RETURN TRUE;
+EXCEPTION WHEN others THEN
+    RETURN FALSE;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION es_numero(p_valor TEXT)
+RETURNS BOOLEAN
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT p_valor ~ '^\s*-?\d+(\.\d+)?\s*$';
+$$;
+
+
 -- CLIENTES
 
 --crear cliente
@@ -149,11 +178,17 @@ $$;
 
 
 --Filtros opcionales
+--Los ILIKE '%...%' usan los índices de trigramas de cliente (nombre, correo, nacionalidad)
+DROP FUNCTION IF EXISTS filtrar_clientes(VARCHAR, VARCHAR, VARCHAR);
+DROP FUNCTION IF EXISTS filtrar_clientes(VARCHAR, VARCHAR, VARCHAR, VARCHAR, INT);
 CREATE OR REPLACE FUNCTION filtrar_clientes(
 --parametros opcionales
     p_nombre VARCHAR DEFAULT NULL,
     p_correo VARCHAR DEFAULT NULL,
-    p_nacionalidad VARCHAR DEFAULT NULL
+    p_nacionalidad VARCHAR DEFAULT NULL,
+--paginacion por llave (keyset): filas con documento mayor a p_despues, como maximo p_limite
+    p_despues VARCHAR DEFAULT NULL,
+    p_limite INT DEFAULT NULL
 )
 --datos que devolvera
 RETURNS TABLE (
@@ -162,21 +197,169 @@ RETURNS TABLE (
     nacionalidad VARCHAR,
     telefono VARCHAR,
     correo VARCHAR,
-    ID_pago INT,
     fecha_nacimiento DATE
 )
 LANGUAGE plpgsql
 AS $$
 BEGIN
     RETURN QUERY
-    SELECT c.documento_identidad, c.nombre, c.nacionalidad, c.telefono, c.correo, c.ID_pago, c.fecha_nacimiento
+    SELECT c.documento_identidad, c.nombre, c.nacionalidad, c.telefono, c.correo, c.fecha_nacimiento
     FROM cliente c -- Se hace alias 'c' a la tabla cliente para evitar ambigüedades
 	
     -- Se aplican filtros solo si los parámetros no son NULL
     -- Se usa ILIKE para permitir búsquedas insensibles a mayúsculas/minúsculas
     WHERE (p_nombre IS NULL OR c.nombre ILIKE '%' || p_nombre || '%')
       AND (p_correo IS NULL OR c.correo ILIKE '%' || p_correo || '%')
-      AND (p_nacionalidad IS NULL OR c.nacionalidad ILIKE '%' || p_nacionalidad || '%');
+      AND (p_nacionalidad IS NULL OR c.nacionalidad ILIKE '%' || p_nacionalidad || '%')
+      AND (p_despues IS NULL OR c.documento_identidad > p_despues)
+    ORDER BY c.documento_identidad
+    LIMIT p_limite;
+END;
+$$;
+
+--Escapa los comodines de LIKE (% y _) para buscar el texto tal como lo escribió el usuario
+CREATE OR REPLACE FUNCTION escapar_like(p_texto TEXT)
+RETURNS TEXT
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT replace(replace(replace(p_texto, '\', '\\'), '%', '\%'), '_', '\_');
+$$;
+
+--Búsqueda de clientes por nombre o correo, ordenada por relevancia.
+--Encuentra el texto como subcadena (ILIKE) o con errores de escritura (similitud de
+--trigramas por palabra, operador <%); ambos usan los índices de trigramas.
+CREATE OR REPLACE FUNCTION buscar_clientes(
+    p_texto VARCHAR,
+    p_limite INT DEFAULT 20
+)
+RETURNS TABLE (
+    documento_identidad VARCHAR,
+    nombre VARCHAR,
+    nacionalidad VARCHAR,
+    telefono VARCHAR,
+    correo VARCHAR,
+    fecha_nacimiento DATE,
+    relevancia REAL
+)
+LANGUAGE plpgsql
+STABLE
+AS $$
+DECLARE
+    v_patron TEXT := '%' || escapar_like(p_texto) || '%';
+BEGIN
+    RETURN QUERY
+    SELECT c.documento_identidad, c.nombre, c.nacionalidad, c.telefono, c.correo, c.fecha_nacimiento,
+           -- Las coincidencias exactas de subcadena van primero, luego por similitud
+           (CASE WHEN c.nombre ILIKE v_patron OR c.correo ILIKE v_patron THEN 1 ELSE 0 END
+            + GREATEST(word_similarity(p_texto, c.nombre), word_similarity(p_texto, c.correo)))::REAL
+    FROM cliente c
+    WHERE c.nombre ILIKE v_patron
+       OR c.correo ILIKE v_patron
+       OR p_texto <% c.nombre
+       OR p_texto <% c.correo
+    ORDER BY 7 DESC, c.documento_identidad
+    LIMIT p_limite;
+END;
+$$;
+
+--Autocompletado: clientes cuyo nombre o correo empieza con el prefijo (índices por prefijo)
+CREATE OR REPLACE FUNCTION autocompletar_clientes(
+    p_prefijo VARCHAR,
+    p_limite INT DEFAULT 10
+)
+RETURNS TABLE (
+    documento_identidad VARCHAR,
+    nombre VARCHAR,
+    correo VARCHAR
+)
+LANGUAGE plpgsql
+STABLE
+AS $$
+DECLARE
+    v_patron TEXT := escapar_like(lower(p_prefijo)) || '%';
+BEGIN
+    RETURN QUERY
+    SELECT t.documento_identidad, t.nombre, t.correo
+    FROM (
+        (SELECT c.documento_identidad, c.nombre, c.correo, lower(c.nombre) AS orden
+         FROM cliente c
+         WHERE lower(c.nombre) LIKE v_patron
+         ORDER BY lower(c.nombre)
+         LIMIT p_limite)
+        UNION ALL
+        (SELECT c.documento_identidad, c.nombre, c.correo, lower(c.correo) AS orden
+         FROM cliente c
+         WHERE lower(c.correo) LIKE v_patron
+         ORDER BY lower(c.correo)
+         LIMIT p_limite)
+    ) t
+    -- Un cliente que coincide por nombre y por correo aparece una sola vez
+    GROUP BY t.documento_identidad, t.nombre, t.correo
+    ORDER BY min(t.orden), t.documento_identidad
+    LIMIT p_limite;
+END;
+$$;
+
+--Carga masiva de clientes desde la tabla temporal stg_cliente (ver carga_masiva.py).
+--Aplica las mismas validaciones que crear_cliente, inserta o actualiza cliente y
+--documentos, y devuelve las filas rechazadas.
+CREATE OR REPLACE FUNCTION cargar_clientes_staging()
+RETURNS TABLE (
+    linea BIGINT,
+    motivo TEXT
+)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+BEGIN
+    UPDATE stg_cliente s
+    SET motivo = CASE
+        WHEN s.documento_identidad IS NULL THEN 'Documento de identidad vacío'
+        WHEN s.email IS NULL OR NOT (s.email ~* '^[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}$')
+            THEN 'Formato de correo inválido: ' || COALESCE(s.email, '')
+        WHEN NOT es_fecha(s.fecha_nacimiento) THEN 'Fecha de nacimiento inválida: ' || COALESCE(s.fecha_nacimiento, '')
+        WHEN s.fecha_nacimiento::DATE > CURRENT_DATE THEN 'La fecha de nacimiento es inválida: ' || s.fecha_nacimiento
+        WHEN s.contratos IS NULL OR s.facturacion_electronica IS NULL THEN 'Faltan contratos o facturación electrónica'
+    END;
+
+    -- Si un documento se repite en el archivo se usa su última aparición
+    UPDATE stg_cliente s
+    SET motivo = 'Documento repetido en el archivo (se usa la fila ' || d.ultima || ')'
+    FROM (
+        SELECT x.documento_identidad, max(x.linea) AS ultima
+        FROM stg_cliente x
+        WHERE x.motivo IS NULL
+        GROUP BY x.documento_identidad
+    ) d
+    WHERE s.motivo IS NULL
+      AND s.documento_identidad = d.documento_identidad
+      AND s.linea < d.ultima;
+
+    INSERT INTO cliente (documento_identidad, nombre, nacionalidad, telefono, correo, fecha_nacimiento)
+    SELECT s.documento_identidad, s.nombre, s.nacionalidad, s.telefono, s.email, s.fecha_nacimiento::DATE
+    FROM stg_cliente s
+    WHERE s.motivo IS NULL
+    ON CONFLICT (documento_identidad) DO UPDATE
+    SET nombre = EXCLUDED.nombre,
+        nacionalidad = EXCLUDED.nacionalidad,
+        telefono = EXCLUDED.telefono,
+        correo = EXCLUDED.correo,
+        fecha_nacimiento = EXCLUDED.fecha_nacimiento;
+
+    INSERT INTO documentos (copia_pasaporte, contratos, facturacion_electronica)
+    SELECT s.documento_identidad, s.contratos, s.facturacion_electronica
+    FROM stg_cliente s
+    WHERE s.motivo IS NULL
+    ON CONFLICT (copia_pasaporte) DO UPDATE
+    SET contratos = EXCLUDED.contratos,
+        facturacion_electronica = EXCLUDED.facturacion_electronica;
+
+    RETURN QUERY
+    SELECT s.linea, s.motivo
+    FROM stg_cliente s
+    WHERE s.motivo IS NOT NULL
+    ORDER BY s.linea;
 END;
 $$;
 
@@ -198,6 +381,7 @@ AS $$
 DECLARE
     v_id_costos INT;
     v_id_evento INT;
+    v_id_habitacion INT;
 BEGIN
     -- Insertar en costos usando los valores definidos por el usuario
     INSERT INTO costos (temporada, promociones_especiales, precio_noche)
@@ -211,7 +395,10 @@ BEGIN
 
     -- Insertar en habitacion
     INSERT INTO habitacion (numero, tipo, descripcion, disponibilidad, caracteristicas, id_costos, id_evento)
-    VALUES (p_numero, p_tipo, p_descripcion, p_disponibilidad, p_caracteristicas, v_id_costos, v_id_evento);
+    VALUES (p_numero, p_tipo, p_descripcion, p_disponibilidad, p_caracteristicas, v_id_costos, v_id_evento)
+    RETURNING id_habitacion INTO v_id_habitacion;
+
+    PERFORM notificar_habitacion(v_id_habitacion, 'creacion');
 
     RAISE NOTICE 'Habitación creada exitosamente con costo % y evento %', v_id_costos, v_id_evento;
 END;
@@ -277,6 +464,8 @@ BEGIN
     WHERE id_costos = (
         SELECT id_costos FROM habitacion WHERE id_habitacion = p_id_habitacion
     );
+
+    PERFORM notificar_habitacion(p_id_habitacion, 'actualizacion');
 END;
 $$;
 
@@ -303,6 +492,9 @@ BEGIN
     FROM habitacion
     WHERE id_habitacion = p_id_habitacion;
 
+    -- El aviso lleva los datos de la habitación, así que se arma antes de borrarla
+    PERFORM notificar_habitacion(p_id_habitacion, 'eliminacion');
+
     -- Eliminar la habitación
     DELETE FROM habitacion
     WHERE id_habitacion = p_id_habitacion;
@@ -322,11 +514,15 @@ END;
 $$;
 
 --Filtros de busqueda
+DROP FUNCTION IF EXISTS filtrar_habitaciones(VARCHAR, NUMERIC, VARCHAR);
 CREATE OR REPLACE FUNCTION filtrar_habitaciones(
 --parametros de filtro
     p_tipo VARCHAR DEFAULT NULL,
     p_precio_maximo NUMERIC DEFAULT NULL,
-    p_disponibilidad VARCHAR DEFAULT NULL
+    p_disponibilidad VARCHAR DEFAULT NULL,
+--paginacion por llave (keyset)
+    p_despues INT DEFAULT NULL,
+    p_limite INT DEFAULT NULL
 )
 RETURNS TABLE (
     id_habitacion INT,
@@ -353,7 +549,111 @@ BEGIN
     JOIN costos c ON h.id_costos = c.id_costos
     WHERE (p_tipo IS NULL OR h.tipo = p_tipo)
       AND (p_precio_maximo IS NULL OR c.precio_noche <= p_precio_maximo)
-      AND (p_disponibilidad IS NULL OR h.disponibilidad = p_disponibilidad);
+      AND (p_disponibilidad IS NULL OR h.disponibilidad = p_disponibilidad)
+      AND (p_despues IS NULL OR h.id_habitacion > p_despues)
+    ORDER BY h.id_habitacion
+    LIMIT p_limite;
+END;
+$$;
+
+--Carga masiva de habitaciones desde la tabla temporal stg_habitacion (ver carga_masiva.py).
+--Si ya existe una habitación con el mismo número se actualiza junto con su costo;
+--si no, se crea con su propio costo y evento como en crear_habitacion.
+CREATE OR REPLACE FUNCTION cargar_habitaciones_staging()
+RETURNS TABLE (
+    linea BIGINT,
+    motivo TEXT
+)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+BEGIN
+    UPDATE stg_habitacion s
+    SET motivo = CASE
+        WHEN s.numero IS NULL OR s.numero !~ '^\s*\d+\s*$' THEN 'Número de habitación inválido: ' || COALESCE(s.numero, '')
+        WHEN s.tipo IS NULL OR s.tipo NOT IN ('sencilla', 'doble', 'suite') THEN 'Tipo inválido: ' || COALESCE(s.tipo, '')
+        WHEN s.disponibilidad IS NULL OR s.disponibilidad NOT IN ('libre', 'ocupada', 'en limpieza', 'en mantenimiento')
+            THEN 'Disponibilidad inválida: ' || COALESCE(s.disponibilidad, '')
+        WHEN s.descripcion IS NULL OR s.caracteristicas IS NULL THEN 'Faltan descripción o características'
+        WHEN s.precio_noche IS NULL OR NOT es_numero(s.precio_noche) OR s.precio_noche::NUMERIC < 0
+            THEN 'Precio por noche inválido: ' || COALESCE(s.precio_noche, '')
+    END;
+
+    -- Si un número se repite en el archivo se usa su última aparición
+    UPDATE stg_habitacion s
+    SET motivo = 'Número repetido en el archivo (se usa la fila ' || d.ultima || ')'
+    FROM (
+        SELECT x.numero, max(x.linea) AS ultima
+        FROM stg_habitacion x
+        WHERE x.motivo IS NULL
+        GROUP BY x.numero
+    ) d
+    WHERE s.motivo IS NULL
+      AND s.numero = d.numero
+      AND s.linea < d.ultima;
+
+    -- Se convierten a sus tipos solo las filas válidas, en una tabla aparte, para que
+    -- los joins de abajo nunca evalúen la conversión sobre una fila rechazada
+    CREATE TEMP TABLE stg_habitacion_ok ON COMMIT DROP AS
+    SELECT
+        s.numero::INT AS numero, s.tipo, s.descripcion, s.disponibilidad, s.caracteristicas,
+        s.temporada, s.promociones_especiales, s.precio_noche::NUMERIC(10,2) AS precio_noche
+    FROM stg_habitacion s
+    WHERE s.motivo IS NULL;
+
+    -- Habitaciones existentes
+    UPDATE habitacion h
+    SET tipo = v.tipo,
+        descripcion = v.descripcion,
+        disponibilidad = v.disponibilidad,
+        caracteristicas = v.caracteristicas
+    FROM stg_habitacion_ok v
+    WHERE h.numero = v.numero;
+
+    UPDATE costos c
+    SET temporada = v.temporada,
+        promociones_especiales = v.promociones_especiales,
+        precio_noche = v.precio_noche
+    FROM stg_habitacion_ok v
+    JOIN habitacion h ON h.numero = v.numero
+    WHERE c.id_costos = h.id_costos;
+
+    -- Habitaciones nuevas: un costo y un evento por habitación
+    WITH nuevas AS MATERIALIZED (
+        SELECT
+            v.*,
+            nextval(pg_get_serial_sequence('costos', 'id_costos')) AS id_costos,
+            nextval(pg_get_serial_sequence('eventos', 'id_evento')) AS id_evento
+        FROM stg_habitacion_ok v
+        WHERE NOT EXISTS (SELECT 1 FROM habitacion h WHERE h.numero = v.numero)
+    ),
+    ins_costos AS (
+        INSERT INTO costos (id_costos, temporada, promociones_especiales, precio_noche)
+        SELECT n.id_costos, n.temporada, n.promociones_especiales, n.precio_noche FROM nuevas n
+    ),
+    ins_eventos AS (
+        INSERT INTO eventos (ID_evento, habitacion_VIP, bloqueo_por_eventos, grupos)
+        SELECT n.id_evento, FALSE, FALSE, FALSE FROM nuevas n
+    )
+    INSERT INTO habitacion (numero, tipo, descripcion, disponibilidad, caracteristicas, id_costos, id_evento)
+    SELECT n.numero, n.tipo, n.descripcion, n.disponibilidad, n.caracteristicas, n.id_costos, n.id_evento
+    FROM nuevas n;
+
+    -- Un solo aviso para toda la carga (ver notificar_habitacion): los clientes de
+    -- GET /habitaciones/eventos vuelven a leer la lista y cada proceso de la API
+    -- vuelve a leer sus habitaciones
+    IF EXISTS (SELECT 1 FROM stg_habitacion_ok) THEN
+        PERFORM pg_notify('habitaciones', json_build_object(
+            'id', nextval('seq_aviso_habitacion'),
+            'evento', 'carga'
+        )::TEXT);
+    END IF;
+
+    RETURN QUERY
+    SELECT s.linea, s.motivo
+    FROM stg_habitacion s
+    WHERE s.motivo IS NOT NULL
+    ORDER BY s.linea;
 END;
 $$;
 
@@ -417,14 +717,43 @@ BEGIN
         numero_huespedes = p_numero_huespedes,
         solicitudes_especial = p_solicitudes_especial
     WHERE id_reserva = p_id_reserva;
+
+    PERFORM notificar_habitacion(
+        (SELECT id_habitacion FROM reserva WHERE id_reserva = p_id_reserva), 'modificacion', p_id_reserva
+    );
 END;
 $$;
 
+--Reservas activas que siguen vigentes a partir de una fecha (para el calendario de ocupación en memoria)
+CREATE OR REPLACE FUNCTION reservas_activas_desde(p_fecha DATE)
+RETURNS TABLE (
+    id_reserva INT,
+    id_habitacion INT,
+    fecha_entrada DATE,
+    fecha_salida DATE
+)
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        r.id_reserva,
+        r.id_habitacion,
+        r.fecha_entrada,
+        r.fecha_salida
+    FROM reserva r
+    WHERE r.estado_reserva <> 'Cancelada'
+      AND r.fecha_salida > p_fecha;
+END;
+$$ LANGUAGE plpgsql;
+
 --Consultar reservas filtros opcionales:
 
+DROP FUNCTION IF EXISTS filtrar_reservas(VARCHAR, DATE);
 CREATE OR REPLACE FUNCTION filtrar_reservas(
     p_documento_identidad VARCHAR DEFAULT NULL,
-    p_fecha_entrada DATE DEFAULT NULL
+    p_fecha_entrada DATE DEFAULT NULL,
+    p_despues INT DEFAULT NULL,  -- paginacion por llave (keyset)
+    p_limite INT DEFAULT NULL
 )
 RETURNS TABLE (
     id_reserva INT,
@@ -439,23 +768,82 @@ RETURNS TABLE (
     documento_identidad VARCHAR
 ) AS $$
 BEGIN
-    RETURN QUERY
-    SELECT 
-        r.id_reserva,
-        r.numero_huespedes,
-        r.solicitudes_especial,
-        r.tipo_reserva,
-        r.tipo_confirmacion,
-        r.fecha_entrada,
-        r.fecha_salida,
-        r.id_politicas,
-        r.id_habitacion,
-        r.documento_identidad
-    FROM reserva r
-    WHERE
-        (p_documento_identidad IS NULL OR r.documento_identidad = p_documento_identidad)
-        AND
-        (p_fecha_entrada IS NULL OR r.fecha_entrada = p_fecha_entrada);
+    -- Una consulta por combinación de filtros: con "p_x IS NULL OR ..." el plan
+    -- genérico que guarda PL/pgSQL no usa idx_reserva_documento_identidad ni
+    -- idx_reserva_fechas; cada rama tiene su propio plan con el índice que le sirve
+    IF p_documento_identidad IS NOT NULL AND p_fecha_entrada IS NOT NULL THEN
+        RETURN QUERY
+        SELECT
+            r.id_reserva,
+            r.numero_huespedes,
+            r.solicitudes_especial,
+            r.tipo_reserva,
+            r.tipo_confirmacion,
+            r.fecha_entrada,
+            r.fecha_salida,
+            r.id_politicas,
+            r.id_habitacion,
+            r.documento_identidad
+        FROM reserva r
+        WHERE r.documento_identidad = p_documento_identidad
+          AND r.fecha_entrada = p_fecha_entrada
+          AND r.id_reserva > COALESCE(p_despues, 0)
+        ORDER BY r.id_reserva
+        LIMIT p_limite;
+    ELSIF p_documento_identidad IS NOT NULL THEN
+        RETURN QUERY
+        SELECT
+            r.id_reserva,
+            r.numero_huespedes,
+            r.solicitudes_especial,
+            r.tipo_reserva,
+            r.tipo_confirmacion,
+            r.fecha_entrada,
+            r.fecha_salida,
+            r.id_politicas,
+            r.id_habitacion,
+            r.documento_identidad
+        FROM reserva r
+        WHERE r.documento_identidad = p_documento_identidad
+          AND r.id_reserva > COALESCE(p_despues, 0)
+        ORDER BY r.id_reserva
+        LIMIT p_limite;
+    ELSIF p_fecha_entrada IS NOT NULL THEN
+        RETURN QUERY
+        SELECT
+            r.id_reserva,
+            r.numero_huespedes,
+            r.solicitudes_especial,
+            r.tipo_reserva,
+            r.tipo_confirmacion,
+            r.fecha_entrada,
+            r.fecha_salida,
+            r.id_politicas,
+            r.id_habitacion,
+            r.documento_identidad
+        FROM reserva r
+        WHERE r.fecha_entrada = p_fecha_entrada
+          AND r.id_reserva > COALESCE(p_despues, 0)
+        ORDER BY r.id_reserva
+        LIMIT p_limite;
+    ELSE
+        RETURN QUERY
+        SELECT
+            r.id_reserva,
+            r.numero_huespedes,
+            r.solicitudes_especial,
+            r.tipo_reserva,
+            r.tipo_confirmacion,
+            r.fecha_entrada,
+            r.fecha_salida,
+            r.id_politicas,
+            r.id_habitacion,
+            r.documento_identidad
+        FROM reserva r
+        WHERE r.id_reserva > COALESCE(p_despues, 0)
+        ORDER BY r.id_reserva
+        LIMIT p_limite;
+    END IF;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -463,6 +851,7 @@ $$ LANGUAGE plpgsql;
 
 --PAGOS
 
+DROP PROCEDURE IF EXISTS registrar_pago(INT, VARCHAR, VARCHAR, VARCHAR, VARCHAR, VARCHAR, INT, VARCHAR);
 CREATE OR REPLACE PROCEDURE registrar_pago(
     p_id_reserva INT,
     p_tipo_pago VARCHAR,
@@ -471,7 +860,8 @@ CREATE OR REPLACE PROCEDURE registrar_pago(
     p_factura VARCHAR,
     p_recibo VARCHAR,
     p_reembolso INT,
-    p_cargos_extra VARCHAR
+    p_cargos_extra VARCHAR,
+    INOUT p_id_pago INT DEFAULT NULL   -- salida: id del pago creado
 )
 LANGUAGE plpgsql
 AS $$
@@ -495,7 +885,8 @@ BEGIN
     ) VALUES (
         p_tipo_pago, p_plataformas_integradas, p_metodo_pago,
         p_factura, p_recibo, p_reembolso, p_cargos_extra, p_id_reserva, v_documento_identidad
-    );
+    )
+    RETURNING ID_pago INTO p_id_pago;
 
     -- Actualizar el estado de la reserva
     CALL ActualizarEstadoPago(p_id_reserva);
@@ -536,10 +927,13 @@ END;
 $$ LANGUAGE plpgsql;
 
 
+DROP FUNCTION IF EXISTS filtrar_pagos(VARCHAR, DATE, VARCHAR);
 CREATE OR REPLACE FUNCTION filtrar_pagos(
     p_documento_identidad VARCHAR DEFAULT NULL,
     p_fecha_pago DATE DEFAULT NULL,
-    p_metodo_pago VARCHAR DEFAULT NULL
+    p_metodo_pago VARCHAR DEFAULT NULL,
+    p_despues INT DEFAULT NULL,  -- paginacion por llave (keyset)
+    p_limite INT DEFAULT NULL
 )
 RETURNS TABLE (
     id_pago INT,
@@ -556,24 +950,88 @@ RETURNS TABLE (
 )
 AS $$
 BEGIN
-    RETURN QUERY
-    SELECT 
-        p.id_pago,
-        p.tipo_pago,
-        p.plataformas_integradas,
-        p.metodo_pago,
-        p.factura,
-        p.recibo,
-        p.reembolso,
-        p.cargos_extra,
-        p.id_reserva,
-        p.documento_identidad,
-        p.fecha_pago
-    FROM pago p
-    WHERE 
-        (p_documento_identidad IS NULL OR p.documento_identidad = p_documento_identidad) AND
-        (p_fecha_pago IS NULL OR p.fecha_pago = p_fecha_pago) AND
-        (p_metodo_pago IS NULL OR p.metodo_pago = p_metodo_pago);
+    -- Una consulta por el filtro más selectivo recibido, para que cada una tenga su
+    -- plan con el índice correspondiente (idx_pago_documento_identidad, idx_pago_fecha,
+    -- idx_pago_metodo); los demás filtros se aplican sobre las filas que trae el índice
+    IF p_documento_identidad IS NOT NULL THEN
+        RETURN QUERY
+        SELECT
+            p.id_pago,
+            p.tipo_pago,
+            p.plataformas_integradas,
+            p.metodo_pago,
+            p.factura,
+            p.recibo,
+            p.reembolso,
+            p.cargos_extra,
+            p.id_reserva,
+            p.documento_identidad,
+            p.fecha_pago
+        FROM pago p
+        WHERE p.documento_identidad = p_documento_identidad
+          AND (p_fecha_pago IS NULL OR p.fecha_pago = p_fecha_pago)
+          AND (p_metodo_pago IS NULL OR p.metodo_pago = p_metodo_pago)
+          AND p.id_pago > COALESCE(p_despues, 0)
+        ORDER BY p.id_pago
+        LIMIT p_limite;
+    ELSIF p_fecha_pago IS NOT NULL THEN
+        RETURN QUERY
+        SELECT
+            p.id_pago,
+            p.tipo_pago,
+            p.plataformas_integradas,
+            p.metodo_pago,
+            p.factura,
+            p.recibo,
+            p.reembolso,
+            p.cargos_extra,
+            p.id_reserva,
+            p.documento_identidad,
+            p.fecha_pago
+        FROM pago p
+        WHERE p.fecha_pago = p_fecha_pago
+          AND (p_metodo_pago IS NULL OR p.metodo_pago = p_metodo_pago)
+          AND p.id_pago > COALESCE(p_despues, 0)
+        ORDER BY p.id_pago
+        LIMIT p_limite;
+    ELSIF p_metodo_pago IS NOT NULL THEN
+        RETURN QUERY
+        SELECT
+            p.id_pago,
+            p.tipo_pago,
+            p.plataformas_integradas,
+            p.metodo_pago,
+            p.factura,
+            p.recibo,
+            p.reembolso,
+            p.cargos_extra,
+            p.id_reserva,
+            p.documento_identidad,
+            p.fecha_pago
+        FROM pago p
+        WHERE p.metodo_pago = p_metodo_pago
+          AND p.id_pago > COALESCE(p_despues, 0)
+        ORDER BY p.id_pago
+        LIMIT p_limite;
+    ELSE
+        RETURN QUERY
+        SELECT
+            p.id_pago,
+            p.tipo_pago,
+            p.plataformas_integradas,
+            p.metodo_pago,
+            p.factura,
+            p.recibo,
+            p.reembolso,
+            p.cargos_extra,
+            p.id_reserva,
+            p.documento_identidad,
+            p.fecha_pago
+        FROM pago p
+        WHERE p.id_pago > COALESCE(p_despues, 0)
+        ORDER BY p.id_pago
+        LIMIT p_limite;
+    END IF;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -668,7 +1126,12 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE OR REPLACE FUNCTION filtrar_servicios(p_filtro_disponible BOOLEAN DEFAULT NULL)
+DROP FUNCTION IF EXISTS filtrar_servicios(BOOLEAN);
+CREATE OR REPLACE FUNCTION filtrar_servicios(
+    p_filtro_disponible BOOLEAN DEFAULT NULL,
+    p_despues INT DEFAULT NULL,  -- paginacion por llave (keyset)
+    p_limite INT DEFAULT NULL
+)
 RETURNS TABLE (
     id_servicio INT,
     documento_identidad VARCHAR,
@@ -682,19 +1145,259 @@ RETURNS TABLE (
 )
 AS $$
 BEGIN
-    RETURN QUERY
-    SELECT 
-        s.id_servicio,
-        s.documento_identidad,
-        s.nombre,
-        s.disponibilidad,
-        s.horario,
-        s.precio,
-        s.promociones,
-        s.servicios_extra,
-        s.ofertas_personalizadas
-    FROM servicios s
-    WHERE p_filtro_disponible IS NULL OR s.disponibilidad = p_filtro_disponible;
+    -- Con el filtro, la consulta propia usa idx_servicios_disponibilidad
+    IF p_filtro_disponible IS NOT NULL THEN
+        RETURN QUERY
+        SELECT
+            s.id_servicio,
+            s.documento_identidad,
+            s.nombre,
+            s.disponibilidad,
+            s.horario,
+            s.precio,
+            s.promociones,
+            s.servicios_extra,
+            s.ofertas_personalizadas
+        FROM servicios s
+        WHERE s.disponibilidad = p_filtro_disponible
+          AND s.id_servicio > COALESCE(p_despues, 0)
+        ORDER BY s.id_servicio
+        LIMIT p_limite;
+    ELSE
+        RETURN QUERY
+        SELECT
+            s.id_servicio,
+            s.documento_identidad,
+            s.nombre,
+            s.disponibilidad,
+            s.horario,
+            s.precio,
+            s.promociones,
+            s.servicios_extra,
+            s.ofertas_personalizadas
+        FROM servicios s
+        WHERE s.id_servicio > COALESCE(p_despues, 0)
+        ORDER BY s.id_servicio
+        LIMIT p_limite;
+    END IF;
 END;
 $$ LANGUAGE plpgsql;
 
+
+--Carga masiva de servicios desde la tabla temporal stg_servicio (ver carga_masiva.py).
+--Los servicios no tienen llave natural, así que cada fila válida se inserta.
+CREATE OR REPLACE FUNCTION cargar_servicios_staging()
+RETURNS TABLE (
+    linea BIGINT,
+    motivo TEXT
+)
+LANGUAGE plpgsql
+AS $$
+#variable_conflict use_column
+BEGIN
+    UPDATE stg_servicio s
+    SET motivo = CASE
+        WHEN s.documento_identidad IS NULL THEN 'Documento de identidad vacío'
+        WHEN NOT EXISTS (SELECT 1 FROM cliente c WHERE c.documento_identidad = s.documento_identidad)
+            THEN 'No existe el cliente ' || s.documento_identidad
+        WHEN s.nombre_servicio IS NULL THEN 'Nombre del servicio vacío'
+        WHEN s.disponible IS NULL OR lower(s.disponible) NOT IN ('true', 'false', 't', 'f', '1', '0')
+            THEN 'Valor de disponible inválido: ' || COALESCE(s.disponible, '')
+        WHEN s.horario IS NULL OR s.horario !~ '^([01]?\d|2[0-3]):[0-5]\d(:[0-5]\d)?$'
+            THEN 'Horario inválido: ' || COALESCE(s.horario, '')
+        WHEN s.precio_unitario IS NULL OR NOT es_numero(s.precio_unitario)
+            THEN 'Precio inválido: ' || COALESCE(s.precio_unitario, '')
+        WHEN s.promociones IS NULL OR s.servicios_extra IS NULL OR s.ofertas_personalizadas IS NULL
+            THEN 'Faltan promociones, servicios extra u ofertas personalizadas'
+    END;
+
+    INSERT INTO servicios (
+        documento_identidad, nombre, disponibilidad, horario,
+        precio, promociones, servicios_extra, ofertas_personalizadas
+    )
+    SELECT s.documento_identidad, s.nombre_servicio, s.disponible::BOOLEAN, s.horario::TIME,
+           s.precio_unitario::DECIMAL(10,2), s.promociones, s.servicios_extra, s.ofertas_personalizadas
+    FROM stg_servicio s
+    WHERE s.motivo IS NULL;
+
+    RETURN QUERY
+    SELECT s.linea, s.motivo
+    FROM stg_servicio s
+    WHERE s.motivo IS NOT NULL
+    ORDER BY s.linea;
+END;
+$$;
+
+
+-- Reportes: solo leen los agregados reporte_* (ver refrescar_reportes en el script principal)
+
+-- Ocupación, ingreso, ADR (ingreso por noche vendida) y RevPAR (ingreso por noche
+-- disponible) por tipo de habitación en [p_desde, p_hasta), por día, por mes o en total.
+-- Las noches disponibles se cuentan con las habitaciones que existen hoy.
+CREATE OR REPLACE FUNCTION reporte_ocupacion(
+    p_desde DATE,
+    p_hasta DATE,
+    p_tipo VARCHAR DEFAULT NULL,
+    p_agrupacion TEXT DEFAULT 'dia'  -- 'dia', 'mes' o 'total'
+)
+RETURNS TABLE (
+    periodo DATE,
+    tipo VARCHAR,
+    habitaciones INT,
+    noches_disponibles BIGINT,
+    noches_ocupadas BIGINT,
+    ocupacion NUMERIC,
+    ingreso NUMERIC,
+    adr NUMERIC,
+    revpar NUMERIC
+)
+LANGUAGE sql STABLE
+AS $$
+    WITH inventario AS (
+        SELECT h.tipo, count(*)::INT AS habitaciones
+        FROM habitacion h
+        WHERE p_tipo IS NULL OR h.tipo = p_tipo
+        GROUP BY h.tipo
+    ), por_dia AS (
+        SELECT d.fecha, i.tipo, i.habitaciones,
+               COALESCE(o.noches, 0) AS noches,
+               COALESCE(o.ingreso, 0) AS ingreso
+        FROM (SELECT p_desde + k AS fecha FROM generate_series(0, p_hasta - p_desde - 1) AS k) d
+        CROSS JOIN inventario i
+        LEFT JOIN reporte_ocupacion_diaria o ON o.fecha = d.fecha AND o.tipo = i.tipo
+    )
+    SELECT CASE p_agrupacion
+               WHEN 'dia' THEN x.fecha
+               WHEN 'mes' THEN date_trunc('month', x.fecha::TIMESTAMP)::DATE
+               ELSE p_desde
+           END AS periodo,
+           x.tipo,
+           max(x.habitaciones),
+           sum(x.habitaciones),
+           sum(x.noches),
+           round(sum(x.noches)::NUMERIC / NULLIF(sum(x.habitaciones), 0), 4),
+           sum(x.ingreso),
+           round(sum(x.ingreso) / NULLIF(sum(x.noches), 0), 2),
+           round(sum(x.ingreso) / NULLIF(sum(x.habitaciones), 0), 2)
+    FROM por_dia x
+    GROUP BY 1, x.tipo
+    ORDER BY 1, x.tipo;
+$$;
+
+-- Pagos por método y tipo de pago con fecha_pago en [p_desde, p_hasta)
+CREATE OR REPLACE FUNCTION reporte_pagos(p_desde DATE, p_hasta DATE)
+RETURNS TABLE (
+    metodo_pago VARCHAR,
+    tipo_pago VARCHAR,
+    pagos BIGINT,
+    monto NUMERIC,
+    reembolsos NUMERIC,
+    porcentaje_monto NUMERIC
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT r.metodo_pago, r.tipo_pago, sum(r.pagos), sum(r.monto), sum(r.reembolsos),
+           round(100 * sum(r.monto) / NULLIF(sum(sum(r.monto)) OVER (), 0), 2)
+    FROM reporte_pagos_diario r
+    WHERE r.fecha >= p_desde AND r.fecha < p_hasta
+    GROUP BY r.metodo_pago, r.tipo_pago
+    ORDER BY sum(r.monto) DESC, r.metodo_pago, r.tipo_pago;
+$$;
+
+-- Cancelaciones por mes de entrada y tipo de habitación
+CREATE OR REPLACE FUNCTION reporte_cancelaciones(
+    p_desde DATE,
+    p_hasta DATE,
+    p_tipo VARCHAR DEFAULT NULL
+)
+RETURNS TABLE (
+    mes DATE,
+    tipo VARCHAR,
+    cancelaciones INT,
+    noches INT,
+    ingreso_perdido NUMERIC
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT c.mes, c.tipo, c.cancelaciones, c.noches, c.ingreso_perdido
+    FROM reporte_cancelaciones_mensual c
+    WHERE c.mes >= date_trunc('month', p_desde::TIMESTAMP)::DATE
+      AND c.mes < p_hasta
+      AND (p_tipo IS NULL OR c.tipo = p_tipo)
+    ORDER BY c.mes, c.tipo;
+$$;
+
+-- Folio de uno o varios clientes (checkout y auditoría nocturna) en una sola consulta:
+-- reservas con su cargo por noches según costos.precio_noche, servicios consumidos,
+-- pagos y saldo. Las reservas canceladas no generan cargo y una reserva con al menos un
+-- pago se considera pagada (registrar_pago la confirma). Cada parte se lee por los
+-- índices de documento_identidad de reserva, servicios y pago, y por idx_pago_id_reserva.
+-- Los documentos que no existen no devuelven fila.
+CREATE OR REPLACE FUNCTION folio_clientes(p_documentos VARCHAR[])
+RETURNS TABLE (
+    documento_identidad VARCHAR,
+    folio JSONB
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT c.documento_identidad,
+           jsonb_build_object(
+               'documento_identidad', c.documento_identidad,
+               'nombre', c.nombre,
+               'reservas', COALESCE(r.reservas, '[]'::JSONB),
+               'servicios', COALESCE(s.servicios, '[]'::JSONB),
+               'pagos', COALESCE(p.pagos, '[]'::JSONB),
+               'cargo_noches', COALESCE(r.cargo, 0),
+               'cargo_servicios', COALESCE(s.cargo, 0),
+               'pagado', COALESCE(r.pagado, 0),
+               'reembolsos', COALESCE(p.reembolsos, 0),
+               'saldo', COALESCE(r.cargo, 0) + COALESCE(s.cargo, 0)
+                        - COALESCE(r.pagado, 0) + COALESCE(p.reembolsos, 0)
+           )
+    FROM cliente c
+    LEFT JOIN LATERAL (
+        SELECT jsonb_agg(jsonb_build_object(
+                   'id_reserva', x.id_reserva,
+                   'id_habitacion', x.id_habitacion,
+                   'numero', x.numero,
+                   'tipo', x.tipo,
+                   'fecha_entrada', x.fecha_entrada,
+                   'fecha_salida', x.fecha_salida,
+                   'estado_reserva', x.estado_reserva,
+                   'noches', x.noches,
+                   'precio_noche', x.precio_noche,
+                   'cargo', x.cargo,
+                   'pagada', x.pagada
+               ) ORDER BY x.id_reserva) AS reservas,
+               sum(x.cargo) AS cargo,
+               sum(x.cargo) FILTER (WHERE x.pagada) AS pagado
+        FROM (
+            SELECT rv.id_reserva, rv.id_habitacion, h.numero, h.tipo,
+                   rv.fecha_entrada, rv.fecha_salida, rv.estado_reserva,
+                   rv.fecha_salida - rv.fecha_entrada AS noches,
+                   co.precio_noche,
+                   CASE WHEN rv.estado_reserva = 'Cancelada' THEN 0
+                        ELSE (rv.fecha_salida - rv.fecha_entrada) * COALESCE(co.precio_noche, 0)
+                   END AS cargo,
+                   EXISTS (SELECT 1 FROM pago pg WHERE pg.id_reserva = rv.id_reserva) AS pagada
+            FROM reserva rv
+            LEFT JOIN habitacion h ON h.id_habitacion = rv.id_habitacion
+            LEFT JOIN costos co ON co.id_costos = h.id_costos
+            WHERE rv.documento_identidad = c.documento_identidad
+        ) x
+    ) r ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT jsonb_agg(to_jsonb(sv) ORDER BY sv.id_servicio) AS servicios,
+               sum(sv.precio) AS cargo
+        FROM servicios sv
+        WHERE sv.documento_identidad = c.documento_identidad
+    ) s ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT jsonb_agg(to_jsonb(pg) ORDER BY pg.id_pago) AS pagos,
+               sum(pg.reembolso) AS reembolsos
+        FROM pago pg
+        WHERE pg.documento_identidad = c.documento_identidad
+    ) p ON TRUE
+    WHERE c.documento_identidad = ANY (p_documentos)
+    ORDER BY c.documento_identidad;
+$$;
@@ -0,0 +1,49 @@
+"""Configuración de logs: una línea JSON por evento, con nivel y muestreo.
+
+Uso en los módulos:
+    log = logging.getLogger(__name__)
+    log.info("reserva creada", extra={"campos": {"id_reserva": 10}})
+"""
+import json
+import logging
+import os
+import random
+import sys
+from datetime import datetime, timezone
+
+# Nivel mínimo (DEBUG, INFO, WARNING, ERROR)
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+# Fracción de los eventos DEBUG e INFO que se escriben (los WARNING y ERROR siempre)
+LOG_MUESTREO = float(os.getenv("LOG_MUESTREO", "1"))
+
+
+class FormatoJSON(logging.Formatter):
+    def format(self, record):
+        evento = {
+            "fecha": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "nivel": record.levelname,
+            "modulo": record.name,
+            "mensaje": record.getMessage(),
+        }
+        evento.update(getattr(record, "campos", {}))
+        if record.exc_info:
+            evento["excepcion"] = self.formatException(record.exc_info)
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+
+class Muestreo(logging.Filter):
+    def __init__(self, fraccion):
+        super().__init__()
+        self.fraccion = fraccion
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.fraccion >= 1 or random.random() < self.fraccion
+
+
+def configurar():
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(FormatoJSON())
+    salida.addFilter(Muestreo(LOG_MUESTREO))
+    raiz = logging.getLogger()
+    raiz.handlers[:] = [salida]
+    raiz.setLevel(LOG_NIVEL)
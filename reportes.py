@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import os
+from datetime import date
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import Optional, Literal
+from conexion_BD import get_db, get_db_lectura, conexion, error_http
+
+log = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Segundos entre refrescos de los agregados de reportes (0 = solo con POST /reportes/actualizacion)
+REPORTES_INTERVALO = float(os.getenv("REPORTES_INTERVALO", "5"))
+# Anotaciones de reporte_pendiente que se toman por llamada a refrescar_reportes
+REPORTES_LOTE = int(os.getenv("REPORTES_LOTE", "1000"))
+
+
+async def actualizar(db):
+    # Recalcula los meses anotados hasta que no quede ninguno
+    total = 0
+    while True:
+        fila = await db.fetchone("SELECT refrescar_reportes(%s) AS meses;", (REPORTES_LOTE,))
+        if not fila["meses"]:
+            return total
+        total += fila["meses"]
+
+
+async def actualizar_periodicamente():
+    while True:
+        await asyncio.sleep(REPORTES_INTERVALO)
+        try:
+            async with conexion() as db:
+                await actualizar(db)
+        except Exception:
+            log.exception("no se pudieron refrescar los reportes")
+
+
+def _validar_rango(desde, hasta):
+    if hasta <= desde:
+        raise HTTPException(status_code=400, detail="La fecha 'hasta' debe ser posterior a 'desde'")
+
+
+# Ocupación por tipo de habitación en [desde, hasta), por día o por mes
+@router.get("/reportes/ocupacion")
+async def reporte_ocupacion(
+    desde: date,
+    hasta: date,
+    tipo: Optional[str] = Query(None),
+    agrupar: Literal["dia", "mes"] = Query("dia"),
+    db=Depends(get_db_lectura)
+):
+    _validar_rango(desde, hasta)
+    try:
+        return await db.fetchall(
+            "SELECT * FROM reporte_ocupacion(%s, %s, %s, %s);", (desde, hasta, tipo, agrupar)
+        )
+    except Exception as e:
+        raise error_http(e)
+
+
+# ADR y RevPAR por tipo de habitación, por mes o para todo el rango
+@router.get("/reportes/ingresos")
+async def reporte_ingresos(
+    desde: date,
+    hasta: date,
+    tipo: Optional[str] = Query(None),
+    agrupar: Literal["mes", "total"] = Query("total"),
+    db=Depends(get_db_lectura)
+):
+    _validar_rango(desde, hasta)
+    try:
+        filas = await db.fetchall(
+            "SELECT * FROM reporte_ocupacion(%s, %s, %s, %s);", (desde, hasta, tipo, agrupar)
+        )
+    except Exception as e:
+        raise error_http(e)
+    campos = ("periodo", "tipo", "noches_ocupadas", "noches_disponibles", "ingreso", "adr", "revpar")
+    return [{c: f[c] for c in campos} for f in filas]
+
+
+# Pagos por método y tipo de pago
+@router.get("/reportes/pagos")
+async def reporte_pagos(desde: date, hasta: date, db=Depends(get_db_lectura)):
+    _validar_rango(desde, hasta)
+    try:
+        return await db.fetchall("SELECT * FROM reporte_pagos(%s, %s);", (desde, hasta))
+    except Exception as e:
+        raise error_http(e)
+
+
+# Cancelaciones por mes de entrada
+@router.get("/reportes/cancelaciones")
+async def reporte_cancelaciones(
+    desde: date,
+    hasta: date,
+    tipo: Optional[str] = Query(None),
+    db=Depends(get_db_lectura)
+):
+    _validar_rango(desde, hasta)
+    try:
+        return await db.fetchall("SELECT * FROM reporte_cancelaciones(%s, %s, %s);", (desde, hasta, tipo))
+    except Exception as e:
+        raise error_http(e)
+
+
+# Refrescar los agregados en el momento en lugar de esperar al siguiente ciclo
+@router.post("/reportes/actualizacion")
+async def actualizar_reportes(db=Depends(get_db)):
+    try:
+        return {"meses_recalculados": await actualizar(db)}
+    except Exception as e:
+        raise error_http(e)
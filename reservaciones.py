@@ -1,10 +1,21 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from conexion_BD import get_connection
+import csv
+import io
+import json
+import logging
+from fastapi import APIRouter, HTTPException, Depends, Response, Request, Header
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, ValidationError
+from conexion_BD import get_db, get_db_lectura, consultar_uno, error_http
+from calendario import calendario
+from cache import cache, leer
+from bitacora import bitacora
+from idempotencia import idempotente
+from paginacion import paginar, respuesta_ndjson, columnas, RespuestaJSON, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
 from datetime import date
-import psycopg2.extras
 from fastapi import Query
-from typing import Optional
+from typing import Optional, Literal, List
+
+log = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -19,54 +30,188 @@ class ReservacionRequest(BaseModel):
     tipo_confirmacion: str
     solicitudes_especial: str = None
 
+# Modelo de respuesta (documentación de la API; las filas se envían sin validar)
+class Reservacion(BaseModel):
+    id_reserva: int
+    numero_huespedes: int
+    solicitudes_especial: Optional[str] = None
+    tipo_reserva: str
+    tipo_confirmacion: str
+    fecha_entrada: date
+    fecha_salida: date
+    id_politicas: Optional[int] = None
+    id_habitacion: Optional[int] = None
+    documento_identidad: Optional[str] = None
 
 
 @router.post("/reservaciones")
-def crear_reservacion(data: ReservacionRequest):
-    conn = get_connection()
-    cur = conn.cursor()
+async def crear_reservacion(
+    data: ReservacionRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
+    db=Depends(get_db)
+):
+    # Con Idempotency-Key un reintento devuelve la misma reserva en lugar de tomar otra habitación
+    async with idempotente(db, "POST /reservaciones", idempotency_key, data) as solicitud:
+        if solicitud.repetida:
+            response.headers["Idempotent-Replayed"] = "true"
+            return solicitud.respuesta
+        try:
+            # Los dos NULL son los parámetros INOUT con la reserva y la habitación asignada
+            fila = await db.fetchone("""
+                CALL crear_reservacion(%s, %s, %s, %s, %s, %s, %s, %s, %s, NULL, NULL)
+            """, (
+                data.numero_huespedes,
+                data.tipo_habitacion,
+                data.id_politicas,
+                data.documento_identidad,
+                data.fecha_entrada,
+                data.fecha_salida,
+                data.tipo_reserva,
+                data.tipo_confirmacion,
+                data.solicitudes_especial
+            ))
+        except Exception as e:
+            log.warning("no se pudo crear la reserva", extra={"campos": {
+                "documento_identidad": data.documento_identidad, "error": str(e),
+            }})
+            raise error_http(e)
+        solicitud.respuesta = {
+            "mensaje": "Reservación creada exitosamente",
+            "id_reserva": fila["p_id_reserva"],
+            "id_habitacion": fila["p_id_habitacion"]
+        }
+    # Ya confirmada la transacción
+    calendario.reserva_creada(fila["p_id_reserva"], fila["p_id_habitacion"], data.fecha_entrada, data.fecha_salida)
+    # Si la estadía ya empezó la habitación pasa a 'ocupada'
+    await cache.invalidar(f"habitacion:{fila['p_id_habitacion']}")
+    await bitacora.registrado()
+    log.info("reserva creada", extra={"campos": {
+        "id_reserva": fila["p_id_reserva"], "id_habitacion": fila["p_id_habitacion"],
+        "documento_identidad": data.documento_identidad,
+        "fecha_entrada": data.fecha_entrada, "fecha_salida": data.fecha_salida,
+    }})
+    return solicitud.respuesta
+
+class LoteRevertido(Exception):
+    pass
+
+
+async def leer_lote(request: Request):
+    # Acepta una lista JSON o un CSV con encabezados (Content-Type: text/csv)
+    cuerpo = await request.body()
+    if request.headers.get("content-type", "").startswith("text/csv"):
+        filas = list(csv.DictReader(io.StringIO(cuerpo.decode("utf-8-sig"))))
+        return [{k: (v if v != "" else None) for k, v in fila.items()} for fila in filas]
+    filas = json.loads(cuerpo)
+    if not isinstance(filas, list):
+        raise ValueError("Se esperaba una lista de reservaciones")
+    return filas
+
+
+# Importación de reservas en lote. Con atomico=true todo el lote va en una sola
+# transacción (si una falla no se crea ninguna); si no, se procesa en grupos de
+# `lote` reservas, cada grupo en su propia transacción.
+@router.post("/reservaciones/lote")
+async def crear_reservaciones_lote(
+    request: Request,
+    lote: int = Query(100, ge=1, le=1000),
+    atomico: bool = Query(False),
+    db=Depends(get_db)
+):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;") 
-        cur.execute("""
-            CALL sch_reservas_hotel.crear_reservacion(%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            data.numero_huespedes,
-            data.tipo_habitacion,
-            data.id_politicas,
-            data.documento_identidad,
-            data.fecha_entrada,
-            data.fecha_salida,
-            data.tipo_reserva,
-            data.tipo_confirmacion,
-            data.solicitudes_especial
-        ))
-        conn.commit()
-        print(f"Reserva creada para {data.documento_identidad} del {data.fecha_entrada} al {data.fecha_salida}")
-        return {"mensaje": "Reservación creada exitosamente"}
+        filas = await leer_lote(request)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"No se pudo leer el lote: {e}")
+
+    resultados = {}
+    reservas = {}
+    for indice, fila in enumerate(filas):
+        try:
+            reservas[indice] = ReservacionRequest(**fila)
+        except (ValidationError, TypeError) as e:
+            resultados[indice] = {"indice": indice, "ok": False, "error": str(e)}
+    validas = [{**jsonable_encoder(r), "indice": i} for i, r in reservas.items()]
+
+    sql = "SELECT * FROM crear_reservaciones_lote(%s::jsonb);"
+    creadas = []
+    try:
+        if atomico:
+            try:
+                async with db.transaccion():
+                    if resultados:
+                        raise LoteRevertido()
+                    creadas = await db.fetchall(sql, (json.dumps(validas),))
+                    if any(c["error"] for c in creadas):
+                        raise LoteRevertido()
+            except LoteRevertido:
+                fallidas = {c["indice"]: c["error"] for c in creadas}
+                creadas = [
+                    {"indice": v["indice"], "reserva_id": None, "habitacion_id": None,
+                     "error": fallidas.get(v["indice"]) or "Revertida porque otra reserva del lote falló"}
+                    for v in validas
+                ]
+        else:
+            for i in range(0, len(validas), lote):
+                creadas += await db.fetchall(sql, (json.dumps(validas[i:i + lote]),))
     except Exception as e:
-        conn.rollback()
-        print("ERROR:", str(e))
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
-
-@router.get("/reservaciones/{id_reserva}")
-def obtener_reservacion(id_reserva: int):
-    conn = get_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        raise error_http(e)
+
+    asignadas = set()
+    for c in creadas:
+        if c["error"] is None:
+            r = reservas[c["indice"]]
+            calendario.reserva_creada(c["reserva_id"], c["habitacion_id"], r.fecha_entrada, r.fecha_salida)
+            asignadas.add(f"habitacion:{c['habitacion_id']}")
+            resultados[c["indice"]] = {
+                "indice": c["indice"], "ok": True,
+                "id_reserva": c["reserva_id"], "id_habitacion": c["habitacion_id"]
+            }
+        else:
+            resultados[c["indice"]] = {"indice": c["indice"], "ok": False, "error": c["error"]}
+    await cache.invalidar(*asignadas)
+
+    exitosas = sum(1 for r in resultados.values() if r["ok"])
+    await bitacora.registrado(exitosas)
+    return {
+        "total": len(filas),
+        "creadas": exitosas,
+        "fallidas": len(filas) - exitosas,
+        "resultados": [resultados[i] for i in sorted(resultados)]
+    }
+
+# Habitaciones libres para un rango de fechas (se declara antes de /reservaciones/{id_reserva}).
+# Va a la primaria y no a una réplica: con ella se decide qué reservar, y una réplica
+# atrasada ofrecería habitaciones que ya se reservaron
+@router.get("/reservaciones/disponibilidad")
+async def consultar_disponibilidad(
+    fecha_entrada: date,
+    fecha_salida: date,
+    tipo: Optional[str] = Query(None),
+    db=Depends(get_db)
+):
+    if fecha_salida <= fecha_entrada:
+        raise HTTPException(status_code=400, detail="La fecha de salida debe ser posterior a la de entrada")
+    try:
+        return await db.fetchall(
+            "SELECT * FROM habitaciones_disponibles(%s, %s, %s);",
+            (tipo, fecha_entrada, fecha_salida)
+        )
+    except Exception as e:
+        raise error_http(e)
+
+@router.get("/reservaciones/{id_reserva}", response_model=Reservacion)
+async def obtener_reservacion(id_reserva: int):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("SELECT * FROM obtener_reservacion(%s);", (id_reserva,))
-        reservacion = cur.fetchone()
-        if not reservacion:
-            raise HTTPException(status_code=404, detail="Reservación no encontrada")
-        return reservacion
+        reservacion = await leer(
+            f"reservacion:{id_reserva}",
+            lambda: consultar_uno("SELECT * FROM obtener_reservacion(%s);", (id_reserva,))
+        )
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
+    if not reservacion:
+        raise HTTPException(status_code=404, detail="Reservación no encontrada")
+    return RespuestaJSON(reservacion)
 
 class ReservacionUpdateRequest(BaseModel):
     fecha_entrada: date
@@ -75,12 +220,9 @@ class ReservacionUpdateRequest(BaseModel):
     solicitudes_especial: str = None
 
 @router.put("/reservaciones/{id_reserva}")
-def actualizar_reservacion(id_reserva: int, data: ReservacionUpdateRequest):
-    conn = get_connection()
-    cur = conn.cursor()
+async def actualizar_reservacion(id_reserva: int, data: ReservacionUpdateRequest, db=Depends(get_db)):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("""
+        await db.execute("""
             CALL actualizar_reservacion(%s, %s, %s, %s, %s);
         """, (
             id_reserva,
@@ -89,51 +231,49 @@ def actualizar_reservacion(id_reserva: int, data: ReservacionUpdateRequest):
             data.numero_huespedes,
             data.solicitudes_especial
         ))
-        conn.commit()
+        await cache.invalidar(f"reservacion:{id_reserva}")
+        await calendario.reserva_actualizada(db, id_reserva)
         return {"mensaje": f"Reservación {id_reserva} actualizada exitosamente"}
     except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
 
 
 @router.delete("/reservaciones/{id_reserva}")
-def cancelar_reservacion(id_reserva: int):
-    conn = get_connection()
-    cur = conn.cursor()
+async def cancelar_reservacion(id_reserva: int, db=Depends(get_db)):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("CALL cancelar_reservacion(%s);", (id_reserva,))
-        conn.commit()
+        fila = await db.fetchone("CALL cancelar_reservacion(%s, NULL);", (id_reserva,))
+        calendario.reserva_cancelada(id_reserva)
+        # La reserva cambia de estado, se borran sus pagos (etiquetados con ella)
+        # y la habitación puede quedar libre
+        await cache.invalidar(f"reservacion:{id_reserva}", f"habitacion:{fila['p_id_habitacion']}")
+        await bitacora.registrado()
         return {"mensaje": f"Reservación {id_reserva} cancelada exitosamente"}
     except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
 
 
-@router.get("/reservaciones")
-def listar_reservaciones(
+# fields=fecha_entrada,fecha_salida devuelve solo esas columnas (más id_reserva)
+@router.get("/reservaciones", response_model=List[Reservacion])
+async def listar_reservaciones(
     documento_identidad: Optional[str] = Query(None),
-    fecha_entrada: Optional[date] = Query(None)
+    fecha_entrada: Optional[date] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    after: Optional[int] = Query(None),
+    formato: Literal["json", "ndjson"] = Query("json"),
+    fields: Optional[str] = Query(None, description="Columnas separadas por comas"),
+    db=Depends(get_db_lectura)
 ):
-    print("Documento:", documento_identidad)
-    print("Fecha:", fecha_entrada)
-    conn = get_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    log.debug("listado de reservaciones", extra={"campos": {
+        "documento_identidad": documento_identidad, "fecha_entrada": fecha_entrada,
+    }})
+    sql = f"""
+            SELECT {columnas(fields, Reservacion, 'id_reserva')} FROM filtrar_reservas(%s, %s, %s, %s);
+        """
+    if formato == "ndjson":
+        return respuesta_ndjson(db, sql, (documento_identidad, fecha_entrada, after, limit))
+    limite = limit or LIMITE_POR_DEFECTO
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("""
-            SELECT * FROM filtrar_reservas(%s, %s);
-        """, (documento_identidad, fecha_entrada))
-        resultados = cur.fetchall()
-        return resultados
+        resultados = await db.fetchall(sql, (documento_identidad, fecha_entrada, after, limite))
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+        raise error_http(e)
+    return paginar(resultados, limite, "id_reserva")
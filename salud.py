@@ -0,0 +1,34 @@
+import os
+from fastapi import APIRouter, HTTPException
+from conexion_BD import conexion, PoolAgotado
+from calendario import calendario
+
+router = APIRouter()
+
+# Lo activa servidor.py al recibir SIGTERM: el proceso deja de declararse listo para
+# que el balanceador deje de enviarle peticiones mientras termina las que tiene
+drenando = False
+
+
+# Vivo: el proceso responde (si deja de hacerlo hay que reiniciarlo)
+@router.get("/salud/vivo")
+async def vivo():
+    return {"estado": "vivo", "pid": os.getpid()}
+
+
+# Listo: puede atender peticiones (no está drenando, el calendario está construido
+# y el pool entrega una conexión que responde)
+@router.get("/salud/listo")
+async def listo():
+    if drenando:
+        raise HTTPException(status_code=503, detail="Drenando peticiones antes de apagarse")
+    if not calendario.listo:
+        raise HTTPException(status_code=503, detail="Calendario de ocupación sin construir")
+    try:
+        async with conexion() as db:
+            await db.fetchone("SELECT 1 AS ok;")
+    except PoolAgotado as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Base de datos no disponible: {e}")
+    return {"estado": "listo", "pid": os.getpid()}
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Request
 from pydantic import BaseModel
-from conexion_BD import get_connection
+from conexion_BD import get_db, get_db_lectura, consultar_uno, error_http
+from cache import cache, leer
+from carga_masiva import recibir, cargar
+from paginacion import paginar, respuesta_ndjson, columnas, RespuestaJSON, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
 from datetime import time
-import psycopg2.extras
-from typing import Optional
+from typing import Optional, Literal, List
 from fastapi import Query
 
 router = APIRouter()
@@ -19,12 +21,9 @@ class ServicioRequest(BaseModel):
     ofertas_personalizadas: str
 
 @router.post("/servicios")
-def crear_servicio(data: ServicioRequest):
-    conn = get_connection()
-    cur = conn.cursor()
+async def crear_servicio(data: ServicioRequest, db=Depends(get_db)):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("""
+        await db.execute("""
             CALL crear_servicio(%s, %s, %s, %s, %s, %s, %s, %s);
         """, (
             data.documento_identidad,
@@ -36,14 +35,19 @@ def crear_servicio(data: ServicioRequest):
             data.servicios_extra,
             data.ofertas_personalizadas
         ))
-        conn.commit()
         return {"mensaje": "Servicio registrado exitosamente"}
     except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
+
+
+# Carga masiva de servicios desde CSV o NDJSON (ver carga_masiva.py)
+@router.post("/servicios/lote")
+async def cargar_servicios(request: Request, formato: Literal["csv", "ndjson"] = Query("csv"), db=Depends(get_db)):
+    try:
+        archivo = await recibir(request)
+        return await cargar(db, "servicios", archivo, formato)
+    except Exception as e:
+        raise error_http(e)
 
 
 class ServicioUpdateRequest(BaseModel):
@@ -54,14 +58,23 @@ class ServicioUpdateRequest(BaseModel):
     servicios_extra: str
     ofertas_personalizadas: str
 
+# Modelo de respuesta (documentación de la API; las filas se envían sin validar)
+class Servicio(BaseModel):
+    id_servicio: int
+    documento_identidad: Optional[str] = None
+    nombre: str
+    disponibilidad: bool
+    horario: Optional[time] = None
+    precio: float
+    promociones: Optional[str] = None
+    servicios_extra: Optional[str] = None
+    ofertas_personalizadas: Optional[str] = None
+
 
 @router.put("/servicios/{id_servicio}")
-def actualizar_servicio(id_servicio: int, data: ServicioUpdateRequest):
-    conn = get_connection()
-    cur = conn.cursor()
+async def actualizar_servicio(id_servicio: int, data: ServicioUpdateRequest, db=Depends(get_db)):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("""
+        await db.execute("""
             CALL actualizar_servicio(%s, %s, %s, %s, %s, %s, %s);
         """, (
             id_servicio,
@@ -72,59 +85,49 @@ def actualizar_servicio(id_servicio: int, data: ServicioUpdateRequest):
             data.servicios_extra,
             data.ofertas_personalizadas
         ))
-        conn.commit()
+        await cache.invalidar(f"servicio:{id_servicio}")
         return {"mensaje": f"Servicio {id_servicio} actualizado exitosamente"}
     except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
 
 @router.delete("/servicios/{id_servicio}")
-def eliminar_servicio(id_servicio: int):
-    conn = get_connection()
-    cur = conn.cursor()
+async def eliminar_servicio(id_servicio: int, db=Depends(get_db)):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("CALL eliminar_servicio(%s);", (id_servicio,))
-        conn.commit()
+        await db.execute("CALL eliminar_servicio(%s);", (id_servicio,))
+        await cache.invalidar(f"servicio:{id_servicio}")
         return {"mensaje": f"Servicio {id_servicio} eliminado exitosamente"}
     except Exception as e:
-        conn.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
 
-@router.get("/servicios/{id_servicio}")
-def obtener_servicio(id_servicio: int):
-    conn = get_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+@router.get("/servicios/{id_servicio}", response_model=Servicio)
+async def obtener_servicio(id_servicio: int):
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("SELECT * FROM obtener_servicio(%s);", (id_servicio,))
-        servicio = cur.fetchone()
-        if not servicio:
-            raise HTTPException(status_code=404, detail="Servicio no encontrado")
-        return servicio
+        servicio = await leer(
+            f"servicio:{id_servicio}",
+            lambda: consultar_uno("SELECT * FROM obtener_servicio(%s);", (id_servicio,))
+        )
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
+        raise error_http(e)
+    if not servicio:
+        raise HTTPException(status_code=404, detail="Servicio no encontrado")
+    return RespuestaJSON(servicio)
 
-@router.get("/servicios")
-def listar_servicios(disponible: Optional[bool] = Query(None)):
-    conn = get_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+# fields=nombre,precio devuelve solo esas columnas (más id_servicio)
+@router.get("/servicios", response_model=List[Servicio])
+async def listar_servicios(
+    disponible: Optional[bool] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    after: Optional[int] = Query(None),
+    formato: Literal["json", "ndjson"] = Query("json"),
+    fields: Optional[str] = Query(None, description="Columnas separadas por comas"),
+    db=Depends(get_db_lectura)
+):
+    sql = f"SELECT {columnas(fields, Servicio, 'id_servicio')} FROM filtrar_servicios(%s, %s, %s);"
+    if formato == "ndjson":
+        return respuesta_ndjson(db, sql, (disponible, after, limit))
+    limite = limit or LIMITE_POR_DEFECTO
     try:
-        cur.execute("SET search_path TO sch_reservas_hotel;")
-        cur.execute("SELECT * FROM filtrar_servicios(%s);", (disponible,))
-        servicios = cur.fetchall()
-        return servicios
+        servicios = await db.fetchall(sql, (disponible, after, limite))
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+        raise error_http(e)
+    return paginar(servicios, limite, "id_servicio")
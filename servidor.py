@@ -0,0 +1,220 @@
+"""Arranque de la API con varios procesos.
+
+Uso:
+    python -m servidor --trabajadores 4 --puerto 8000 --conexiones-totales 80
+
+Un proceso supervisor abre el socket y levanta `--trabajadores` procesos de uvicorn
+(por defecto uno por núcleo) que lo comparten. Cada trabajador abre su propio pool en
+el lifespan de menu_API.py; con --conexiones-totales el máximo de conexiones que admite
+la base de datos se reparte entre ellos (DB_POOL_MAX por proceso).
+
+- Precarga: la aplicación se importa una vez en el supervisor y los trabajadores la
+  heredan al crearse (solo donde existe fork); reiniciar un trabajador es inmediato.
+- SIGTERM: los trabajadores dejan de declararse listos (GET /salud/listo responde 503),
+  siguen atendiendo --espera-drenado segundos para que el balanceador los saque, dejan
+  de aceptar conexiones y esperan hasta --gracia segundos a las peticiones en curso.
+- Reciclaje: con --max-peticiones cada trabajador termina tras ese número de peticiones
+  (más un extra aleatorio de hasta --variacion, para que no se reinicien todos a la vez)
+  y el supervisor levanta otro en su lugar.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+import registro
+
+log = logging.getLogger("servidor")
+
+
+class Servidor(uvicorn.Server):
+    # uvicorn.Server que, antes de dejar de aceptar conexiones, pasa un tiempo
+    # respondiendo 503 en /salud/listo
+    def __init__(self, config, espera_drenado):
+        super().__init__(config)
+        self.espera_drenado = espera_drenado
+        self.drenando_desde = None
+
+    def handle_exit(self, sig, frame):
+        # Se importa aquí: salud importa conexion_BD, que lee DB_POOL_MAX al importarse
+        import salud
+        if salud.drenando:
+            # Segunda señal: apagar sin esperar más
+            super().handle_exit(sig, frame)
+            return
+        salud.drenando = True
+        self.drenando_desde = time.monotonic()
+        log.info("drenando", extra={"campos": {"pid": os.getpid(), "senal": sig}})
+
+    async def on_tick(self, counter):
+        if self.drenando_desde is not None and time.monotonic() - self.drenando_desde >= self.espera_drenado:
+            return True
+        return await super().on_tick(counter)
+
+
+def _trabajador(sock, app, opciones):
+    # Ctrl+C en la terminal llega solo al supervisor, que decide cuándo detener a cada uno
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    maximo = opciones["max_peticiones"]
+    config = uvicorn.Config(
+        app,
+        lifespan="on",
+        log_config=None,    # los logs van por registro.py (JSON)
+        access_log=False,   # cada petición ya se registra en metricas.MedirPeticiones
+        timeout_keep_alive=opciones["keep_alive"],
+        timeout_graceful_shutdown=opciones["gracia"],
+        limit_max_requests=maximo + random.randint(0, opciones["variacion"]) if maximo else None,
+    )
+    servidor = Servidor(config, opciones["espera_drenado"])
+    servidor.run(sockets=[sock])
+    if not servidor.started:
+        # Falló el arranque (lifespan): el supervisor lo relanza con espera, no como reciclaje
+        sys.exit(3)
+
+
+def dimensionar_pool(trabajadores, conexiones_totales):
+    # Antes de importar conexion_BD: cada proceso toma su parte de las conexiones
+    if not conexiones_totales:
+        return
+    maximo = max(conexiones_totales // trabajadores, 1)
+    os.environ["DB_POOL_MAX"] = str(maximo)
+    os.environ["DB_POOL_MIN"] = str(min(int(os.getenv("DB_POOL_MIN", "2")), maximo))
+
+
+class Supervisor:
+    def __init__(self, sock, app, trabajadores, opciones, contexto):
+        self.sock = sock
+        self.app = app
+        self.trabajadores = trabajadores
+        self.opciones = opciones
+        self.contexto = contexto
+        self.procesos = {}      # número de trabajador -> proceso
+        self.reintentar = {}    # número de trabajador -> cuándo volver a levantarlo tras un fallo
+        self.deteniendo = False
+        self.reinicios = 0
+
+    def iniciar(self, numero):
+        proceso = self.contexto.Process(
+            target=_trabajador,
+            args=(self.sock, self.app, self.opciones),
+            name=f"trabajador-{numero}",
+        )
+        proceso.start()
+        self.procesos[numero] = proceso
+        log.info("trabajador iniciado", extra={"campos": {"trabajador": numero, "pid": proceso.pid}})
+
+    def detener(self, sig, frame):
+        if self.deteniendo:
+            # Segunda señal: terminar a todos ya
+            for proceso in self.procesos.values():
+                proceso.kill()
+            return
+        self.deteniendo = True
+
+    def ejecutar(self):
+        signal.signal(signal.SIGTERM, self.detener)
+        signal.signal(signal.SIGINT, self.detener)
+        for numero in range(self.trabajadores):
+            self.iniciar(numero)
+
+        while not self.deteniendo:
+            time.sleep(0.5)
+            for numero, proceso in list(self.procesos.items()):
+                if proceso.is_alive() or self.deteniendo:
+                    continue
+                if numero not in self.reintentar:
+                    if proceso.exitcode == 0:
+                        log.info("trabajador reciclado", extra={"campos": {"trabajador": numero, "pid": proceso.pid}})
+                        self.reintentar[numero] = 0
+                    else:
+                        # Un trabajador que falla al arrancar (p. ej. sin base de datos) no
+                        # se relanza en un ciclo cerrado
+                        log.warning("trabajador terminó con error", extra={"campos": {
+                            "trabajador": numero, "pid": proceso.pid, "codigo": proceso.exitcode,
+                        }})
+                        self.reintentar[numero] = time.monotonic() + 1
+                if time.monotonic() >= self.reintentar[numero]:
+                    del self.reintentar[numero]
+                    self.reinicios += 1
+                    self.iniciar(numero)
+
+        self.apagar()
+
+    def apagar(self):
+        log.info("apagando trabajadores", extra={"campos": {"trabajadores": len(self.procesos)}})
+        for proceso in self.procesos.values():
+            if proceso.is_alive():
+                proceso.terminate()
+        limite = time.monotonic() + self.opciones["espera_drenado"] + self.opciones["gracia"] + 10
+        for proceso in self.procesos.values():
+            proceso.join(max(limite - time.monotonic(), 0))
+            if proceso.is_alive():
+                log.warning("trabajador sin terminar; se mata", extra={"campos": {"pid": proceso.pid}})
+                proceso.kill()
+                proceso.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("SERVIDOR_HOST", "0.0.0.0"))
+    parser.add_argument("--puerto", type=int, default=int(os.getenv("SERVIDOR_PUERTO", "8000")))
+    parser.add_argument("--trabajadores", type=int, default=int(os.getenv("SERVIDOR_TRABAJADORES", "0")),
+                        help="procesos de la API (0 = uno por núcleo)")
+    parser.add_argument("--conexiones-totales", type=int, default=int(os.getenv("SERVIDOR_CONEXIONES_TOTALES", "0")),
+                        help="conexiones a repartir entre los procesos (0 = DB_POOL_MAX en cada uno)")
+    parser.add_argument("--sin-precarga", action="store_true", help="cada trabajador importa la aplicación")
+    parser.add_argument("--max-peticiones", type=int, default=int(os.getenv("SERVIDOR_MAX_PETICIONES", "0")),
+                        help="peticiones tras las cuales se recicla un trabajador (0 = nunca)")
+    parser.add_argument("--variacion", type=int, default=int(os.getenv("SERVIDOR_VARIACION", "0")))
+    parser.add_argument("--espera-drenado", type=float, default=float(os.getenv("SERVIDOR_ESPERA_DRENADO", "5")),
+                        help="segundos respondiendo 503 en /salud/listo antes de dejar de aceptar conexiones")
+    parser.add_argument("--gracia", type=int, default=int(os.getenv("SERVIDOR_GRACIA", "30")),
+                        help="segundos máximos para terminar las peticiones en curso")
+    parser.add_argument("--keep-alive", type=int, default=int(os.getenv("SERVIDOR_KEEP_ALIVE", "5")))
+    args = parser.parse_args()
+
+    registro.configurar()
+    trabajadores = args.trabajadores or os.cpu_count() or 1
+    dimensionar_pool(trabajadores, args.conexiones_totales)
+
+    metodos = multiprocessing.get_all_start_methods()
+    precarga = not args.sin_precarga and "fork" in metodos
+    contexto = multiprocessing.get_context("fork" if precarga else "spawn")
+    if precarga:
+        from menu_API import app
+    else:
+        app = "menu_API:app"
+
+    sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.puerto))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    log.info("servidor iniciado", extra={"campos": {
+        "host": args.host, "puerto": args.puerto, "trabajadores": trabajadores, "precarga": precarga,
+        "pool_max": os.getenv("DB_POOL_MAX", "10"), "max_peticiones": args.max_peticiones,
+    }})
+    opciones = {
+        "max_peticiones": args.max_peticiones,
+        "variacion": args.variacion,
+        "espera_drenado": args.espera_drenado,
+        "gracia": args.gracia,
+        "keep_alive": args.keep_alive,
+    }
+    try:
+        Supervisor(sock, app, trabajadores, opciones, contexto).ejecutar()
+    finally:
+        sock.close()
+
+
+if __name__ == "__main__":
+    main()
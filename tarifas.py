@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import os
+from array import array
+from datetime import date, timedelta
+from itertools import accumulate
+from conexion_BD import conexion
+from calendario import CAPACIDAD_POR_TIPO
+
+log = logging.getLogger(__name__)
+
+# Noches hacia adelante con tarifa precalculada; fuera de ese rango se calcula noche a noche
+TARIFAS_DIAS = int(os.getenv("TARIFAS_DIAS", "730"))
+# Cada cuántos segundos se reconstruye desde la base de datos (0 = nunca). Recoge los
+# cambios de tarifa_temporada y tarifa_promocion; los precios cambiados en otros
+# procesos llegan antes por los avisos de notificar_habitacion (notificaciones.py)
+TARIFAS_REFRESCO = float(os.getenv("TARIFAS_REFRESCO", "300"))
+
+
+class TablaTarifas:
+    # Las temporadas multiplican el precio_noche de cada habitación, así que por tipo de
+    # habitación basta guardar las sumas acumuladas del factor de cada noche:
+    # acumulado[j] - acumulado[i] es la suma de los factores de las noches inicio + i
+    # hasta inicio + j - 1, y el total de cualquier estadía sale de dos lecturas del
+    # array sin recorrer sus noches. Los precios no entran en los arrays: cambiar el de
+    # una habitación solo actualiza `precios` y el precio base de su tipo.
+    def __init__(self, dias):
+        self.dias = dias
+        self.inicio = None
+        self.acumulado = {}    # tipo -> array("d") de dias + 1 sumas
+        self.precios = {}      # id_habitacion -> (tipo, precio_noche)
+        self.base = {}         # tipo -> menor precio_noche de sus habitaciones
+        self.temporadas = []
+        self.promociones = []
+        self.construido = None
+        self._bloqueo = None
+
+    @property
+    def listo(self):
+        return self.inicio is not None
+
+    @property
+    def bloqueo(self):
+        # Igual que en el calendario: los cambios de otros procesos esperan a la reconstrucción
+        if self._bloqueo is None:
+            self._bloqueo = asyncio.Lock()
+        return self._bloqueo
+
+    async def construir(self, db):
+        async with self.bloqueo:
+            await self._construir(db)
+
+    async def _construir(self, db):
+        habitaciones = await db.fetchall("SELECT * FROM filtrar_habitaciones(NULL, NULL, NULL);")
+        temporadas = await db.fetchall("SELECT * FROM tarifa_temporada;")
+        promociones = await db.fetchall("SELECT * FROM tarifa_promocion;")
+        self.cargar(date.today(), habitaciones, temporadas, promociones)
+
+    def cargar(self, inicio, habitaciones, temporadas, promociones):
+        # Se arma en una tabla nueva y se reemplaza de una sola vez
+        nueva = TablaTarifas(self.dias)
+        nueva.inicio = inicio
+        nueva.temporadas = [{
+            "tipo": t["tipo"],
+            "desde": t["desde"],
+            "hasta": t["hasta"],
+            "dias_semana": set(t["dias_semana"] or ()),
+            "factor": float(t["factor"]),
+        } for t in temporadas]
+        nueva.promociones = [{
+            "nombre": p["nombre"],
+            "codigo": p["codigo"],
+            "tipo": p["tipo"],
+            "desde": p["desde"],
+            "hasta": p["hasta"],
+            "noches_minimas": p["noches_minimas"],
+            "descuento": float(p["descuento"]) / 100,
+        } for p in promociones]
+        for h in habitaciones:
+            nueva.precios[h["id_habitacion"]] = (h["tipo"], float(h["precio_noche"]))
+        for tipo in set(CAPACIDAD_POR_TIPO) | {t for t, _ in nueva.precios.values()}:
+            nueva._calcular(tipo)
+            nueva._calcular_base(tipo)
+
+        self.inicio = nueva.inicio
+        self.temporadas = nueva.temporadas
+        self.promociones = nueva.promociones
+        self.precios = nueva.precios
+        self.base = nueva.base
+        self.acumulado = nueva.acumulado
+        self.construido = date.today()
+
+    def _calcular(self, tipo):
+        factores = array("d", [1.0]) * self.dias
+        for t in self.temporadas:
+            if t["tipo"] is not None and t["tipo"] != tipo:
+                continue
+            i = max((t["desde"] - self.inicio).days, 0)
+            j = min((t["hasta"] - self.inicio).days, self.dias)
+            for k in range(i, j):
+                if not t["dias_semana"] or (self.inicio + timedelta(days=k)).isoweekday() in t["dias_semana"]:
+                    factores[k] *= t["factor"]
+        self.acumulado[tipo] = array("d", accumulate(factores, initial=0.0))
+
+    def _calcular_base(self, tipo):
+        precios = [p for t, p in self.precios.values() if t == tipo]
+        if precios:
+            self.base[tipo] = min(precios)
+        else:
+            self.base.pop(tipo, None)
+
+    def _factor(self, tipo, noche):
+        factor = 1.0
+        for t in self.temporadas:
+            if (t["tipo"] is None or t["tipo"] == tipo) and t["desde"] <= noche < t["hasta"] \
+                    and (not t["dias_semana"] or noche.isoweekday() in t["dias_semana"]):
+                factor *= t["factor"]
+        return factor
+
+    def _suma(self, tipo, entrada, salida):
+        # Suma de los factores de las noches en [entrada, salida)
+        i = (entrada - self.inicio).days
+        j = (salida - self.inicio).days
+        acumulado = self.acumulado.get(tipo)
+        if acumulado is not None and i >= 0 and j <= self.dias:
+            return acumulado[j] - acumulado[i]
+        return sum(self._factor(tipo, entrada + timedelta(days=k)) for k in range(j - i))
+
+    # Cambios que informan las rutas de habitaciones
+
+    def habitacion_actualizada(self, id_habitacion, tipo, precio_noche):
+        if not self.listo:
+            return
+        anterior = self.precios.get(id_habitacion)
+        self.precios[id_habitacion] = (tipo, float(precio_noche))
+        if tipo not in self.acumulado:
+            self._calcular(tipo)
+        self._calcular_base(tipo)
+        if anterior and anterior[0] != tipo:
+            self._calcular_base(anterior[0])
+
+    def habitacion_eliminada(self, id_habitacion):
+        anterior = self.precios.pop(id_habitacion, None)
+        if anterior:
+            self._calcular_base(anterior[0])
+
+    async def recargar_habitaciones(self, db):
+        # crear_habitacion no devuelve el id; se vuelven a leer los precios
+        if not self.listo:
+            return
+        for h in await db.fetchall("SELECT * FROM filtrar_habitaciones(NULL, NULL, NULL);"):
+            self.habitacion_actualizada(h["id_habitacion"], h["tipo"], h["precio_noche"])
+
+    # Consultas
+
+    def cotizar(self, fecha_entrada, fecha_salida, tipo, precio, codigo=None, id_habitacion=None):
+        noches = (fecha_salida - fecha_entrada).days
+        subtotal = precio * self._suma(tipo, fecha_entrada, fecha_salida)
+        descuento, promocion = 0.0, None
+        for p in self.promociones:
+            if (p["tipo"] is not None and p["tipo"] != tipo) or noches < p["noches_minimas"]:
+                continue
+            if p["codigo"] is not None and p["codigo"] != codigo:
+                continue
+            desde, hasta = max(fecha_entrada, p["desde"]), min(fecha_salida, p["hasta"])
+            if desde >= hasta:
+                continue
+            monto = precio * p["descuento"] * self._suma(tipo, desde, hasta)
+            if monto > descuento:
+                descuento, promocion = monto, p["nombre"]
+        total = round(subtotal - descuento, 2)
+        return {
+            "tipo": tipo,
+            "id_habitacion": id_habitacion,
+            "fecha_entrada": fecha_entrada,
+            "fecha_salida": fecha_salida,
+            "noches": noches,
+            "precio_noche": precio,
+            "subtotal": round(subtotal, 2),
+            "promocion": promocion,
+            "descuento": round(descuento, 2),
+            "total": total,
+            "promedio_noche": round(total / noches, 2),
+        }
+
+    def cotizar_habitacion(self, id_habitacion, fecha_entrada, fecha_salida, codigo=None):
+        habitacion = self.precios.get(id_habitacion)
+        if habitacion is None:
+            return None
+        tipo, precio = habitacion
+        return self.cotizar(fecha_entrada, fecha_salida, tipo, precio, codigo, id_habitacion)
+
+    def cotizar_tipos(self, fecha_entrada, fecha_salida, tipo=None, codigo=None):
+        # Precio desde: el de la habitación más barata de cada tipo
+        return [
+            self.cotizar(fecha_entrada, fecha_salida, t, precio, codigo)
+            for t, precio in sorted(self.base.items())
+            if tipo is None or t == tipo
+        ]
+
+
+tarifas = TablaTarifas(TARIFAS_DIAS)
+
+
+async def refrescar_periodicamente():
+    # Reconstruye la tabla de tarifas cada TARIFAS_REFRESCO segundos
+    while True:
+        await asyncio.sleep(TARIFAS_REFRESCO)
+        try:
+            async with conexion() as db:
+                await tarifas.construir(db)
+        except Exception:
+            log.exception("no se pudo refrescar la tabla de tarifas")